@@ -3,14 +3,92 @@ PDF Download Server
 
 Endpoints:
 - POST /download
-  Payload: {"url": "https://example.com/file.pdf", "filename": "optional_name.pdf", "timeout": 30}
+  Payload: {"url": "https://example.com/file.pdf", "filename": "optional_name.pdf", "timeout": 30,
+            "hedge": false, "hedge_delay": 3, "stream": false, "force": false}
   Returns: application/pdf file streamed as attachment.
+- GET /download?url=...&filename=...&timeout=30
+  Same as POST /download without the hedge/stream options, so plain clients (curl -C -, browsers)
+  can resume and revalidate.
+- POST /download/doi
+  Payload: {"doi": "10.1007/s00134-020-06294-x", "url": "optional landing page", "filename": ..., "timeout": 30}
+  Tries the publisher-direct PDF URLs for the DOI (src/server/doi_resolver.py; extend with DOI_RULES)
+  in order, then the landing page ("url", or https://doi.org/<doi>). Returns the first valid PDF with
+  ``X-Resolved-Url`` and ``X-Doi-Rule`` headers.
+- POST /jobs
+  Payload: {"urls": ["https://example.com/a.pdf", ...]} or {"items": [{"url": ..., "filename": ...}]},
+           optional "timeout" (seconds, per URL)
+  Returns: {"job_id": ..., "total": N}. Jobs are persisted in SQLite and drained by JOB_WORKERS workers.
+- GET /jobs/{job_id}?offset=0&limit=1000&status=failed
+  Returns: per-status counts and per-URL status (attempts, error, size, strategy).
+- GET /jobs/{job_id}/items/{idx}
+  Returns: the downloaded PDF of one finished item.
+- GET /jobs/{job_id}/zip
+  Returns: all finished items as a streamed ZIP archive.
+- DELETE /jobs/{job_id}
+  Removes the job and its files.
+- GET /metrics
+  Returns: Prometheus text format: per-strategy attempts (success, failure, error, cancelled, or
+  unavailable when e.g. aria2c is not installed) and latency histograms, bytes downloaded
+  and served, validation failures by reason, queue depth, browser pool utilisation, cache hit ratio.
+- GET /stats
+  Returns: JSON counters (coalesced downloads, cache size, browser pool usage).
+
+PDF responses carry ``X-Download-Strategy`` (aria2c, direct_http, playwright, stream or cache);
+src/server/bench.py uses it to report latency per strategy against a local fake origin.
 
 Behavior:
 1. Try to download with aria2c (if available) with the given timeout.
-2. If aria2c not available or fails, try a direct requests HTTP stream download.
+2. If aria2c not available or fails, try a direct HTTP stream download.
 3. If direct request fails, run the project's Playwright downloader script (src/post_process/download_with_playwrite.py).
 4. All attempts enforce the provided timeout (seconds). If no response within timeout, move to next method.
+5. Optional hedged mode ("hedge": true, or HEDGE_ENABLED): the next method starts after "hedge_delay"
+   seconds without waiting for the previous one (0 races all of them); the first valid PDF wins and
+   the other attempts are cancelled.
+6. Optional stream-through mode ("stream": true): direct HTTP and then aria2c are tried first with the
+   body piped to the client as it arrives, once the first bytes sniff as %PDF. The same bytes are
+   written to disk and committed to the cache when the transfer completes and validates. If neither
+   source yields a PDF header the normal chain runs and the finished file is returned.
+
+Strategy routing (src/server/host_stats.py): per host, the strategy that last produced a valid
+PDF is tried first, so paywalled publishers go straight to Playwright. URLs that failed every
+strategy, and hosts where HOST_FAILURE_THRESHOLD URLs in a row did, are answered with 502 +
+Retry-After for NEGATIVE_CACHE_TTL seconds without another attempt ("force": true bypasses this).
+
+Admission control (src/server/admission.py): upstream fetches are limited globally
+(MAX_CONCURRENT_DOWNLOADS) and per host (MAX_DOWNLOADS_PER_HOST). Interactive /download calls
+have priority over /jobs workers and INTERACTIVE_RESERVED_SLOTS that batch work cannot use; when
+MAX_QUEUED_REQUESTS interactive requests are already waiting, or a request waits longer than
+QUEUE_TIMEOUT, the server answers 429 with a Retry-After header.
+
+With ARIA2_RPC on, aria2c downloads go to one long-lived aria2c over JSON-RPC
+(src/utils/aria2_rpc.py) under global ARIA2_MAX_CONCURRENT / ARIA2_MAX_DOWNLOAD_LIMIT limits;
+ARIA2_RPC_URL attaches to a daemon shared with src/post_process/download_with_aria2.py.
+
+The handler is asyncio-native: aria2c and the Playwright script run as awaitable subprocesses
+and the direct HTTP step uses one long-lived httpx.AsyncClient with per-origin keep-alive pools.
+A single uvicorn worker can therefore hold many in-flight downloads instead of pinning one
+threadpool worker per request. Timeouts are hard: subprocesses run in their own process group
+and the whole tree (Chromium included) is killed on timeout or cancellation, and a pooled
+browser whose lease timed out is killed and relaunched in the background.
+Pool sizes are configurable in the ``download_server`` section of config.yaml (see src/server/settings.py).
+
+Validated PDFs are kept in a persistent on-disk cache (src/server/pdf_cache.py) keyed by the
+normalized URL, with LRU eviction inside CACHE_MAX_BYTES. A cache hit skips the whole strategy
+chain; entries that carry an ETag/Last-Modified are revalidated with a conditional GET once
+they are older than CACHE_REVALIDATE_AFTER seconds. Responses carry ``X-Cache: HIT|MISS``.
+
+Concurrent requests for the same (normalized) URL are coalesced: the first one runs the
+strategy chain and the others wait for and receive the same validated file. Coalescing
+counters are reported by GET /stats.
+
+The Playwright fallback leases a fresh, isolated context from a warm pool of long-lived
+Chromium instances (src/server/browser_pool.py) instead of launching a browser per request.
+Browsers are health-checked and recycled after BROWSER_MAX_USES leases or when their RSS
+exceeds BROWSER_MAX_RSS_MB; requests wait up to BROWSER_ACQUIRE_TIMEOUT for a free browser.
+
+Files the server already holds (cache hits, finished downloads, job items) are served with a
+strong ETag and Last-Modified (src/server/file_response.py): Range requests get 206 and
+If-None-Match / If-Modified-Since get 304, without contacting the origin.
 
 Auto API docs: /docs (Swagger UI) and /redoc
 
@@ -19,69 +97,306 @@ Example:
     -d '{"url":"http://example.com/a.pdf"}' --output a.pdf
 
 Requirements:
-  pip install fastapi uvicorn requests
+  pip install fastapi uvicorn httpx
 
 """
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, Response
 from pydantic import BaseModel, HttpUrl
-from fastapi.responses import FileResponse
-from typing import Optional
-import subprocess
+from fastapi.responses import StreamingResponse, JSONResponse
+from typing import List
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Callable, Optional
+import asyncio
+import functools
+import math
+import time
 import shutil
 import tempfile
 import os
 import sys
-import requests
+import httpx
 import logging
 from pathlib import Path
-import concurrent.futures
-import io
+
+from src.server import settings
+from src.server.pdf_cache import PdfCache, CacheEntry, cache_key
+from src.server.singleflight import SingleFlight
+from src.server.browser_pool import BrowserPool, BrowserPoolTimeout
+from src.server.streaming import StreamingDownload, file_size, open_for_follow
+from src.server.jobs import JobStore, JobRunner, iter_zip
+from src.server.admission import AdmissionController, AdmissionRejected, BATCH, INTERACTIVE
+from src.server.metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from src.server.host_stats import StrategyRouter
+from src.server.file_response import PdfFileResponse
+from src.server.doi_resolver import DoiResolver
+from src.utils.proc_utils import kill_process_tree, new_group_kwargs, run_killable
+from src.utils.aria2_rpc import Aria2Daemon
+from src.utils.content_sniffer import ContentMismatch, PdfSniffer
+from src.utils.pdf_validator import pdf_rejection_reason
 
 logger = logging.getLogger("download_server")
 logging.basicConfig(level=logging.INFO)
 
-app = FastAPI(title="PDF Download Service", description="Download PDF via aria2 or Playwright fallback", version="1.0")
+DEFAULT_HEADERS = {
+    "User-Agent": settings.USER_AGENT,
+    "Accept": "application/pdf,*/*;q=0.9",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+
+_http_client: Optional[httpx.AsyncClient] = None
+_cache: Optional[PdfCache] = None
+_flights = SingleFlight()
+_browser_pool: Optional[BrowserPool] = None
+_jobs: Optional[JobStore] = None
+_aria2: Optional[Aria2Daemon] = None
+# ── METRICS ───────────────────────────────────────────────────────────────
+HTTP_REQUESTS = REGISTRY.counter("pdfdl_http_requests_total", "HTTP requests handled",
+                                 ("method", "route", "status"))
+HTTP_LATENCY = REGISTRY.histogram("pdfdl_http_request_duration_seconds", "HTTP request latency",
+                                  ("method", "route"))
+STRATEGY_ATTEMPTS = REGISTRY.counter("pdfdl_strategy_attempts_total", "Download strategy attempts by result",
+                                     ("strategy", "result"))
+STRATEGY_LATENCY = REGISTRY.histogram("pdfdl_strategy_duration_seconds", "Download strategy latency",
+                                      ("strategy",))
+BYTES_DOWNLOADED = REGISTRY.counter("pdfdl_downloaded_bytes_total", "Validated bytes fetched from upstream",
+                                    ("strategy",))
+BYTES_SERVED = REGISTRY.counter("pdfdl_served_bytes_total", "PDF bytes sent to clients", ("source",))
+VALIDATION_FAILURES = REGISTRY.counter("pdfdl_validation_failures_total", "Downloaded files rejected as non-PDF",
+                                       ("reason",))
+CACHE_LOOKUPS = REGISTRY.counter("pdfdl_cache_lookups_total", "PDF cache lookups", ("result",))
+CACHE_HIT_RATIO = REGISTRY.gauge("pdfdl_cache_hit_ratio", "Cache hits / lookups since start")
+COALESCED = REGISTRY.counter("pdfdl_singleflight_requests_total", "Single-flight leaders and coalesced waiters",
+                             ("role",))
+QUEUE_DEPTH = REGISTRY.gauge("pdfdl_queue_depth", "Requests waiting for a download slot, and queued job items",
+                             ("queue",))
+ACTIVE_DOWNLOADS = REGISTRY.gauge("pdfdl_active_downloads", "Upstream downloads holding a slot", ("lane",))
+ADMISSION_REJECTED = REGISTRY.counter("pdfdl_admission_rejected_total", "Requests rejected with 429")
+NEGATIVE_CACHE = REGISTRY.gauge("pdfdl_negative_cache_entries", "URLs and hosts currently failing fast",
+                                ("kind",))
+FAST_FAILURES = REGISTRY.counter("pdfdl_negative_cache_hits_total", "Requests answered from the negative cache")
+BROWSER_POOL = REGISTRY.gauge("pdfdl_browser_pool", "Browser pool size, busy browsers, waiters and recycles",
+                              ("state",))
+
+_admission = AdmissionController(
+    max_concurrent=settings.MAX_CONCURRENT_DOWNLOADS,
+    per_host=settings.MAX_DOWNLOADS_PER_HOST,
+    max_queue=settings.MAX_QUEUED_REQUESTS,
+    queue_timeout=settings.QUEUE_TIMEOUT,
+    reserved=settings.INTERACTIVE_RESERVED_SLOTS,
+    retry_after=settings.RETRY_AFTER,
+)
+_job_runner: Optional[JobRunner] = None
+_doi_resolver = DoiResolver.with_config(settings.DOI_RULES)
+_router = StrategyRouter(
+    negative_ttl=settings.NEGATIVE_CACHE_TTL,
+    host_failure_threshold=settings.HOST_FAILURE_THRESHOLD,
+    adaptive=settings.ADAPTIVE_STRATEGY_ORDER,
+)
+
+
+def _build_http_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=settings.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+    )
+    return httpx.AsyncClient(limits=limits, headers=DEFAULT_HEADERS, follow_redirects=True)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the shared upstream client, creating it lazily outside the app lifespan."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = _build_http_client()
+    return _http_client
+
+
+def get_cache() -> Optional[PdfCache]:
+    """Return the shared PDF cache, or None when CACHE_MAX_BYTES is 0."""
+    global _cache
+    if _cache is None and settings.CACHE_MAX_BYTES > 0:
+        _cache = PdfCache(settings.CACHE_DIR, settings.CACHE_MAX_BYTES,
+                          revalidate_after=settings.CACHE_REVALIDATE_AFTER,
+                          evict_grace=settings.CACHE_EVICT_GRACE)
+    return _cache
+
+
+async def _start_browser_pool() -> Optional[BrowserPool]:
+    if settings.BROWSER_POOL_SIZE <= 0:
+        return None
+    pool = BrowserPool(size=settings.BROWSER_POOL_SIZE, max_uses=settings.BROWSER_MAX_USES,
+                       max_rss_mb=settings.BROWSER_MAX_RSS_MB, acquire_timeout=settings.BROWSER_ACQUIRE_TIMEOUT,
+                       health_interval=settings.BROWSER_HEALTH_INTERVAL)
+    try:
+        await pool.start()
+    except Exception as e:
+        # playwright or chromium missing: keep the per-request fallback
+        logger.warning("Browser pool unavailable, using per-request Playwright: %s", e)
+        await pool.stop()
+        return None
+    return pool
+
+
+async def _start_aria2() -> Optional[Aria2Daemon]:
+    if not settings.ARIA2_RPC:
+        return None
+    daemon = Aria2Daemon(url=settings.ARIA2_RPC_URL, secret=settings.ARIA2_RPC_SECRET,
+                         max_concurrent=settings.ARIA2_MAX_CONCURRENT,
+                         max_download_limit=settings.ARIA2_MAX_DOWNLOAD_LIMIT)
+    try:
+        await daemon.start()
+    except Exception as e:
+        # aria2c missing or the daemon unreachable: keep forking aria2c per download
+        logger.warning("aria2 RPC daemon unavailable, using aria2c per download: %s", e)
+        await daemon.stop()
+        return None
+    return daemon
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _http_client, _browser_pool, _jobs, _job_runner, _aria2
+    get_http_client()
+    get_cache()
+    _browser_pool = await _start_browser_pool()
+    _aria2 = await _start_aria2()
+    if settings.JOB_WORKERS > 0:
+        _jobs = JobStore(settings.JOBS_DB, settings.JOBS_DIR)
+        # a retry inside the negative-cache TTL would be failed fast without another attempt
+        _job_runner = JobRunner(_jobs, _download_to, workers=settings.JOB_WORKERS,
+                                max_attempts=settings.JOB_MAX_ATTEMPTS, lease_for=_chain_budget,
+                                retry_delay=settings.NEGATIVE_CACHE_TTL)
+        _job_runner.start()
+    try:
+        yield
+    finally:
+        if _job_runner is not None:
+            await _job_runner.stop()
+            _job_runner = None
+        if _browser_pool is not None:
+            await _browser_pool.stop()
+            _browser_pool = None
+        if _aria2 is not None:
+            await _aria2.stop()
+            _aria2 = None
+        if _http_client is not None:
+            await _http_client.aclose()
+            _http_client = None
+
+
+app = FastAPI(title="PDF Download Service", description="Download PDF via aria2 or Playwright fallback",
+              version="1.1", lifespan=lifespan)
+
+
+def _register_gauges():
+    def cache_ratio():
+        total = CACHE_LOOKUPS.total()
+        return CACHE_LOOKUPS.value(result="hit") / total if total else 0.0
+
+    def queue_depth():
+        depth = {"interactive": _admission.queued(INTERACTIVE), "batch": _admission.queued(BATCH)}
+        if _jobs is not None:
+            depth["jobs"] = _jobs.pending_count()
+        return depth
+
+    def browser_pool():
+        if _browser_pool is None:
+            return {}
+        stats = _browser_pool.stats()
+        return {"size": stats["size"], "busy": stats["busy"], "waiting": stats["waiting"],
+                "recycled": stats["recycled"]}
+
+    CACHE_HIT_RATIO.set_function(cache_ratio)
+    COALESCED.set_function(lambda: {"leader": _flights.leaders, "coalesced": _flights.coalesced})
+    QUEUE_DEPTH.set_function(queue_depth)
+    ACTIVE_DOWNLOADS.set_function(lambda: dict(_admission.active_by_lane))
+    ADMISSION_REJECTED.set_function(lambda: _admission.rejected)
+    BROWSER_POOL.set_function(browser_pool)
+
+    def negative_cache():
+        stats = _router.stats()
+        return {"url": stats["negative_urls"], "host": stats["negative_hosts"]}
+
+    NEGATIVE_CACHE.set_function(negative_cache)
+    FAST_FAILURES.set_function(lambda: _router.fast_failures)
+
+
+_register_gauges()
+
+
+@app.middleware("http")
+async def _observe_requests(request: Request, call_next):
+    start = time.monotonic()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # label by route template, not raw path, to keep job ids out of the label set
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        HTTP_REQUESTS.inc(method=request.method, route=route, status=status)
+        HTTP_LATENCY.observe(time.monotonic() - start, method=request.method, route=route)
+
+
+async def _counting(chunks, source: str):
+    async for chunk in chunks:
+        BYTES_SERVED.inc(len(chunk), source=source)
+        yield chunk
+
+
+@app.exception_handler(AdmissionRejected)
+async def _admission_rejected(request, exc: AdmissionRejected):
+    return JSONResponse(status_code=429, content={"detail": f"Server busy: {exc}"},
+                        headers={"Retry-After": str(exc.retry_after)})
+
+
+class DoiDownloadRequest(BaseModel):
+    doi: str
+    url: Optional[HttpUrl] = None  # landing page, tried last instead of https://doi.org/<doi>
+    filename: Optional[str] = None
+    timeout: Optional[int] = 30  # seconds, per candidate URL
+    force: bool = False
+
+
+class JobItem(BaseModel):
+    url: HttpUrl
+    filename: Optional[str] = None
+
+
+class JobRequest(BaseModel):
+    urls: List[HttpUrl] = []
+    items: List[JobItem] = []
+    timeout: Optional[int] = 30  # seconds, per URL
+
 
 class DownloadRequest(BaseModel):
     url: HttpUrl
     filename: Optional[str] = None
     timeout: Optional[int] = 30  # seconds
+    hedge: Optional[bool] = None  # default: HEDGE_ENABLED
+    hedge_delay: Optional[float] = None  # seconds; default: HEDGE_DELAY, 0 = race all strategies
+    stream: bool = False  # pipe bytes to the client while the download is in progress
+    force: bool = False  # retry even if the URL or its host failed recently
 
 
-def is_valid_pdf(path: str) -> bool:
-    try:
-        with open(path, "rb") as f:
-            head = f.read(5)
-        return head.startswith(b"%PDF-")
-    except Exception:
+def validate_downloaded_pdf(path: str, expected_size: Optional[int] = None) -> bool:
+    """Return True if file at path appears to be a complete PDF (src/utils/pdf_validator.py).
+    Reject HTML/error bodies saved as .pdf, truncated files and Content-Length mismatches."""
+    reason = pdf_rejection_reason(path, expected_size)
+    if reason is not None:
+        VALIDATION_FAILURES.inc(reason=reason)
         return False
+    return True
 
 
-def validate_downloaded_pdf(path: str) -> bool:
-    """Return True if file at path appears to be a valid PDF. Reject HTML/error bodies saved as .pdf."""
-    try:
-        if not os.path.exists(path):
-            return False
-        size = os.path.getsize(path)
-        if size == 0:
-            return False
-        with open(path, "rb") as f:
-            head = f.read(8)
-        # valid PDF starts with %PDF
-        if head.startswith(b"%PDF"):
-            return True
-        # not a PDF: inspect as text for common server error markers
-        try:
-            with open(path, "r", encoding="utf-8", errors="ignore") as f:
-                txt = f.read(1024).lower()
-            for marker in ("internal server error", "<html", "404 not found", "403 forbidden", "error"):
-                if marker in txt:
-                    return False
-        except Exception:
-            pass
-        return False
-    except Exception:
-        return False
+def _expected_length(response: httpx.Response) -> Optional[int]:
+    """Content-Length of an identity-encoded response (httpx decodes gzip/br bodies)."""
+    length = response.headers.get("content-length")
+    if length and length.isdigit() and not response.headers.get("content-encoding"):
+        return int(length)
+    return None
 
 
 def _cleanup_dir(path: str):
@@ -92,136 +407,804 @@ def _cleanup_dir(path: str):
         logger.warning("Failed to cleanup temp dir %s: %s", path, e)
 
 
-@app.post("/download", response_class=FileResponse, responses={502: {"description": "Download failed"}})
-def download_file(req: DownloadRequest, background_tasks: BackgroundTasks):
-    tmpdir = tempfile.mkdtemp(prefix="pdfdl_")
-    out_name = req.filename or Path(req.url.path).name or "download.pdf"
-    save_path = os.path.join(tmpdir, out_name)
-    ok = False
+def _remove_quietly(path: str):
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+    except Exception:
+        pass
+
+
+def _instrumented(name: str, available: Optional[Callable[[], bool]] = None):
+    """Record attempts, latency and downloaded bytes of a strategy or stream source.
+    The wrapped coroutine's second argument is the save path (or a StreamingDownload).
+    While available() is false the attempt is skipped and counted as result="unavailable",
+    without a latency sample."""
+    def deco(fn):
+        @functools.wraps(fn)
+        async def wrapper(url, target, *args, **kwargs):
+            if available is not None and not available():
+                STRATEGY_ATTEMPTS.inc(strategy=name, result="unavailable")
+                return False
+            start = time.monotonic()
+            result = "error"
+            try:
+                ok = await fn(url, target, *args, **kwargs)
+                result = "success" if ok else "failure"
+                if ok:
+                    BYTES_DOWNLOADED.inc(file_size(getattr(target, "path", target)), strategy=name)
+                return ok
+            except asyncio.CancelledError:
+                result = "cancelled"
+                raise
+            finally:
+                STRATEGY_ATTEMPTS.inc(strategy=name, result=result)
+                STRATEGY_LATENCY.observe(time.monotonic() - start, strategy=name)
+        return wrapper
+    return deco
+
+
+# ── STRATEGIES ────────────────────────────────────────────────────────────
+# Each strategy writes to save_path and returns True only for a validated PDF.
+# ``meta`` collects response validators (etag, last_modified) when a strategy sees them.
+
+_ARIA2_OPTIONS = {"max-tries": 1, "check-certificate": True}
+# single connection, no preallocation: aria2c then appends sequentially and the file can be tailed
+_ARIA2_STREAM_OPTIONS = {**_ARIA2_OPTIONS, "file-allocation": "none", "split": 1,
+                         "max-connection-per-server": 1, "allow-overwrite": True}
+
+
+def _aria2_cmd(aria2_bin: str, url: str, save_path: str, options: dict) -> list:
+    return [aria2_bin, "--dir", os.path.dirname(save_path), "--out", os.path.basename(save_path),
+            *(f"--{k}={str(v).lower() if isinstance(v, bool) else v}" for k, v in options.items()), url]
 
-    # 1) Try aria2c if installed
+
+def _aria2_available() -> bool:
+    return _aria2 is not None or shutil.which("aria2c") is not None
+
+
+@_instrumented("aria2c", _aria2_available)
+async def _try_aria2(url: str, save_path: str, timeout: float, meta: dict) -> bool:
     aria2_bin = shutil.which("aria2c")
-    if aria2_bin:
-        cmd = [aria2_bin, "--dir", tmpdir, "--out", out_name, "--max-tries=1", "--check-certificate=true", str(req.url)]
-        logger.info("Attempting aria2c: %s", " ".join(map(str, cmd)))
-        try:
-            subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=req.timeout)
-            if os.path.exists(save_path) and validate_downloaded_pdf(save_path):
-                ok = True
-                logger.info("aria2c succeeded: %s", save_path)
-            else:
-                # remove invalid file to avoid returning HTML/error blobs
-                if os.path.exists(save_path):
-                    try:
-                        os.remove(save_path)
-                    except Exception:
-                        pass
-        except subprocess.TimeoutExpired:
-            logger.warning("aria2c timed out for URL: %s", str(req.url))
-        except Exception as e:
-            logger.warning("aria2c error: %s", e)
+    try:
+        if _aria2 is not None:
+            logger.info("Attempting aria2c via RPC: %s", url)
+            status = await _aria2.download(url, os.path.dirname(save_path), os.path.basename(save_path),
+                                           timeout, _ARIA2_OPTIONS)
+            expected = int(status.get("totalLength") or 0) or None
+            if status.get("status") != "complete":
+                logger.warning("aria2c failed for URL: %s (%s)", url,
+                               status.get("errorMessage") or status.get("status"))
+        else:
+            expected = None
+            cmd = _aria2_cmd(aria2_bin, url, save_path, _ARIA2_OPTIONS)
+            logger.info("Attempting aria2c: %s", " ".join(map(str, cmd)))
+            await run_killable(cmd, timeout)
+        if os.path.exists(save_path) and validate_downloaded_pdf(save_path, expected):
+            logger.info("aria2c succeeded: %s", save_path)
+            return True
+        # remove invalid file to avoid returning HTML/error blobs
+        _remove_quietly(save_path)
+    except asyncio.TimeoutError:
+        logger.warning("aria2c timed out for URL: %s", url)
+    except Exception as e:
+        logger.warning("aria2c error: %s", e)
+    return False
+
+
+@_instrumented("direct_http")
+async def _try_direct_http(url: str, save_path: str, timeout: float, meta: dict) -> bool:
+    logger.info("Attempting direct HTTP download for %s", url)
+    tmp_path = str(Path(save_path).with_suffix(Path(save_path).suffix + ".partial"))
+    client = get_http_client()
+
+    async def _fetch() -> tuple[str, str, Optional[int]]:
+        async with client.stream("GET", url, timeout=timeout) as r:
+            r.raise_for_status()
+            ctype = (r.headers.get("content-type") or "").lower()
+            disp = r.headers.get("content-disposition") or ""
+            meta["etag"] = r.headers.get("etag")
+            meta["last_modified"] = r.headers.get("last-modified")
+            expected = _expected_length(r)
+            sniffer = PdfSniffer(ctype)
+            with open(tmp_path, "wb") as f:
+                async for chunk in r.aiter_bytes(settings.HTTP_CHUNK_SIZE):
+                    f.write(sniffer.feed(chunk))
+                f.write(sniffer.finish())
+        return ctype, disp, expected
+
+    try:
+        # httpx timeouts are per network operation; wait_for bounds the whole transfer
+        ctype, disp, expected = await asyncio.wait_for(_fetch(), timeout=timeout)
+        os.replace(tmp_path, save_path)
+        if validate_downloaded_pdf(save_path, expected):
+            logger.info("Direct HTTP download succeeded: %s (content-type=%s, content-disposition=%s)",
+                        save_path, ctype, disp)
+            return True
+        logger.warning("Downloaded file is not a valid PDF (direct HTTP): %s", save_path)
+        _remove_quietly(save_path)
+    except ContentMismatch as e:
+        # aborted after the first bytes instead of storing the whole page
+        logger.warning("Direct HTTP body is not a PDF (%s), aborted: %s", e, url)
+        VALIDATION_FAILURES.inc(reason=e.reason)
+    except (asyncio.TimeoutError, httpx.TimeoutException):
+        logger.warning("Direct HTTP download timed out for URL: %s", url)
+    except Exception as e:
+        logger.warning("Direct HTTP download failed: %s", e)
+    finally:
+        _remove_quietly(tmp_path)
+    return False
+
 
-    # 2) Try direct HTTP streaming using requests
-    if not ok:
-        logger.info("Attempting direct HTTP download for %s", req.url)
+@_instrumented("playwright_pool")
+async def _try_playwright_pool(url: str, save_path: str, timeout: float, meta: dict) -> bool:
+    from src.post_process.download_with_playwrite import browser_context_options, download_in_context
+    pool = _browser_pool
+
+    timeout_ms = int(timeout * 1000)
+    # two attempts, each in a fresh isolated context (mirrors download_with_playwright's retry)
+    for attempt in (1, 2):
         try:
-            with requests.get(str(req.url), stream=True, timeout=req.timeout, allow_redirects=True) as r:
-                r.raise_for_status()
-                # quick header check: prefer content-type application/pdf
-                ctype = (r.headers.get("content-type") or "").lower()
-                disp = r.headers.get("content-disposition") or ""
-                tmp_path = str(Path(save_path).with_suffix(Path(save_path).suffix + ".partial"))
-                with open(tmp_path, "wb") as f:
-                    for chunk in r.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                os.replace(tmp_path, save_path)
-
-            if validate_downloaded_pdf(save_path):
-                ok = True
-                logger.info("Direct HTTP download succeeded: %s (content-type=%s, content-disposition=%s)", save_path, ctype, disp)
-            else:
-                logger.warning("Downloaded file is not a valid PDF (direct HTTP): %s", save_path)
-                try:
-                    os.remove(save_path)
-                except Exception:
-                    pass
-        except requests.exceptions.Timeout:
-            logger.warning("Direct HTTP download timed out for URL: %s", req.url)
+            async with pool.context(**browser_context_options()) as ctx:
+                res = await asyncio.wait_for(download_in_context(ctx, url, save_path, timeout_ms),
+                                             timeout=timeout + 5)
+            if res and validate_downloaded_pdf(save_path):
+                logger.info("Playwright pool succeeded (attempt %d): %s", attempt, save_path)
+                return True
+            _remove_quietly(save_path)
+        except BrowserPoolTimeout as e:
+            logger.warning("Playwright pool busy for URL %s: %s", url, e)
+            return False
+        except asyncio.TimeoutError:
+            logger.warning("Playwright pool attempt %d timed out for URL: %s", attempt, url)
+            _remove_quietly(save_path)
+            return False
         except Exception as e:
-            logger.warning("Direct HTTP download failed: %s", e)
+            logger.warning("Playwright pool attempt %d error: %s", attempt, e)
+            _remove_quietly(save_path)
+    logger.warning("Playwright pool produced no valid file for %s", url)
+    return False
 
-    # 3) Fallback: use project's Playwright downloader script
-    if not ok:
-        logger.info("Attempting Playwright fallback for %s", req.url)
-        # Prefer importing the project's function to avoid extra process overhead.
-        try:
-            from src.post_process.download_with_playwrite import download_with_playwright
-        except Exception:
-            download_with_playwright = None
 
-        timeout_ms = int(req.timeout * 1000)
-        if download_with_playwright:
+async def _try_playwright(url: str, save_path: str, timeout: float, meta: dict) -> bool:
+    logger.info("Attempting Playwright fallback for %s", url)
+    if _browser_pool is not None:
+        return await _try_playwright_pool(url, save_path, timeout, meta)
+    # Without the pool the sync script runs in its own process group: a thread running sync
+    # Playwright cannot be stopped, a process tree (Chromium included) can be killed.
+    return await _try_playwright_subprocess(url, save_path, timeout, meta)
+
+
+@_instrumented("playwright_subprocess")
+async def _try_playwright_subprocess(url: str, save_path: str, timeout: float, meta: dict) -> bool:
+    timeout_ms = int(timeout * 1000)
+    script_path = os.path.join(os.path.dirname(__file__), "post_process", "download_with_playwrite.py")
+    if not os.path.exists(script_path):
+        logger.warning("Playwright downloader not available; skipped")
+        return False
+    cmd = [sys.executable, script_path, url, save_path, "--timeout", str(timeout_ms)]
+    logger.info("Running Playwright script subprocess: %s", " ".join(map(str, cmd)))
+    try:
+        rc, stdout, stderr = await run_killable(cmd, timeout + 5)
+        logger.debug("Playwright subprocess stdout: %s", stdout.decode(errors="ignore"))
+        if rc == 0 and os.path.exists(save_path) and validate_downloaded_pdf(save_path):
+            logger.info("Playwright subprocess succeeded: %s", save_path)
+            return True
+        logger.warning("Playwright subprocess failed (rc=%s): %s", rc, stderr.decode(errors="ignore"))
+        _remove_quietly(save_path)
+    except asyncio.TimeoutError:
+        logger.warning("Playwright subprocess timed out for URL: %s", url)
+    except Exception as e:
+        logger.warning("Playwright subprocess invocation error: %s", e)
+    return False
+
+
+STRATEGIES = [
+    ("aria2c", _try_aria2),
+    ("direct_http", _try_direct_http),
+    ("playwright", _try_playwright),
+]
+
+
+def _strategy_order(url: str, exclude: frozenset = frozenset()) -> list:
+    return [(name, strategy) for name, strategy in _router.order(url, STRATEGIES) if name not in exclude]
+
+
+def _chain_budget(timeout: float) -> float:
+    """Worst-case seconds of one run_strategies() call: aria2c and direct HTTP, then the
+    Playwright fallback (a browser acquire plus two attempts), and a minute to commit the file.
+    Admission waits come on top; job leases are renewed while an item runs."""
+    return 2 * timeout + 2 * (timeout + 5) + settings.BROWSER_ACQUIRE_TIMEOUT + 60
+
+
+async def run_strategies(url: str, save_path: str, timeout: float, meta: dict,
+                         hedge_delay: Optional[float] = None, exclude: frozenset = frozenset()) -> Optional[str]:
+    """Try each strategy in order (the host's last winner first), skipping the names in
+    ``exclude``; return the name of the one that produced save_path. With hedge_delay set,
+    strategies overlap instead (see run_strategies_hedged)."""
+    if hedge_delay is not None:
+        return await run_strategies_hedged(url, save_path, timeout, meta, hedge_delay, exclude)
+    for name, strategy in _strategy_order(url, exclude):
+        meta.clear()
+        if await strategy(url, save_path, timeout, meta):
+            return name
+    return None
+
+
+async def run_strategies_hedged(url: str, save_path: str, timeout: float, meta: dict,
+                                delay: float, exclude: frozenset = frozenset()) -> Optional[str]:
+    """Start the next strategy ``delay`` seconds after the previous one (immediately when
+    the previous one fails; delay=0 races them all). The first validated PDF wins, the
+    remaining attempts are cancelled and every attempt's partial files are removed."""
+    loop = asyncio.get_running_loop()
+    base_dir = os.path.dirname(save_path)
+    out_name = os.path.basename(save_path)
+    queue = _strategy_order(url, exclude)
+    pending: dict[asyncio.Task, tuple[str, str, dict]] = {}
+    attempt_dirs = []
+    winner = None
+    next_launch = loop.time()
+    try:
+        while winner is None and (queue or pending):
+            if queue and (not pending or loop.time() >= next_launch):
+                name, strategy = queue.pop(0)
+                # each attempt writes into its own dir so racing strategies never share a file
+                attempt_dir = os.path.join(base_dir, f".{name}")
+                os.makedirs(attempt_dir, exist_ok=True)
+                attempt_dirs.append(attempt_dir)
+                attempt_path = os.path.join(attempt_dir, out_name)
+                attempt_meta = {}
+                task = asyncio.create_task(strategy(url, attempt_path, timeout, attempt_meta))
+                pending[task] = (name, attempt_path, attempt_meta)
+                next_launch = loop.time() + delay
+                continue
+            wait_timeout = max(0.0, next_launch - loop.time()) if queue else None
+            done, _ = await asyncio.wait(pending, timeout=wait_timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                name, attempt_path, attempt_meta = pending.pop(task)
+                if winner is None and not task.cancelled() and task.exception() is None and task.result():
+                    winner = (name, attempt_path, attempt_meta)
+                    logger.info("Hedged download won by %s for %s", name, url)
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        if winner is not None:
+            os.replace(winner[1], save_path)
+        for attempt_dir in attempt_dirs:
+            _cleanup_dir(attempt_dir)
+
+    if winner is None:
+        return None
+    meta.clear()
+    meta.update(winner[2])
+    return winner[0]
+
+
+# ── STREAM-THROUGH SOURCES ────────────────────────────────────────────────
+# A stream source writes into live.path, reports progress with live.advance() and
+# returns True only for a validated PDF. It stops as soon as the sniff rejects the body.
+
+@_instrumented("stream_direct_http")
+async def _stream_direct_http(url: str, live: StreamingDownload, timeout: float, meta: dict) -> bool:
+    logger.info("Attempting streamed direct HTTP download for %s", url)
+    client = get_http_client()
+    try:
+        # timeout applies per read, so large files may take as long as they keep flowing
+        async with client.stream("GET", url, timeout=timeout) as r:
+            r.raise_for_status()
+            meta["etag"] = r.headers.get("etag")
+            meta["last_modified"] = r.headers.get("last-modified")
+            live.content_length = _expected_length(r)
+            sniffer = PdfSniffer(r.headers.get("content-type"))
+            with open(live.path, "wb") as f:
+                async for chunk in r.aiter_bytes(settings.HTTP_CHUNK_SIZE):
+                    data = sniffer.feed(chunk)
+                    if not data:
+                        continue
+                    f.write(data)
+                    f.flush()
+                    live.advance(len(data))
+                    if live.rejected:
+                        return False
+                tail = sniffer.finish()
+                if tail:
+                    f.write(tail)
+                    f.flush()
+                    live.advance(len(tail))
+    except ContentMismatch as e:
+        logger.warning("Streamed direct HTTP body is not a PDF (%s), aborted: %s", e, url)
+        VALIDATION_FAILURES.inc(reason=e.reason)
+        return False
+    except Exception as e:
+        logger.warning("Streamed direct HTTP download failed: %s: %s", type(e).__name__, e)
+        return False
+    return validate_downloaded_pdf(live.path, live.content_length)
+
+
+@_instrumented("stream_aria2c", _aria2_available)
+async def _stream_aria2(url: str, live: StreamingDownload, timeout: float, meta: dict) -> bool:
+    aria2_bin = shutil.which("aria2c")
+    options = {**_ARIA2_STREAM_OPTIONS, "timeout": int(timeout)}
+    proc = None
+    if _aria2 is not None:
+        logger.info("Attempting streamed aria2c via RPC: %s", url)
+        finished = asyncio.create_task(
+            _aria2.download(url, os.path.dirname(live.path), os.path.basename(live.path), None, options))
+    else:
+        cmd = _aria2_cmd(aria2_bin, url, live.path, options)
+        logger.info("Attempting streamed aria2c: %s", " ".join(map(str, cmd)))
+        proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.DEVNULL,
+                                                    stderr=asyncio.subprocess.DEVNULL, **new_group_kwargs())
+        finished = asyncio.create_task(proc.wait())
+    loop = asyncio.get_running_loop()
+    last_progress = loop.time()
+    try:
+        while True:
+            size = file_size(live.path)
+            if size > live.written:
+                live.advance(size - live.written)
+                last_progress = loop.time()
+            if live.rejected:
+                return False
+            if finished.done():
+                break
+            if loop.time() - last_progress > timeout:
+                logger.warning("Streamed aria2c stalled for URL: %s", url)
+                return False
+            await asyncio.wait({finished}, timeout=0.1)
+    finally:
+        if not finished.done():
+            # cancelling the RPC wait removes the download from aria2
+            finished.cancel()
+            if proc is not None:
+                kill_process_tree(proc.pid)
             try:
-                # Run the blocking function in a thread and enforce timeout
-                with concurrent.futures.ThreadPoolExecutor(max_workers=1) as ex:
-                    fut = ex.submit(download_with_playwright, str(req.url), save_path, timeout_ms)
-                    try:
-                        res = fut.result(timeout=(req.timeout + 5))
-                        if res and validate_downloaded_pdf(save_path):
-                            ok = True
-                            logger.info("Playwright function succeeded: %s", save_path)
-                        else:
-                            logger.warning("Playwright function returned False or produced invalid file for %s", req.url)
-                            try:
-                                if os.path.exists(save_path):
-                                    os.remove(save_path)
-                            except Exception:
-                                pass
-                    except concurrent.futures.TimeoutError:
-                        logger.warning("Playwright function timed out for URL: %s", req.url)
-                        try:
-                            fut.cancel()
-                        except Exception:
-                            pass
-            except Exception as e:
-                logger.warning("Playwright function invocation error: %s", e)
-        else:
-            # Last resort: try to spawn the script if present (keeps prior behavior)
-            script_path = os.path.join(os.path.dirname(__file__), "post_process", "download_with_playwrite.py")
-            if os.path.exists(script_path):
-                cmd = [sys.executable, script_path, str(req.url), save_path, "--timeout", str(timeout_ms)]
-                logger.info("Running Playwright script subprocess: %s", " ".join(map(str, cmd)))
+                await finished
+            except (asyncio.CancelledError, Exception):
+                pass
+            if proc is not None:
+                await proc.wait()
+    size = file_size(live.path)
+    if size > live.written:
+        live.advance(size - live.written)
+    if finished.exception() is not None:
+        logger.warning("Streamed aria2c error: %s", finished.exception())
+        return False
+    if proc is not None:
+        ok = proc.returncode == 0
+    else:
+        ok = finished.result().get("status") == "complete"
+    return ok and validate_downloaded_pdf(live.path)
+
+
+STREAM_SOURCES = [
+    ("direct_http", _stream_direct_http),
+    ("aria2c", _stream_aria2),
+]
+
+_live_streams: dict[str, StreamingDownload] = {}
+
+
+async def _revalidate(cache: PdfCache, entry: CacheEntry) -> bool:
+    """Return True if the cached entry may be served (fresh, unchanged, or origin unreachable)."""
+    if not cache.needs_revalidation(entry):
+        return True
+    headers = {}
+    if entry.etag:
+        headers["If-None-Match"] = entry.etag
+    if entry.last_modified:
+        headers["If-Modified-Since"] = entry.last_modified
+    try:
+        async with get_http_client().stream("GET", entry.url, headers=headers, timeout=10) as r:
+            unchanged = r.status_code == 304 or (
+                r.status_code == 200 and entry.etag is not None and r.headers.get("etag") == entry.etag
+            )
+    except Exception as e:
+        # serve stale rather than fail when the origin is unreachable
+        logger.info("Cache revalidation failed for %s, serving cached copy: %s", entry.url, e)
+        return True
+    if unchanged:
+        await asyncio.to_thread(cache.mark_validated, entry)
+        return True
+    logger.info("Cache entry changed upstream, refetching: %s", entry.url)
+    return False
+
+
+@dataclass
+class FetchResult:
+    path: str
+    strategy: str
+    tmpdir: Optional[str] = None  # set when the file lives outside the cache and must be cleaned up
+
+
+def _new_download_dir() -> str:
+    cache = get_cache()
+    return cache.new_staging_dir() if cache else tempfile.mkdtemp(prefix="pdfdl_")
+
+
+def _host_of(url: str) -> str:
+    return httpx.URL(url).host or ""
+
+
+async def _fetch_pdf(url: str, out_name: str, timeout: float, hedge_delay: Optional[float] = None,
+                     lane: str = INTERACTIVE, host_streak: bool = True) -> Optional[FetchResult]:
+    """Run the strategy chain once, inside an admission slot, and commit the result to the cache.
+    With host_streak=False a failure is not counted against the URL's host (see StrategyRouter)."""
+    async with _admission.slot(_host_of(url), lane):
+        tmpdir = _new_download_dir()
+        save_path = os.path.join(tmpdir, out_name)
+        meta = {}
+
+        try:
+            strategy = await run_strategies(url, save_path, timeout, meta, hedge_delay)
+        except BaseException:
+            _cleanup_dir(tmpdir)
+            raise
+    return await _commit_result(url, tmpdir, save_path, strategy, meta, host_streak)
+
+
+async def _fetch_pdf_streaming(url: str, out_name: str, timeout: float, hedge_delay: Optional[float],
+                               announce: asyncio.Future, lane: str = INTERACTIVE) -> Optional[FetchResult]:
+    """Like _fetch_pdf, but first try the stream sources. As soon as one of them has sniffed
+    a PDF header the StreamingDownload is published through ``announce`` so the caller can
+    start responding; otherwise ``announce`` gets None and the normal chain runs."""
+    key = cache_key(url)
+    tmpdir = _new_download_dir()
+    save_path = os.path.join(tmpdir, out_name)
+    meta = {}
+    strategy = None
+    try:
+        # skip the stream sources for hosts where only the browser has worked lately
+        preferred = _router.preferred(url)
+        sources = [] if preferred and preferred not in dict(STREAM_SOURCES) else _router.order(url, STREAM_SOURCES)
+        async with _admission.slot(_host_of(url), lane):
+            for name, source in sources:
+                meta.clear()
+                live = StreamingDownload(save_path)
+                task = asyncio.create_task(source(url, live, timeout, meta))
                 try:
-                    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=req.timeout + 5)
-                    logger.debug("Playwright subprocess stdout: %s", proc.stdout)
-                    if proc.returncode == 0 and os.path.exists(save_path) and validate_downloaded_pdf(save_path):
-                        ok = True
-                        logger.info("Playwright subprocess succeeded: %s", save_path)
-                    else:
-                        logger.warning("Playwright subprocess failed (rc=%s): %s", proc.returncode, proc.stderr)
-                        try:
-                            if os.path.exists(save_path):
-                                os.remove(save_path)
-                        except Exception:
-                            pass
-                except subprocess.TimeoutExpired:
-                    logger.warning("Playwright subprocess timed out for URL: %s", req.url)
-                except Exception as e:
-                    logger.warning("Playwright subprocess invocation error: %s", e)
-            else:
-                logger.warning("Playwright downloader not available; skipped")
-
-    if not ok:
-        # cleanup immediately
+                    await asyncio.wait([task, live.ready], return_when=asyncio.FIRST_COMPLETED)
+                    if live.ready.done() and live.ready.result():
+                        _live_streams[key] = live
+                        if not announce.done():
+                            announce.set_result(live)
+                    ok = await task
+                except BaseException:
+                    task.cancel()
+                    live.finish(False)
+                    raise
+                finally:
+                    _live_streams.pop(key, None)
+                live.finish(ok)
+                if ok:
+                    strategy = name
+                    break
+                _remove_quietly(save_path)
+            if not strategy:
+                if not announce.done():
+                    announce.set_result(None)
+                # the stream sources already were the direct HTTP and aria2c attempts
+                tried = frozenset(name for name, _ in sources)
+                strategy = await run_strategies(url, save_path, timeout, meta, hedge_delay, tried)
+    except BaseException:
+        if not announce.done():
+            announce.set_result(None)
+        _cleanup_dir(tmpdir)
+        raise
+    return await _commit_result(url, tmpdir, save_path, strategy, meta)
+
+
+async def _commit_result(url: str, tmpdir: str, save_path: str, strategy: Optional[str],
+                         meta: dict, host_streak: bool = True) -> Optional[FetchResult]:
+    if not strategy:
+        _router.record_failure(url, host_streak)
         _cleanup_dir(tmpdir)
+        return None
+    _router.record_success(url, strategy)
+
+    cache = get_cache()
+    if cache:
+        try:
+            entry = await asyncio.to_thread(cache.put, url, save_path, meta.get("etag"), meta.get("last_modified"))
+        except Exception as e:
+            logger.warning("Cache store failed for %s: %s", url, e)
+            entry = None
+        if entry:
+            _cleanup_dir(tmpdir)
+            return FetchResult(entry.path, strategy)
+    return FetchResult(save_path, strategy, tmpdir)
+
+
+def _release_fetch(result: Optional[FetchResult]):
+    if result and result.tmpdir:
+        _cleanup_dir(result.tmpdir)
+
+
+def _recently_failed(url: str) -> Optional[int]:
+    """Seconds until url may be retried when it (or its host) is in the negative cache."""
+    remaining = _router.blocked(url)
+    if remaining is None:
+        return None
+    logger.info("Negative cache hit, failing fast: %s", url)
+    return max(1, math.ceil(remaining))
+
+
+def _link_or_copy(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+# a client resuming or revalidating its copy is served from the cache without asking the origin
+_CONDITIONAL_HEADERS = ("range", "if-none-match", "if-modified-since")
+
+_DOWNLOAD_RESPONSES = {
+    200: {"content": {"application/pdf": {}}},
+    206: {"description": "Requested byte range of the PDF"},
+    304: {"description": "Client copy is current"},
+    416: {"description": "Range not satisfiable"},
+    429: {"description": "Too many queued downloads; retry after the Retry-After header"},
+    502: {"description": "Download failed"},
+}
+
+
+@app.post("/download", response_class=PdfFileResponse, responses=_DOWNLOAD_RESPONSES)
+async def download_file(req: DownloadRequest, request: Request, background_tasks: BackgroundTasks):
+    return await _download(req, request, background_tasks)
+
+
+@app.api_route("/download", methods=["GET", "HEAD"], response_class=PdfFileResponse,
+               responses=_DOWNLOAD_RESPONSES)
+async def download_file_get(request: Request, background_tasks: BackgroundTasks, url: HttpUrl,
+                            filename: Optional[str] = None, timeout: int = 30, force: bool = False):
+    req = DownloadRequest(url=url, filename=filename, timeout=timeout, force=force)
+    return await _download(req, request, background_tasks)
+
+
+async def _download(req: DownloadRequest, request: Request, background_tasks: BackgroundTasks):
+    url = str(req.url)
+    out_name = req.filename or Path(req.url.path).name or "download.pdf"
+
+    response = await _cached_response(url, out_name, request)
+    if response is not None:
+        return response
+
+    retry_after = None if req.force else _recently_failed(url)
+    if retry_after is not None:
+        raise HTTPException(status_code=502, headers={"Retry-After": str(retry_after)},
+                            detail="All download methods failed recently for this URL or host")
+
+    hedge = settings.HEDGE_ENABLED if req.hedge is None else req.hedge
+    hedge_delay = (settings.HEDGE_DELAY if req.hedge_delay is None else req.hedge_delay) if hedge else None
+
+    started = False
+    if req.stream:
+        response, started = await _stream_response(cache_key(url), url, out_name, req.timeout, hedge_delay)
+        if response is not None:
+            return response
+
+    response = await _fetched_response(url, out_name, req.timeout, hedge_delay, background_tasks, started)
+    if response is None:
         raise HTTPException(status_code=502, detail="All download methods failed or file is not a valid PDF")
+    return response
+
+
+async def _cached_response(url: str, out_name: str, request: Request) -> Optional[PdfFileResponse]:
+    cache = get_cache()
+    if not cache:
+        return None
+    entry = await asyncio.to_thread(cache.get, url)
+    conditional = any(h in request.headers for h in _CONDITIONAL_HEADERS)
+    if entry and (conditional or await _revalidate(cache, entry)):
+        logger.info("Cache hit: %s", url)
+        CACHE_LOOKUPS.inc(result="hit")
+        return PdfFileResponse(entry.path, filename=out_name,
+                               headers={"X-Cache": "HIT", "X-Download-Strategy": "cache"},
+                               on_sent=lambda n: BYTES_SERVED.inc(n, source="cache"))
+    CACHE_LOOKUPS.inc(result="miss")
+    return None
+
+
+async def _fetched_response(url: str, out_name: str, timeout: float, hedge_delay: Optional[float],
+                            background_tasks: BackgroundTasks, started: bool = False,
+                            host_streak: bool = True) -> Optional[PdfFileResponse]:
+    # Concurrent requests for the same URL share one strategy chain run.
+    async with _flights.acquire(cache_key(url),
+                                lambda: _fetch_pdf(url, out_name, timeout, hedge_delay, host_streak=host_streak),
+                                on_release=_release_fetch, started=started) as result:
+        if result is None:
+            return None
+        save_path = result.path
+        strategy = result.strategy
+        if result.tmpdir:
+            # not cached: take a private link before the shared temp dir is released
+            own_dir = tempfile.mkdtemp(prefix="pdfdl_")
+            save_path = os.path.join(own_dir, out_name)
+            _link_or_copy(result.path, save_path)
+            # Schedule cleanup after response
+            background_tasks.add_task(_cleanup_dir, own_dir)
+
+    return PdfFileResponse(save_path, filename=out_name,
+                           headers={"X-Cache": "MISS", "X-Download-Strategy": strategy},
+                           on_sent=lambda n: BYTES_SERVED.inc(n, source="download"))
+
+
+@app.post("/download/doi", response_class=PdfFileResponse, responses={
+    **_DOWNLOAD_RESPONSES,
+    422: {"description": "Not a DOI"},
+})
+async def download_doi(req: DoiDownloadRequest, request: Request, background_tasks: BackgroundTasks):
+    try:
+        candidates = _doi_resolver.candidates(req.doi)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if req.url is not None:
+        # the caller's landing page replaces the generic doi.org fallback
+        candidates = [(rule, u) for rule, u in candidates if rule != "doi.org"] + [("landing", str(req.url))]
+    out_name = req.filename or _job_filename(candidates[0][1], req.doi.rsplit("/", 1)[-1])
+
+    tried = []
+    for rule, url in candidates:
+        response = await _cached_response(url, out_name, request)
+        if response is None:
+            if not req.force and _recently_failed(url) is not None:
+                tried.append(f"{rule}: {url} (failed recently)")
+                continue
+            # a missed rule candidate says nothing about its host (doi.org, a paywalled publisher)
+            response = await _fetched_response(url, out_name, req.timeout, None, background_tasks, host_streak=False)
+        if response is not None:
+            logger.info("DOI %s resolved via %s: %s", req.doi, rule, url)
+            response.headers["X-Resolved-Url"] = url
+            response.headers["X-Doi-Rule"] = rule
+            return response
+        tried.append(f"{rule}: {url}")
+    raise HTTPException(status_code=502, detail={"message": "No candidate URL yielded a valid PDF", "tried": tried})
+
+
+async def _stream_response(key: str, url: str, out_name: str, timeout: float,
+                           hedge_delay: Optional[float]) -> tuple[Optional[StreamingResponse], bool]:
+    """Tail a live download (joining one already in progress for this URL). Returns
+    (response, started): response is None when the body could not be streamed and the caller
+    should wait for the finished file instead; started tells whether this call began the flight."""
+    live = _live_streams.get(key)
+    started = False
+    if live is None and key not in _flights:
+        announce = asyncio.get_running_loop().create_future()
+        started = _flights.start(key, lambda: _fetch_pdf_streaming(url, out_name, timeout, hedge_delay, announce),
+                                 on_release=_release_fetch)
+        live = await announce
+    f = open_for_follow(live) if live is not None else None
+    if f is None:
+        return None, started
+    headers = {"Content-Disposition": f'attachment; filename="{out_name}"', "X-Cache": "MISS",
+               "X-Download-Strategy": "stream"}
+    if live.content_length is not None:
+        headers["Content-Length"] = str(live.content_length)
+    return StreamingResponse(_counting(live.follow(f, settings.HTTP_CHUNK_SIZE), "stream"), media_type="application/pdf",
+                             headers=headers), started
+
+
+def _job_filename(url: str, filename: Optional[str]) -> str:
+    name = os.path.basename(filename or "") or Path(httpx.URL(url).path).name or "download.pdf"
+    return name if name.lower().endswith(".pdf") else name + ".pdf"
+
+
+async def _download_to(url: str, out_name: str, timeout: float, dest_path: str) -> Optional[str]:
+    """Fetch url (cache, then a shared single-flight chain run) into dest_path.
+    Returns the strategy name ("cache" for hits) or None on failure."""
+    cache = get_cache()
+    if cache:
+        entry = await asyncio.to_thread(cache.get, url)
+        if entry and await _revalidate(cache, entry):
+            CACHE_LOOKUPS.inc(result="hit")
+            _link_or_copy(entry.path, dest_path)
+            return "cache"
+        CACHE_LOOKUPS.inc(result="miss")
+    retry_after = _recently_failed(url)
+    if retry_after is not None:
+        raise RuntimeError(f"all download methods failed recently for this URL or host (retry in {retry_after}s)")
+    async with _flights.acquire(cache_key(url), lambda: _fetch_pdf(url, out_name, timeout, lane=BATCH),
+                                on_release=_release_fetch) as result:
+        if result is None:
+            return None
+        _link_or_copy(result.path, dest_path)
+        return result.strategy
+
+
+def _require_jobs() -> JobStore:
+    if _jobs is None:
+        raise HTTPException(status_code=503, detail="Batch jobs are disabled (JOB_WORKERS = 0)")
+    return _jobs
+
+
+@app.post("/jobs")
+async def create_job(req: JobRequest):
+    jobs = _require_jobs()
+    items = [(str(u), _job_filename(str(u), None)) for u in req.urls]
+    items += [(str(i.url), _job_filename(str(i.url), i.filename)) for i in req.items]
+    if not items:
+        raise HTTPException(status_code=422, detail="No URLs given")
+    if len(items) > settings.JOB_MAX_URLS:
+        raise HTTPException(status_code=413, detail=f"At most {settings.JOB_MAX_URLS} URLs per job")
+    job_id = await asyncio.to_thread(jobs.create, items, req.timeout)
+    _job_runner.notify()
+    logger.info("Created job %s with %d URL(s)", job_id, len(items))
+    return {"job_id": job_id, "total": len(items)}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, offset: int = 0, limit: int = 1000, status: Optional[str] = None):
+    jobs = _require_jobs()
+    job = await asyncio.to_thread(jobs.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    counts = await asyncio.to_thread(jobs.counts, job_id)
+    items = await asyncio.to_thread(jobs.items, job_id, offset, limit, status)
+    return {
+        "job_id": job_id,
+        "created_at": job["created_at"],
+        "total": job["total"],
+        "counts": counts,
+        "finished": counts.get("done", 0) + counts.get("failed", 0) == job["total"],
+        "items": [dict(row) for row in items],
+    }
+
+
+@app.get("/jobs/{job_id}/items/{idx}", response_class=PdfFileResponse)
+async def get_job_item(job_id: str, idx: int):
+    jobs = _require_jobs()
+    item = await asyncio.to_thread(jobs.item, job_id, idx)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Unknown job item")
+    if item["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Item is {item['status']}")
+    return PdfFileResponse(item["path"], filename=item["filename"])
+
+
+@app.get("/jobs/{job_id}/zip")
+async def get_job_zip(job_id: str):
+    jobs = _require_jobs()
+    if await asyncio.to_thread(jobs.get, job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    files = await asyncio.to_thread(jobs.done_files, job_id)
+    entries = [(f"{idx:06d}_{filename}", path) for idx, filename, path in files]
+    return StreamingResponse(iter_zip(entries), media_type="application/zip",
+                             headers={"Content-Disposition": f'attachment; filename="{job_id}.zip"'})
+
+
+@app.delete("/jobs/{job_id}")
+async def delete_job(job_id: str):
+    jobs = _require_jobs()
+    if not await asyncio.to_thread(jobs.delete, job_id):
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return {"job_id": job_id, "deleted": True}
+
+
+@app.get("/metrics", response_class=Response)
+def metrics():
+    """Prometheus text exposition of this worker's counters, histograms and gauges."""
+    return Response(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
 
-    # Schedule cleanup after response
-    background_tasks.add_task(_cleanup_dir, tmpdir)
 
-    # Return as FileResponse (FastAPI will stream the file)
-    return FileResponse(save_path, media_type="application/pdf", filename=out_name)
+@app.get("/stats")
+async def stats():
+    """Counters for coalesced downloads, cache occupancy and browser pool usage."""
+    cache = get_cache()
+    return {
+        "singleflight": _flights.stats(),
+        "cache": (await asyncio.to_thread(cache.stats)) if cache else None,
+        "browser_pool": _browser_pool.stats() if _browser_pool else None,
+        "admission": _admission.stats(),
+        "routing": _router.stats(),
+        "aria2": _aria2.stats() if _aria2 else None,
+        "jobs": {
+            "queued": await asyncio.to_thread(_jobs.pending_count),
+            "active_workers": _job_runner.active,
+        } if _jobs and _job_runner else None,
+    }
 
 
 if __name__ == "__main__":
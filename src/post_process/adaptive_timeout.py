@@ -0,0 +1,150 @@
+"""
+Adaptive per-URL deadlines and stall detection for src/post_process/download_with_aria2.py.
+
+A fixed wall-clock cap kills large PDFs on slow mirrors and lets dead URLs hold a slot for
+the whole cap. Instead each download is watched while it runs:
+
+- stall: no new bytes for ``stall_timeout`` seconds (including before the first byte) ends it;
+- deadline: once the size is known (Content-Length, as reported by aria2) the download gets
+  ``safety * size / rate`` seconds, clamped to [min_timeout, max_timeout], where ``rate`` is
+  the throughput measured for that host on earlier downloads of the run (``assumed_rate``
+  until there is one). While the size is unknown, only max_timeout and the stall rule apply.
+
+Progress comes from aria2 itself: its summary readout (``[#2089b0 1.2MiB/33MiB(3%) CN:4
+DL:115KiB ETA:4m]``, see parse_readout) or tellStatus over RPC.
+
+    timeouts = AdaptiveTimeouts(min_timeout=30, max_timeout=900, stall_timeout=30)
+    watch = timeouts.watch(url)
+    verdict = watch.update(completed_bytes, total_bytes)   # None, "STALL" or "TIMEOUT"
+    watch.finish(ok=True)                                  # feeds the host's throughput
+"""
+import re
+import time
+from typing import Optional
+from urllib.parse import urlsplit
+
+_UNITS = {"": 1, "B": 1, "K": 1024, "KI": 1024, "M": 1024 ** 2, "MI": 1024 ** 2,
+          "G": 1024 ** 3, "GI": 1024 ** 3, "T": 1024 ** 4, "TI": 1024 ** 4}
+_SIZE = re.compile(r"^\s*([\d.]+)\s*([KMGT]?I?)B?\s*$", re.IGNORECASE)
+_READOUT = re.compile(r"\[#([0-9a-f]+) ([^\]]+)\]")
+
+
+def parse_size(text) -> Optional[int]:
+    """'1.2MiB', '10K', '512B', '2048' → bytes (None if unparseable)."""
+    m = _SIZE.match(str(text))
+    if not m:
+        return None
+    return int(float(m.group(1)) * _UNITS[m.group(2).upper()])
+
+
+def parse_readout(text: str) -> list[dict]:
+    """aria2 progress readout entries → [{gid, completed, total, connections, speed, eta, file}].
+    total is None while aria2 does not know the size; file comes from the ``FILE:`` line that
+    follows an entry in the periodic summary."""
+    entries = []
+    for line in text.splitlines():
+        if line.startswith("FILE: ") and entries and entries[-1]["file"] is None:
+            entries[-1]["file"] = line[6:].strip()
+            continue
+        m = _READOUT.search(line)
+        if not m:
+            continue
+        gid, body = m.groups()
+        fields = body.split()
+        done, _, rest = fields[0].partition("/")
+        total = parse_size(rest.split("(")[0]) if rest else None
+        entry = {"gid": gid, "completed": parse_size(done) or 0, "total": total or None,
+                 "connections": None, "speed": None, "eta": None, "file": None}
+        for field in fields[1:]:
+            key, _, value = field.partition(":")
+            if key == "CN":
+                entry["connections"] = int(value) if value.isdigit() else None
+            elif key == "DL":
+                entry["speed"] = parse_size(value)
+            elif key == "ETA":
+                entry["eta"] = value
+        entries.append(entry)
+    return entries
+
+
+def host_of(url: str) -> str:
+    return (urlsplit(url).hostname or "").lower()
+
+
+class HostThroughput:
+    """Exponentially weighted bytes/s per host, from completed downloads."""
+
+    def __init__(self, alpha: float = 0.3):
+        self.alpha = alpha
+        self._rates: dict[str, float] = {}
+
+    def rate(self, host: str) -> Optional[float]:
+        return self._rates.get(host)
+
+    def record(self, host: str, nbytes: int, seconds: float):
+        if nbytes <= 0 or seconds <= 0:
+            return
+        sample = nbytes / seconds
+        prev = self._rates.get(host)
+        self._rates[host] = sample if prev is None else prev + self.alpha * (sample - prev)
+
+
+class DownloadWatch:
+    """Progress of one download; see AdaptiveTimeouts.watch()."""
+
+    def __init__(self, owner: "AdaptiveTimeouts", url: str):
+        self.owner = owner
+        self.url = url
+        self.host = host_of(url)
+        self.started = self.last_progress = time.monotonic()
+        self.completed = 0
+        self.total: Optional[int] = None
+
+    @property
+    def deadline(self) -> float:
+        """Seconds allowed since start, given what is known so far."""
+        return self.owner.deadline_for(self.host, self.total)
+
+    def queued(self):
+        """Still waiting for a download slot: the clocks start when the download does."""
+        self.started = self.last_progress = time.monotonic()
+
+    def update(self, completed: Optional[int], total: Optional[int] = None,
+               now: Optional[float] = None) -> Optional[str]:
+        """Record progress; returns "STALL" or "TIMEOUT" when the download should be stopped."""
+        now = time.monotonic() if now is None else now
+        if total:
+            self.total = total
+        if completed is not None and completed > self.completed:
+            self.completed = completed
+            self.last_progress = now
+        if now - self.last_progress > self.owner.stall_timeout:
+            return "STALL"
+        if now - self.started > self.deadline:
+            return "TIMEOUT"
+        return None
+
+    def finish(self, ok: bool, nbytes: Optional[int] = None):
+        if ok:
+            self.owner.throughput.record(self.host, nbytes or self.total or self.completed,
+                                         time.monotonic() - self.started)
+
+
+class AdaptiveTimeouts:
+    def __init__(self, min_timeout: float = 30, max_timeout: float = 900, stall_timeout: float = 30,
+                 assumed_rate: float = 100 * 1024, safety: float = 3.0):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.stall_timeout = stall_timeout
+        self.assumed_rate = assumed_rate
+        self.safety = safety
+        self.throughput = HostThroughput()
+
+    def deadline_for(self, host: str, total: Optional[int]) -> float:
+        if not total:
+            return self.max_timeout
+        rate = self.throughput.rate(host) or self.assumed_rate
+        return min(self.max_timeout, max(self.min_timeout, self.safety * total / rate))
+
+    def watch(self, url: str) -> DownloadWatch:
+        return DownloadWatch(self, url)
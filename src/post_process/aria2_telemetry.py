@@ -0,0 +1,151 @@
+"""
+Structured progress telemetry for src/post_process/download_with_aria2.py.
+
+The aria2 stage reports every download it sees: the readout in aria2's periodic summary
+(batch and per-URL modes, see adaptive_timeout.parse_readout) or tellStatus (RPC mode).
+Every ``interval`` seconds one event is appended to a JSONL file and one line is logged:
+
+    {"type": "progress", "at": "...", "elapsed_s": 120.0, "urls": 1000, "completed": 412,
+     "failed": 9, "active": 8, "bytes_per_s": 4404019, "downloaded_bytes": 912345678,
+     "eta_s": 170, "hosts": {"arxiv.org": {"active": 3, "connections": 12, "bytes_per_s": 3100000}},
+     "stalled_hosts": ["slow.example.org"]}
+
+    aria2: 412/1000 done, 9 failed, 8 active, 4.2 MiB/s, ETA 2m50s | stalled: slow.example.org
+
+``stalled_hosts`` are hosts with active downloads that received no bytes since the previous
+event; the overall ETA extrapolates the URL completion rate so far.
+
+    telemetry = ProgressTelemetry("foo_progress.jsonl", total_urls=1000, interval=10)
+    telemetry.active(url, completed=..., total=..., speed=..., connections=...)
+    telemetry.finished(url, ok=True, nbytes=...)
+    telemetry.tick()    # emits when the interval has passed
+    telemetry.close()   # final event
+"""
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Optional
+
+from src.post_process.adaptive_timeout import host_of
+
+logger = logging.getLogger(__name__)
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat() + "Z"
+
+
+def _rate(bps: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if bps < 1024 or unit == "GiB":
+            return f"{bps:.1f} {unit}/s" if unit != "B" else f"{bps:.0f} B/s"
+        bps /= 1024
+
+
+def _duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "?"
+    seconds = int(seconds)
+    h, rest = divmod(seconds, 3600)
+    m, s = divmod(rest, 60)
+    return f"{h}h{m:02d}m" if h else f"{m}m{s:02d}s" if m else f"{s}s"
+
+
+class ProgressTelemetry:
+    def __init__(self, path: Optional[str], total_urls: int, interval: float = 10, label: str = "aria2"):
+        self.path = path
+        self.total_urls = total_urls
+        self.interval = interval
+        self.label = label
+        self.completed = 0
+        self.failed = 0
+        self.finished_bytes = 0
+        self.started = self._last_emit = time.monotonic()
+        self._active: dict[str, dict] = {}
+        self._seen: set = set()
+        self._last_completed: dict[str, int] = {}
+        self._fh = open(path, "a", encoding="utf-8") if path else None
+        self._write({"type": "start", "at": _now(), "urls": total_urls})
+
+    # ── input ─────────────────────────────────────────────────────────────
+    def active(self, url: str, completed: int = 0, total: Optional[int] = None, speed: Optional[int] = None,
+               connections: Optional[int] = None):
+        """Latest progress of a running download."""
+        if url in self._seen:
+            return  # a summary printed before its completion line was read
+        self._active[url] = {"host": host_of(url), "completed": completed or 0, "total": total,
+                             "speed": speed or 0, "connections": connections or 0}
+
+    def set_active(self, entries: dict[str, dict]):
+        """Replace the whole set of running downloads ({url: progress}), e.g. from one aria2 summary."""
+        self._active = {}
+        for url, e in entries.items():
+            self.active(url, e.get("completed"), e.get("total"), e.get("speed"), e.get("connections"))
+
+    def finished(self, url: str, ok: bool, nbytes: Optional[int] = None):
+        if url in self._seen:
+            return
+        self._seen.add(url)
+        last = self._active.pop(url, None)
+        if ok:
+            self.completed += 1
+            self.finished_bytes += nbytes or (last or {}).get("total") or 0
+        else:
+            self.failed += 1
+
+    # ── output ────────────────────────────────────────────────────────────
+    def snapshot(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        hosts: dict[str, dict] = {}
+        for url, a in self._active.items():
+            h = hosts.setdefault(a["host"], {"active": 0, "connections": 0, "bytes_per_s": 0, "_progress": False})
+            h["active"] += 1
+            h["connections"] += a["connections"]
+            h["bytes_per_s"] += a["speed"]
+            if a["completed"] > self._last_completed.get(url, 0):
+                h["_progress"] = True
+        stalled = sorted(host for host, h in hosts.items() if not h.pop("_progress"))
+        self._last_completed = {url: a["completed"] for url, a in self._active.items()}
+
+        done = self.completed + self.failed
+        left = max(0, self.total_urls - done)
+        eta = left * elapsed / done if done else None
+        return {
+            "type": "progress",
+            "at": _now(),
+            "elapsed_s": round(elapsed, 1),
+            "urls": self.total_urls,
+            "completed": self.completed,
+            "failed": self.failed,
+            "active": len(self._active),
+            "bytes_per_s": sum(a["speed"] for a in self._active.values()),
+            "downloaded_bytes": self.finished_bytes + sum(a["completed"] for a in self._active.values()),
+            "eta_s": round(eta) if eta is not None else None,
+            "hosts": hosts,
+            "stalled_hosts": stalled,
+        }
+
+    def tick(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last_emit < self.interval:
+            return
+        self._last_emit = now
+        event = self.snapshot()
+        self._write(event)
+        line = (f"{self.label}: {event['completed']}/{event['urls']} done, {event['failed']} failed, "
+                f"{event['active']} active, {_rate(event['bytes_per_s'])}, ETA {_duration(event['eta_s'])}")
+        if event["stalled_hosts"]:
+            line += " | stalled: " + ", ".join(event["stalled_hosts"][:5])
+        logger.info(line)
+
+    def _write(self, event: dict):
+        if self._fh is not None:
+            self._fh.write(json.dumps(event, ensure_ascii=False) + "\n")
+            self._fh.flush()
+
+    def close(self):
+        self.tick(force=True)
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
@@ -0,0 +1,139 @@
+"""
+Append-only progress journal for src/post_process/download_with_aria2.py.
+
+One JSON line per event, appended and flushed as each URL completes or fails, so a crash
+or Ctrl-C loses at most the line being written::
+
+    {"type": "start", "csv": "foo_merged.csv", "at": "2024-05-01T10:00:00Z"}
+    {"url": "https://...", "status": "done", "file": "a.pdf", "at": "..."}
+    {"url": "https://...", "status": "failed", "attempts": 2, "at": "..."}
+
+Resuming replays the file (O(records), i.e. O(completed URLs)) into the latest record per
+URL; URLs recorded as ``done`` are skipped. close() compacts the journal to one line per
+URL, and remove() deletes it once every URL of the CSV is done. A truncated last line
+from a crash is ignored.
+"""
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+DONE = "done"
+FAILED = "failed"
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat() + "Z"
+
+
+class DownloadJournal:
+    def __init__(self, path: str, csv_name: str):
+        self.path = path
+        self.csv_name = csv_name
+        self.records: dict[str, dict] = {}
+        self._fh = None
+
+    def replay(self) -> dict[str, dict]:
+        """Load the latest record per URL. A journal written for another CSV is discarded."""
+        self.records = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue  # torn write at crash time
+                    if rec.get("type") == "start":
+                        if rec.get("csv") != self.csv_name:
+                            logger.info("Journal %s belongs to %s, starting over", self.path, rec.get("csv"))
+                            self.records = {}
+                            return self.records
+                        continue
+                    if rec.get("url"):
+                        self.records[rec["url"]] = rec
+        except OSError:
+            pass
+        return self.records
+
+    def done(self) -> set:
+        return {u for u, rec in self.records.items() if rec.get("status") == DONE}
+
+    def open(self):
+        """Open for appending. A new journal (or one for another CSV) is first rewritten with
+        a start header and the records already in memory."""
+        if not self._has_header():
+            self.compact()
+        self._fh = open(self.path, "a", encoding="utf-8")
+
+    def _has_header(self) -> bool:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                first = json.loads(f.readline() or "{}")
+            return first.get("type") == "start" and first.get("csv") == self.csv_name
+        except (OSError, ValueError):
+            return False
+
+    def _write(self, rec: dict):
+        self._fh.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        self._fh.flush()
+
+    def record(self, url: str, status: str, **fields):
+        prev = self.records.get(url) or {}
+        rec = {"url": url, "status": status, **fields, "at": _now()}
+        if status == FAILED:
+            rec["attempts"] = prev.get("attempts", 0) + 1
+        self.records[url] = rec
+        if self._fh is not None:
+            self._write(rec)
+
+    def close(self, compact: bool = True):
+        if self._fh is not None:
+            try:
+                os.fsync(self._fh.fileno())
+            except OSError:
+                pass
+            self._fh.close()
+            self._fh = None
+        if compact:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the journal as one line per URL (atomic replace)."""
+        dirn = os.path.dirname(self.path) or "."
+        fd, tmp = tempfile.mkstemp(dir=dirn, prefix=".journal.")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"type": "start", "csv": self.csv_name, "at": _now()}) + "\n")
+                for rec in self.records.values():
+                    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            os.replace(tmp, self.path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def __enter__(self) -> "DownloadJournal":
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def migrate_state(journal: DownloadJournal, state: Optional[dict], all_urls: list[str]):
+    """Import a legacy .aria2_state.json: URLs of the same CSV not in "remaining" count as done."""
+    if not state or state.get("csv") != journal.csv_name:
+        return
+    remaining = set(state.get("remaining") or [])
+    for u in all_urls:
+        if u not in remaining and u not in journal.records:
+            journal.records[u] = {"url": u, "status": DONE, "at": _now(), "migrated": True}
@@ -0,0 +1,220 @@
+"""
+Cross-run download ledger for src/post_process/download_with_aria2.py.
+
+One SQLite row per URL, shared by every CSV and every run: status (done / failed), local
+path, size, sha256, failed-attempt count and last error. download_with_aria2.py takes its skip,
+retry and report decisions from indexed queries on this table instead of probing the
+filesystem for every URL; the filesystem is only checked for URLs the ledger has never
+seen (files downloaded before the ledger existed).
+
+The file lives at ARIA2_LEDGER (default cache/download_ledger.sqlite3) in WAL mode, so a
+report can be read while a download run is writing.
+
+The sha256 index also drives content deduplication: a URL whose file has the same hash as
+one downloaded earlier under another URL (mirrors, query-string variants) is recorded in the
+``duplicates`` table with its canonical URL and path, and the caller hardlinks the file.
+
+Usage:
+    python -m src.post_process.download_ledger                 # status counts per CSV
+    python -m src.post_process.download_ledger --failed out.csv --csv foo_merged.csv
+    python -m src.post_process.download_ledger --duplicates dups.csv
+"""
+import argparse
+import csv
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Iterable, Optional
+
+DONE = "done"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS downloads (
+    url        TEXT PRIMARY KEY,
+    csv        TEXT,
+    status     TEXT NOT NULL,
+    path       TEXT,
+    size       INTEGER,
+    sha256     TEXT,
+    attempts   INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    via        TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS downloads_csv_status ON downloads(csv, status);
+CREATE INDEX IF NOT EXISTS downloads_status ON downloads(status);
+CREATE INDEX IF NOT EXISTS downloads_sha256 ON downloads(sha256);
+CREATE TABLE IF NOT EXISTS duplicates (
+    url            TEXT PRIMARY KEY,
+    csv            TEXT,
+    path           TEXT NOT NULL,
+    canonical_url  TEXT NOT NULL,
+    canonical_path TEXT NOT NULL,
+    sha256         TEXT NOT NULL,
+    linked         INTEGER NOT NULL,
+    updated_at     REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS duplicates_csv ON duplicates(csv);
+"""
+
+_CHUNK = 500  # stays below SQLite's host parameter limit
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class DownloadLedger:
+    def __init__(self, db_path: str):
+        self.db_path = os.path.abspath(db_path)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript(_SCHEMA)
+
+    # sqlite3 connections are per thread
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def lookup(self, urls: Iterable[str]) -> dict[str, sqlite3.Row]:
+        """Rows for the given URLs (primary-key lookups, in chunks)."""
+        urls = list(urls)
+        rows = {}
+        conn = self._conn()
+        for i in range(0, len(urls), _CHUNK):
+            chunk = urls[i:i + _CHUNK]
+            marks = ",".join("?" * len(chunk))
+            for row in conn.execute(f"SELECT * FROM downloads WHERE url IN ({marks})", chunk):
+                rows[row["url"]] = row
+        return rows
+
+    def mark_done(self, url: str, path: str, csv_name: Optional[str] = None, via: Optional[str] = None,
+                  size: Optional[int] = None, sha256: Optional[str] = None):
+        """Record a finished download; size and sha256 are computed from path when not given."""
+        path = os.path.abspath(path)
+        if size is None:
+            size = os.path.getsize(path)
+        if sha256 is None:
+            sha256 = file_sha256(path)
+        self._conn().execute(
+            "INSERT INTO downloads (url, csv, status, path, size, sha256, attempts, last_error, via, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, 0, NULL, ?, ?) "
+            "ON CONFLICT(url) DO UPDATE SET csv = excluded.csv, status = excluded.status, path = excluded.path, "
+            "size = excluded.size, sha256 = excluded.sha256, last_error = NULL, "
+            "via = excluded.via, updated_at = excluded.updated_at",
+            (url, csv_name, DONE, path, size, sha256, via, time.time()),
+        )
+
+    def mark_failed(self, url: str, error: str, csv_name: Optional[str] = None, path: Optional[str] = None):
+        self._conn().execute(
+            "INSERT INTO downloads (url, csv, status, path, attempts, last_error, updated_at) "
+            "VALUES (?, ?, ?, ?, 1, ?, ?) "
+            "ON CONFLICT(url) DO UPDATE SET csv = excluded.csv, status = excluded.status, "
+            "path = COALESCE(excluded.path, path), attempts = attempts + 1, "
+            "last_error = excluded.last_error, updated_at = excluded.updated_at",
+            (url, csv_name, FAILED, path and os.path.abspath(path), error, time.time()),
+        )
+
+    def same_content(self, sha256: str, exclude_url: str) -> list[sqlite3.Row]:
+        """Finished downloads of other URLs with this sha256, originals (not themselves duplicates) first."""
+        return self._conn().execute(
+            "SELECT url, path, size FROM downloads WHERE sha256 = ? AND status = ? AND url != ? "
+            "ORDER BY url IN (SELECT url FROM duplicates), updated_at LIMIT 20",
+            (sha256, DONE, exclude_url)).fetchall()
+
+    def mark_duplicate(self, url: str, path: str, canonical_url: str, canonical_path: str, sha256: str,
+                       linked: bool, csv_name: Optional[str] = None):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO duplicates (url, csv, path, canonical_url, canonical_path, sha256, linked, "
+            "updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (url, csv_name, os.path.abspath(path), canonical_url, os.path.abspath(canonical_path), sha256,
+             int(linked), time.time()),
+        )
+
+    def duplicates(self, csv_name: Optional[str] = None) -> list[sqlite3.Row]:
+        sql = "SELECT url, csv, path, canonical_url, canonical_path, sha256, linked FROM duplicates"
+        params: tuple = ()
+        if csv_name is not None:
+            sql += " WHERE csv = ?"
+            params = (csv_name,)
+        return self._conn().execute(sql + " ORDER BY canonical_url, url", params).fetchall()
+
+    def report(self, csv_name: Optional[str] = None) -> list[sqlite3.Row]:
+        """(csv, status, count, bytes) groups, optionally for one CSV."""
+        if csv_name is None:
+            return self._conn().execute(
+                "SELECT csv, status, COUNT(*) AS count, COALESCE(SUM(size), 0) AS bytes "
+                "FROM downloads GROUP BY csv, status ORDER BY csv, status").fetchall()
+        return self._conn().execute(
+            "SELECT csv, status, COUNT(*) AS count, COALESCE(SUM(size), 0) AS bytes "
+            "FROM downloads WHERE csv = ? GROUP BY status ORDER BY status", (csv_name,)).fetchall()
+
+    def failures(self, csv_name: Optional[str] = None) -> list[sqlite3.Row]:
+        sql = "SELECT url, csv, attempts, last_error, updated_at FROM downloads WHERE status = ?"
+        params: tuple = (FAILED,)
+        if csv_name is not None:
+            sql += " AND csv = ?"
+            params += (csv_name,)
+        return self._conn().execute(sql + " ORDER BY attempts DESC, url", params).fetchall()
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def _export(out_path: str, columns: list[str], rows):
+    out = sys.stdout if out_path == "-" else open(out_path, "w", encoding="utf-8", newline="")
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([row[c] for c in columns])
+    if out is not sys.stdout:
+        out.close()
+
+
+def write_duplicates(out_path: str, rows):
+    """The duplicate → canonical mapping as CSV, for fixing up metadata that points at duplicate files."""
+    _export(out_path, ["url", "csv", "path", "canonical_url", "canonical_path", "sha256", "linked"], rows)
+
+
+def main(argv: Optional[list[str]] = None):
+    from src.utils.utils import project_root
+    parser = argparse.ArgumentParser(description="Report on the aria2 downloader's ledger")
+    parser.add_argument("--db", default=os.path.join(project_root, "cache", "download_ledger.sqlite3"))
+    parser.add_argument("--csv", help="limit to one *_merged.csv")
+    parser.add_argument("--failed", metavar="OUT", help="write failed URLs to this CSV file ('-' for stdout)")
+    parser.add_argument("--duplicates", metavar="OUT",
+                        help="write the duplicate → canonical URL mapping to this CSV file ('-' for stdout)")
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.db):
+        raise SystemExit(f"No ledger at {args.db}")
+    ledger = DownloadLedger(args.db)
+    if args.failed:
+        _export(args.failed, ["url", "csv", "attempts", "last_error"], ledger.failures(args.csv))
+        return
+    if args.duplicates:
+        write_duplicates(args.duplicates, ledger.duplicates(args.csv))
+        return
+    print(f"{'csv':<40} {'status':<8} {'count':>8} {'MB':>10}")
+    for row in ledger.report(args.csv):
+        print(f"{(row['csv'] or '-'):<40} {row['status']:<8} {row['count']:>8} {row['bytes'] / 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,81 @@
 # python
 import os
+import csv
+import shutil
 import glob
+import hashlib
+import importlib.util
+import re
 import subprocess
 import logging
 import pandas as pd
 import json
 import sys
-import tempfile
-from datetime import datetime
-from src.utils.utils import load_config
+import time
+from typing import Callable, Optional
+from src.utils.utils import load_config, project_root
+from src.post_process.adaptive_timeout import AdaptiveTimeouts, parse_readout, parse_size
+from src.post_process.aria2_telemetry import ProgressTelemetry
+from src.post_process.download_journal import DONE, FAILED, DownloadJournal, migrate_state
+from src.post_process.download_ledger import DownloadLedger, file_sha256, write_duplicates
+from src.post_process import url_probe
+from src.utils.pdf_validator import is_valid_pdf, pdf_rejection_reason
+from src.utils.proc_utils import kill_process_tree, new_group_kwargs
 
 # ── CONFIG ────────────────────────────────────────────────────────────────
 cfg = load_config()["aria2_download"]
 INPUT_DIR = cfg["INPUT_DIR"][0]
 OUTPUT_DIR = cfg["OUTPUT_DIR"][0]
 
+# Batch mode: one aria2c session per CSV (--input-file) instead of one process per URL.
+ARIA2_BATCH = bool(cfg.get("ARIA2_BATCH", [True])[0])
+ARIA2_CONCURRENCY = int(cfg.get("ARIA2_CONCURRENCY", [8])[0])  # -j, downloads in parallel
+# A download is aborted when it stays below ARIA2_LOWEST_SPEED, or gets no data for
+# ARIA2_STALL_TIMEOUT seconds; it is retried up to ARIA2_MAX_TRIES times.
+ARIA2_LOWEST_SPEED = str(cfg.get("ARIA2_LOWEST_SPEED", ["10K"])[0])
+ARIA2_STALL_TIMEOUT = int(cfg.get("ARIA2_STALL_TIMEOUT", [30])[0])
+ARIA2_MAX_TRIES = int(cfg.get("ARIA2_MAX_TRIES", [3])[0])
+# Progress telemetry (aria2_telemetry.py): every ARIA2_PROGRESS_INTERVAL seconds one event in
+# {prefix}_progress.jsonl and one console line (speed, ETA, per-host connections, stalled hosts).
+ARIA2_PROGRESS_INTERVAL = int(cfg.get("ARIA2_PROGRESS_INTERVAL", [10])[0])
+# RPC mode: submit the CSV to a long-lived aria2c over JSON-RPC (src/utils/aria2_rpc.py),
+# started here or, with ARIA2_RPC_URL, shared with the download server.
+ARIA2_RPC = bool(cfg.get("ARIA2_RPC", [False])[0])
+ARIA2_RPC_URL = cfg.get("ARIA2_RPC_URL", [""])[0] or None
+ARIA2_RPC_SECRET = cfg.get("ARIA2_RPC_SECRET", [""])[0] or None
+ARIA2_MAX_DOWNLOAD_LIMIT = str(cfg.get("ARIA2_MAX_DOWNLOAD_LIMIT", ["0"])[0])  # bytes/s, 0 = unlimited
+# Per-URL and RPC modes: each download gets ARIA2_TIMEOUT_SAFETY x size / host speed seconds once its
+# size is known (the host's measured speed, ARIA2_ASSUMED_SPEED before that), between
+# ARIA2_PER_URL_TIMEOUT and ARIA2_MAX_TIMEOUT; one without new bytes for ARIA2_STALL_TIMEOUT is dropped.
+ARIA2_PER_URL_TIMEOUT = int(cfg.get("ARIA2_PER_URL_TIMEOUT", [30])[0])
+ARIA2_MAX_TIMEOUT = int(cfg.get("ARIA2_MAX_TIMEOUT", [900])[0])
+ARIA2_ASSUMED_SPEED = str(cfg.get("ARIA2_ASSUMED_SPEED", ["100K"])[0])
+ARIA2_TIMEOUT_SAFETY = float(cfg.get("ARIA2_TIMEOUT_SAFETY", [3])[0])
+# Cross-run ledger (download_ledger.py): URLs done in any earlier run or CSV are skipped without
+# touching the filesystem; URLs that failed ARIA2_MAX_ATTEMPTS runs are not retried (0 = always retry).
+ARIA2_LEDGER = cfg.get("ARIA2_LEDGER", [""])[0] or os.path.join(project_root, "cache", "download_ledger.sqlite3")
+ARIA2_MAX_ATTEMPTS = int(cfg.get("ARIA2_MAX_ATTEMPTS", [5])[0])
+# Done URLs are skipped on the ledger's word alone; ARIA2_VERIFY_LEDGER also checks that their
+# files still exist (one stat per URL, slow on network filesystems) and re-downloads deleted ones.
+ARIA2_VERIFY_LEDGER = bool(cfg.get("ARIA2_VERIFY_LEDGER", [False])[0])
+# A finished file whose sha256 the ledger already has under another URL is replaced by a hardlink
+# to that file; the mapping goes to {prefix}_duplicates.csv. aria2c and the browser write files
+# themselves, so the hash costs one extra read of each file after it completes (usually from the
+# page cache); the ledger needs it either way, so turning dedup off does not save it.
+ARIA2_DEDUP = bool(cfg.get("ARIA2_DEDUP", [True])[0])
+PLAYWRIGHT_TIMEOUT_MS = ARIA2_PER_URL_TIMEOUT * 1000  # milliseconds for Playwright API
+# Pre-flight probe (url_probe.py): one small ranged GET per URL before downloading; dead (404/410)
+# URLs and redirects to a sign-in page are skipped, HTML landing pages and bare 401/403 responses
+# go straight to the Playwright fallback.
+PROBE_URLS = bool(cfg.get("PROBE_URLS", [True])[0])
+PROBE_CONCURRENCY = int(cfg.get("PROBE_CONCURRENCY", [64])[0])
+PROBE_PER_HOST = int(cfg.get("PROBE_PER_HOST", [8])[0])
+PROBE_TIMEOUT = float(cfg.get("PROBE_TIMEOUT", [10])[0])
+# Fallback for URLs aria2 could not fetch: one browser with PLAYWRIGHT_CONCURRENCY contexts
+# (playwright_batch.py) instead of one Playwright subprocess per URL.
+PLAYWRIGHT_BATCH = bool(cfg.get("PLAYWRIGHT_BATCH", [True])[0])
+PLAYWRIGHT_CONCURRENCY = int(cfg.get("PLAYWRIGHT_CONCURRENCY", [4])[0])
+
 USER_AGENT = (
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
     "AppleWebKit/537.36 (KHTML, like Gecko) "
@@ -38,29 +99,29 @@ ARIA2_COMMON_FLAGS = [
     "--header=Connection: keep-alive",
 ]
 
+# shared by every CSV of a run, so host speeds measured on one CSV carry over to the next
+TIMEOUTS = AdaptiveTimeouts(
+    min_timeout=ARIA2_PER_URL_TIMEOUT,
+    max_timeout=ARIA2_MAX_TIMEOUT,
+    stall_timeout=ARIA2_STALL_TIMEOUT,
+    assumed_rate=parse_size(ARIA2_ASSUMED_SPEED) or 100 * 1024,
+    safety=ARIA2_TIMEOUT_SAFETY,
+)
+
 # ── LOGGING ───────────────────────────────────────────────────────────────
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s [%(levelname)s] %(message)s",
     datefmt="%Y-%m-%d %H:%M:%S",
 )
+# one INFO line per probe / RPC request would drown the run's own progress
+logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 
 # ── STATE HELPERS ────────────────────────────────────────────────────────
-def _atomic_write(path: str, data: dict):
-    tmp = None
-    try:
-        dirn = os.path.dirname(path) or "."
-        fd, tmp = tempfile.mkstemp(dir=dirn)
-        with os.fdopen(fd, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        os.replace(tmp, path)
-    finally:
-        if tmp and os.path.exists(tmp):
-            os.remove(tmp)
-
-
+# Progress is kept in an append-only journal (download_journal.py); the old
+# .aria2_state.json is only read once to migrate an interrupted run.
 def load_state(path: str) -> dict | None:
     try:
         with open(path, "r", encoding="utf-8") as f:
@@ -78,14 +139,6 @@ def remove_state(path: str):
 
 
 # ── UTILS ──────────────────────────────────────────────────────────────────
-def is_valid_pdf(path: str) -> bool:
-    try:
-        with open(path, "rb") as f:
-            return f.read(4) == b"%PDF"
-    except Exception:
-        return False
-
-
 def clean_urls(urls):
     clean = []
     for u in urls:
@@ -102,7 +155,439 @@ def _target_name_from_url(url: str) -> str:
     return base
 
 
+def _url_hash(url: str) -> str:
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+
+def target_names(urls) -> dict:
+    """Deterministic output filename per URL: the URL basename, or a hash-based name when the
+    basename is empty or already taken by an earlier URL of the same list."""
+    names, taken = {}, set()
+    for u in urls:
+        name = _target_name_from_url(u)
+        if not name or name in taken:
+            stem, ext = os.path.splitext(name)
+            name = f"{stem or 'download'}_{_url_hash(u)[:10]}{ext or '.pdf'}"
+        taken.add(name)
+        names[u] = name
+    return names
+
+
+# ── ARIA2 ──────────────────────────────────────────────────────────────────
+_RESULT_LINE = re.compile(r"^([0-9a-f]{6})\|(\w+)\s*\|[^|]*\|(.*)$")
+_FAILED_LINE = re.compile(r"Download GID#\w+ not complete: (.+)$")
+_COMPLETE_LINE = re.compile(r"Download complete: (.+)$")
+
+
+def _gid(url: str) -> str:
+    # aria2 GIDs are 16 hex digits; derived from the URL so results can be mapped back
+    return _url_hash(url)[:16]
+
+
+def write_input_file(path: str, urls, names: dict):
+    with open(path, "w", encoding="utf-8") as f:
+        for u in urls:
+            f.write(f"{u}\n  out={names[u]}\n  gid={_gid(u)}\n")
+
+
+def parse_download_results(text: str) -> list[tuple[str, str, str]]:
+    """(gid prefix, status, path or URI) rows of aria2c's "Download Results" table."""
+    rows = []
+    in_table = False
+    for line in text.splitlines():
+        if line.startswith("Download Results:"):
+            in_table = True
+            continue
+        if in_table:
+            m = _RESULT_LINE.match(line.strip())
+            if m:
+                rows.append((m.group(1), m.group(2), m.group(3).strip()))
+    return rows
+
+
+def parse_session(path: str) -> set:
+    """URIs aria2c saved as unfinished or failed with --save-session."""
+    uris = set()
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip() and not line[0].isspace():
+                    uris.update(line.strip().split("\t"))
+    except OSError:
+        pass
+    return uris
+
+
+def run_aria2_batch(urls, names: dict, download_dir: str, input_file: str,
+                    on_done: Optional[Callable[[str], None]] = None,
+                    telemetry: Optional[ProgressTelemetry] = None) -> dict:
+    """Download urls with a single aria2c session. Returns {url: aria2 status}: OK, ERR,
+    RM or INPR from the results table, SESSION if only the saved session lists it as
+    unfinished, UNKNOWN otherwise. on_done(url) is called as each download completes;
+    telemetry gets the downloads listed in aria2's periodic summary."""
+    write_input_file(input_file, urls, names)
+    session_file = os.path.join(download_dir, ".aria2_session.txt")
+    console_log = os.path.join(download_dir, "aria2_batch.log")
+    cmd = [
+        "aria2c",
+        f"--dir={download_dir}",
+        f"--input-file={input_file}",
+        f"--save-session={session_file}",
+        f"--max-concurrent-downloads={ARIA2_CONCURRENCY}",
+        f"--lowest-speed-limit={ARIA2_LOWEST_SPEED}",
+        f"--timeout={ARIA2_STALL_TIMEOUT}",
+        f"--connect-timeout={ARIA2_STALL_TIMEOUT}",
+        f"--max-tries={ARIA2_MAX_TRIES}",
+        f"--summary-interval={ARIA2_PROGRESS_INTERVAL}",
+        # invalid leftovers (HTML saved as .pdf) are downloaded again instead of failing
+        "--allow-overwrite=true",
+        "--download-result=default",
+        *[flag for flag in ARIA2_COMMON_FLAGS
+          if not flag.startswith(("--timeout=", "--max-tries=", "--summary-interval="))],
+    ]
+    logger.info(f"▶ aria2c batch: {len(urls)} URL(s), -j {ARIA2_CONCURRENCY}, "
+                f"stall limit {ARIA2_LOWEST_SPEED}/s or {ARIA2_STALL_TIMEOUT}s, log {console_log}")
+    # the results table shows 6-digit gid prefixes, so rows are mapped by path/URI first
+    by_target = {os.path.join(download_dir, names[u]): u for u in urls}
+    by_target.update({u: u for u in urls})
+    with open(console_log, "w", encoding="utf-8") as log, \
+            open(console_log, "r", encoding="utf-8", errors="replace") as tail:
+        proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, text=True, **new_group_kwargs())
+        try:
+            pending = ""
+            while True:
+                finished = proc.poll() is not None
+                pending += tail.read()
+                lines, _, pending = pending.rpartition("\n")
+                for line in lines.splitlines():
+                    m = _COMPLETE_LINE.search(line) or _FAILED_LINE.search(line)
+                    url = by_target.get(m.group(1).strip()) if m else None
+                    if url is None:
+                        continue
+                    ok = m.re is _COMPLETE_LINE
+                    if ok and on_done:
+                        on_done(url)
+                    if telemetry:
+                        telemetry.finished(url, ok)
+                if telemetry:
+                    readout = parse_readout(lines)
+                    if readout:
+                        telemetry.set_active({by_target[e["file"]]: e for e in readout if e["file"] in by_target})
+                    telemetry.tick()
+                if finished:
+                    break
+                time.sleep(1)
+        except BaseException:
+            kill_process_tree(proc.pid)
+            proc.wait()
+            raise
+    with open(console_log, "r", encoding="utf-8", errors="replace") as log:
+        results = parse_download_results(log.read())
+
+    by_gid = {}
+    for u in urls:
+        by_gid.setdefault(_gid(u)[:6], []).append(u)
+    statuses = {}
+    for gid, status, target in results:
+        url = by_target.get(target)
+        if url is None and len(by_gid.get(gid, [])) == 1:
+            url = by_gid[gid][0]
+        if url is not None:
+            statuses[url] = status
+    unfinished = parse_session(session_file)
+    for u in urls:
+        if u not in statuses:
+            statuses[u] = "SESSION" if u in unfinished else "UNKNOWN"
+    ok = sum(1 for st in statuses.values() if st == "OK")
+    logger.info(f"aria2c batch finished (rc={proc.returncode}): {ok}/{len(urls)} OK")
+    return statuses
+
+
+def run_aria2_rpc(urls, names: dict, download_dir: str, input_file: str,
+                  on_done: Optional[Callable[[str], None]] = None,
+                  telemetry: Optional[ProgressTelemetry] = None) -> dict:
+    """Download urls through an aria2c JSON-RPC daemon. Returns {url: status} with the same
+    OK/ERR/RM codes as the batch mode; on_done(url) is called as each download completes."""
+    import asyncio
+    from src.utils.aria2_rpc import Aria2Daemon, flags_to_options
+
+    write_input_file(input_file, urls, names)
+    options = flags_to_options(f for f in ARIA2_COMMON_FLAGS if not f.startswith("--summary-interval="))
+    options.update({
+        "lowest-speed-limit": ARIA2_LOWEST_SPEED,
+        "timeout": ARIA2_STALL_TIMEOUT,
+        "connect-timeout": ARIA2_STALL_TIMEOUT,
+        "max-tries": ARIA2_MAX_TRIES,
+        "allow-overwrite": True,
+    })
+    codes = {"complete": "OK", "error": "ERR", "removed": "RM", "STALL": "STALL", "TIMEOUT": "TIMEOUT"}
+
+    async def one(daemon, u: str) -> dict:
+        watch = TIMEOUTS.watch(u)
+        gid = await daemon.add_uri(u, download_dir, names[u], options)
+        waiter = asyncio.ensure_future(daemon.wait(gid))
+        while not waiter.done():
+            await asyncio.wait({waiter}, timeout=1)
+            if waiter.done():
+                break
+            st = daemon.last_status(gid)
+            if st is None or st.get("status") in ("waiting", "paused"):
+                watch.queued()
+                continue
+            verdict = watch.update(int(st.get("completedLength") or 0), int(st.get("totalLength") or 0))
+            if telemetry:
+                telemetry.active(u, int(st.get("completedLength") or 0), int(st.get("totalLength") or 0),
+                                 int(st.get("downloadSpeed") or 0), int(st.get("connections") or 0))
+                telemetry.tick()
+            if verdict:
+                waiter.cancel()  # wait() removes the download from aria2
+                try:
+                    await waiter
+                except asyncio.CancelledError:
+                    pass
+                logger.warning("aria2c %s for URL: %s (%d of %s bytes after %.0fs)", verdict.lower(), u,
+                               watch.completed, watch.total or "?", time.monotonic() - watch.started)
+                if telemetry:
+                    telemetry.finished(u, False)
+                return {"status": verdict}
+        res = waiter.result()
+        watch.finish(res.get("status") == "complete", int(res.get("totalLength") or 0))
+        if telemetry:
+            telemetry.finished(u, res.get("status") == "complete", int(res.get("totalLength") or 0))
+        if on_done and res.get("status") == "complete":
+            on_done(u)
+        return res
+
+    async def run() -> dict:
+        daemon = Aria2Daemon(url=ARIA2_RPC_URL, secret=ARIA2_RPC_SECRET, max_concurrent=ARIA2_CONCURRENCY,
+                             max_download_limit=ARIA2_MAX_DOWNLOAD_LIMIT)
+        await daemon.start()
+        # submit only a little ahead of aria2's slots, so its waiting queue and each status poll stay small
+        submit = asyncio.Semaphore(2 * ARIA2_CONCURRENCY)
+
+        async def submitted(u: str) -> dict:
+            async with submit:
+                return await one(daemon, u)
+
+        try:
+            results = await asyncio.gather(*(submitted(u) for u in urls), return_exceptions=True)
+        finally:
+            await daemon.stop()
+        statuses = {}
+        for u, res in zip(urls, results):
+            if isinstance(res, BaseException):
+                logger.warning("aria2 RPC error for URL: %s -> %s", u, res)
+                statuses[u] = "ERR"
+            else:
+                statuses[u] = codes.get(res.get("status"), "UNKNOWN")
+                if statuses[u] == "ERR":
+                    logger.debug("aria2c failed for URL: %s (%s)", u, res.get("errorMessage"))
+        return statuses
+
+    logger.info(f"▶ aria2c RPC: {len(urls)} URL(s), -j {ARIA2_CONCURRENCY}, "
+                f"daemon {ARIA2_RPC_URL or 'local'}")
+    statuses = asyncio.run(run())
+    ok = sum(1 for st in statuses.values() if st == "OK")
+    logger.info(f"aria2c RPC finished: {ok}/{len(urls)} OK")
+    return statuses
+
+
+def run_aria2_per_url(urls, names: dict, download_dir: str, url_list: str,
+                      on_done: Optional[Callable[[str], None]] = None,
+                      telemetry: Optional[ProgressTelemetry] = None) -> dict:
+    """One aria2c process per URL, each stopped on a stall or its adaptive deadline (TIMEOUTS).
+    Returns {url: status}."""
+    with open(url_list, "w", encoding="utf-8") as f:
+        for u in urls:
+            f.write(u + "\n")
+    console_log = os.path.join(download_dir, "aria2_per_url.log")
+    logger.info(f"▶ aria2c starting per-URL ({len(urls)} URLs), timeout {ARIA2_PER_URL_TIMEOUT}-{ARIA2_MAX_TIMEOUT}s "
+                f"each by size and host speed, stall after {ARIA2_STALL_TIMEOUT}s")
+    flags = [f for f in ARIA2_COMMON_FLAGS if not f.startswith(("--timeout=", "--max-tries=", "--summary-interval="))]
+
+    statuses = {}
+    with open(console_log, "w", encoding="utf-8") as log, \
+            open(console_log, "r", encoding="utf-8", errors="replace") as tail:
+        for u in urls:
+            aria2_cmd = [
+                "aria2c",
+                f"--dir={download_dir}",
+                f"--out={names[u]}",
+                # a readout every second feeds the stall detector and the size-based deadline
+                "--summary-interval=1",
+                f"--lowest-speed-limit={ARIA2_LOWEST_SPEED}",
+                f"--timeout={ARIA2_STALL_TIMEOUT}",
+                f"--connect-timeout={ARIA2_STALL_TIMEOUT}",
+                f"--max-tries={ARIA2_MAX_TRIES}",
+                # pass the URL directly so each run handles one resource and can be timed out
+                u,
+                *flags,
+            ]
+            watch = TIMEOUTS.watch(u)
+            try:
+                rc, verdict = _run_watched(aria2_cmd, log, tail, watch, telemetry)
+            except Exception as e:
+                logger.warning("aria2c raised exception for URL: %s -> %s", u, e)
+                statuses[u] = "ERR"
+                if telemetry:
+                    telemetry.finished(u, False)
+                continue
+            if verdict:
+                logger.warning("aria2c %s for URL: %s (%d of %s bytes after %.0fs)", verdict.lower(), u,
+                               watch.completed, watch.total or "?", time.monotonic() - watch.started)
+                statuses[u] = verdict
+            elif rc != 0:
+                logger.warning("aria2c failed for URL: %s (rc=%s)", u, rc)
+                statuses[u] = "ERR"
+            else:
+                statuses[u] = "OK"
+                path = os.path.join(download_dir, names[u])
+                watch.finish(True, os.path.getsize(path) if os.path.exists(path) else None)
+                if on_done:
+                    on_done(u)
+            if telemetry:
+                telemetry.finished(u, statuses[u] == "OK")
+    return statuses
+
+
+def _run_watched(cmd: list, log, tail, watch, telemetry: Optional[ProgressTelemetry] = None
+                 ) -> tuple[int, Optional[str]]:
+    """Run aria2c, feeding its readout (appended to log, read back through tail) to watch
+    and telemetry.
+    Returns (returncode, None), or (returncode, "STALL" / "TIMEOUT") if it had to be killed."""
+    proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, text=True, **new_group_kwargs())
+    verdict = None
+    pending = ""
+    try:
+        while proc.poll() is None:
+            time.sleep(0.5)
+            pending += tail.read()
+            lines, _, pending = pending.rpartition("\n")
+            readout = parse_readout(lines)
+            if readout:
+                e = readout[-1]
+                verdict = watch.update(e["completed"], e["total"])
+                if telemetry:
+                    telemetry.active(watch.url, e["completed"], e["total"], e["speed"], e["connections"])
+            else:
+                verdict = watch.update(None)
+            if telemetry:
+                telemetry.tick()
+            if verdict:
+                kill_process_tree(proc.pid)
+                break
+    except BaseException:
+        kill_process_tree(proc.pid)
+        proc.wait()
+        raise
+    rc = proc.wait()
+    tail.read()
+    return rc, verdict
+
+
+def write_results(path: str, rows: list[dict]):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["url", "file", "aria2_status", "outcome"])
+        writer.writeheader()
+        writer.writerows(rows)
+
+
 # ── CORE LOGIC ─────────────────────────────────────────────────────────────
+class _Progress:
+    """Records per-URL outcomes in the CSV's journal (crash-safe resume) and in the shared ledger."""
+
+    def __init__(self, journal: DownloadJournal, ledger: DownloadLedger, csv_name: str,
+                 names: dict, download_dir: str):
+        self.journal = journal
+        self.ledger = ledger
+        self.csv_name = csv_name
+        self.names = names
+        self.download_dir = download_dir
+
+    def path(self, url: str) -> str:
+        return os.path.join(self.download_dir, self.names[url])
+
+    def is_done(self, url: str) -> bool:
+        return self.journal.records.get(url, {}).get("status") == DONE
+
+    def done(self, url: str, via: str, size: Optional[int] = None, sha256: Optional[str] = None):
+        if self.is_done(url):
+            return
+        path = self.path(url)
+        if sha256 is None:
+            # read once here and shared by the dedup lookup and the ledger row
+            sha256 = file_sha256(path)
+        fields = {}
+        if ARIA2_DEDUP:
+            canonical = self._dedup(url, path, sha256)
+            if canonical is not None:
+                fields["duplicate_of"] = canonical
+        self.journal.record(url, DONE, file=self.names[url], via=via, **fields)
+        self.ledger.mark_done(url, path, self.csv_name, via, size=size, sha256=sha256)
+
+    def _dedup(self, url: str, path: str, sha256: str) -> Optional[str]:
+        """Hardlink path to an earlier file with the same content; returns that file's URL."""
+        size = os.path.getsize(path)
+        for row in self.ledger.same_content(sha256, url):
+            canonical = row["path"]
+            try:
+                if os.path.getsize(canonical) != size:
+                    continue
+                linked = os.path.samefile(canonical, path) or _replace_with_link(canonical, path)
+            except OSError:
+                continue  # canonical file moved or deleted since
+            self.ledger.mark_duplicate(url, path, row["url"], canonical, sha256, linked, self.csv_name)
+            logger.debug("Duplicate of %s: %s (%s)", row["url"], url, "hardlinked" if linked else "kept")
+            return row["url"]
+        return None
+
+    def failed(self, url: str, error: str):
+        self.journal.record(url, FAILED, file=self.names[url], error=error)
+        self.ledger.mark_failed(url, error, self.csv_name, self.path(url))
+
+
+def _replace_with_link(src: str, dst: str) -> bool:
+    """Atomically replace dst by a hardlink to src; False (dst kept) if they cannot be linked."""
+    tmp = dst + ".link"
+    try:
+        os.link(src, tmp)
+        os.replace(tmp, dst)
+        return True
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return False
+
+
+def _same_file(a: str, b: str) -> bool:
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
+
+
+def _unlink_shared_targets(urls, progress: _Progress):
+    """Remove target files that are hardlinks (dedup, reuse across CSVs) before downloading into
+    them: aria2 --allow-overwrite rewrites a file in place, i.e. through the link into the
+    canonical copy. Unshared partial downloads with a .aria2 control file are kept for --continue;
+    other leftovers are removed too."""
+    for u in urls:
+        target = progress.path(u)
+        try:
+            st = os.stat(target)
+        except OSError:
+            continue
+        if st.st_nlink > 1 or not os.path.exists(target + ".aria2"):
+            os.unlink(target)
+
+
+def _link_or_copy(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
 def download_from_csv(csv_path: str, base_dir: str):
     base_name = os.path.basename(csv_path)
     prefix = base_name.replace("_merged.csv", "")
@@ -122,90 +607,140 @@ def download_from_csv(csv_path: str, base_dir: str):
         logger.warning("No valid URLs found.")
         return
 
+    # names come from the full CSV list so they stay the same when a run is resumed
+    names = target_names(initial_urls)
+
+    journal = DownloadJournal(os.path.join(download_dir, ".aria2_journal.jsonl"), base_name)
+    journal.replay()
     state_path = os.path.join(download_dir, ".aria2_state.json")
-    existing_state = load_state(state_path)
+    migrate_state(journal, load_state(state_path), initial_urls)
+    ledger = DownloadLedger(ARIA2_LEDGER)
+    progress = _Progress(journal, ledger, base_name, names, download_dir)
 
-    # Determine which URL list to use: resume if same CSV recorded
-    if existing_state and existing_state.get("csv") == base_name:
-        urls = existing_state.get("remaining", initial_urls)
-        logger.info(f"Resuming previous state with {len(urls)} remaining URL(s).")
+    journal.open()
+    remove_state(state_path)
+    try:
+        urls, given_up = _plan(initial_urls, progress)
+        _download_urls(urls, prefix, progress)
+        duplicates = ledger.duplicates(base_name)
+        if duplicates:
+            write_duplicates(os.path.join(download_dir, f"{prefix}_duplicates.csv"), duplicates)
+            linked = sum(row["linked"] for row in duplicates)
+            logger.info(f"{len(duplicates)} URL(s) duplicate content of another URL ({linked} hardlinked), "
+                        f"see {prefix}_duplicates.csv")
+    finally:
+        journal.close()
+        ledger.close()
+    left = len(initial_urls) - len(journal.done()) - len(given_up)
+    if left <= 0:
+        # Completed (or given up on): remove the journal to avoid confusion next task
+        journal.remove()
+        logger.info("✓ All URLs completed, journal removed.")
     else:
-        urls = initial_urls
-        _atomic_write(state_path, {
-            "csv": base_name,
-            "remaining": urls,
-            "started_at": datetime.utcnow().isoformat() + "Z"
-        })
-        logger.info(f"Created new state file with {len(urls)} URL(s).")
-
-    # Filter out already existing target files to avoid re-downloads
-    filtered = []
-    for u in urls:
-        tname = _target_name_from_url(u)
-        if tname and os.path.exists(os.path.join(download_dir, tname)):
-            logger.debug("Skipping existing file: %s", tname)
+        logger.warning(f"Some URLs remain ({left}). Journal kept for resume.")
+
+    logger.info("✓ Directory completed")
+
+
+def _plan(initial_urls, progress: _Progress) -> tuple[list, set]:
+    """Split the CSV into URLs to download now and URLs given up on, using the journal and the
+    ledger. URLs done in another CSV are linked into this directory instead of downloaded. Done
+    URLs of this CSV are trusted without touching the disk (unless ARIA2_VERIFY_LEDGER); only URLs
+    the ledger has never seen (files from before the ledger existed) and those done under another
+    path are probed on disk."""
+    journal, ledger = progress.journal, progress.ledger
+    rows = ledger.lookup(initial_urls)
+    urls, given_up, reused = [], set(), 0
+    for u in initial_urls:
+        row = rows.get(u)
+        target = progress.path(u)
+        if progress.is_done(u):
+            if row is None and os.path.exists(target):
+                ledger.mark_done(u, target, progress.csv_name, via="journal")
+            continue
+        if row is None:
+            if os.path.exists(target) and is_valid_pdf(target):
+                logger.debug("Skipping existing file: %s", progress.names[u])
+                progress.done(u, via="existing")
+            else:
+                urls.append(u)
+            continue
+        if row["status"] == DONE and row["path"]:
+            same_path = row["path"] == os.path.abspath(target)
+            if same_path and not ARIA2_VERIFY_LEDGER:
+                journal.record(u, DONE, file=progress.names[u], via="ledger")
+                continue
+            if os.path.exists(target):
+                if same_path:
+                    journal.record(u, DONE, file=progress.names[u], via="ledger")
+                    continue
+                if _same_file(row["path"], target):
+                    progress.done(u, via="ledger", size=row["size"], sha256=row["sha256"])
+                    continue
+                if is_valid_pdf(target):
+                    progress.done(u, via="existing")
+                    continue
+            elif os.path.exists(row["path"]):
+                # downloaded for another CSV: reuse the file
+                _link_or_copy(row["path"], target)
+                progress.done(u, via="ledger", size=row["size"], sha256=row["sha256"])
+                reused += 1
+                continue
+        if row["status"] == FAILED and 0 < ARIA2_MAX_ATTEMPTS <= row["attempts"]:
+            given_up.add(u)
             continue
-        filtered.append(u)
+        urls.append(u)
+    done = len(journal.done())
+    if done or given_up:
+        logger.info(f"Ledger: {done} URL(s) already done ({reused} reused from other CSVs), "
+                    f"{len(given_up)} given up after {ARIA2_MAX_ATTEMPTS} attempts, {len(urls)} to go.")
+    return urls, given_up
 
+
+def _download_urls(urls, prefix: str, progress: _Progress):
+    names, download_dir = progress.names, progress.download_dir
+    filtered = urls
     if not filtered:
-        logger.info("All files already present, cleaning up state.")
-        remove_state(state_path)
+        logger.info("All files already present.")
         return
 
     url_list = os.path.join(download_dir, f"{prefix}_urls.txt")
-    with open(url_list, "w", encoding="utf-8") as f:
-        for u in filtered:
-            f.write(u + "\n")
-
-    # Save current remaining list before starting aria2
-    _atomic_write(state_path, {
-        "csv": base_name,
-        "remaining": filtered,
-        "started_at": datetime.utcnow().isoformat() + "Z"
-    })
+    _unlink_shared_targets(filtered, progress)
 
-    # Run aria2 per-URL with a short timeout to avoid getting stuck on slow servers.
-    ARIA2_PER_URL_TIMEOUT = 30  # seconds
-    PLAYWRIGHT_TIMEOUT_MS = ARIA2_PER_URL_TIMEOUT * 1000  # milliseconds for Playwright API
-    logger.info(f"▶ aria2c starting per-URL ({len(filtered)} URLs), timeout={ARIA2_PER_URL_TIMEOUT}s each")
+    # ── PRE-FLIGHT PROBE ──────────────────────────────────────────────
+    browser_only = []
+    if PROBE_URLS:
+        filtered, browser_only = _probe_and_route(filtered, prefix, progress)
 
-    aria2_errors = []
-    for u in filtered:
-        tname = _target_name_from_url(u) or u
-        aria2_cmd = [
-            "aria2c",
-            f"--dir={download_dir}",
-            # pass the URL directly so each run handles one resource and can be timed out
-            u,
-            *ARIA2_COMMON_FLAGS,
-        ]
+    def aria2_done(u: str):
+        if is_valid_pdf(progress.path(u)):
+            progress.done(u, via="aria2")
 
+    if not filtered:
+        aria2_status = {}
+    else:
+        telemetry = ProgressTelemetry(os.path.join(download_dir, f"{prefix}_progress.jsonl"), len(filtered),
+                                      interval=ARIA2_PROGRESS_INTERVAL)
         try:
-            result = subprocess.run(
-                aria2_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                timeout=ARIA2_PER_URL_TIMEOUT,
-            )
-            if result.returncode != 0:
-                logger.warning("aria2c failed for URL: %s (rc=%s)", u, result.returncode)
-                logger.debug(result.stderr)
-                aria2_errors.append(u)
-        except subprocess.TimeoutExpired:
-            logger.warning("aria2c timed out for URL: %s", u)
-            aria2_errors.append(u)
-        except Exception as e:
-            logger.warning("aria2c raised exception for URL: %s -> %s", u, e)
-            aria2_errors.append(u)
+            if ARIA2_RPC:
+                aria2_status = run_aria2_rpc(filtered, names, download_dir, url_list, aria2_done, telemetry)
+            elif ARIA2_BATCH:
+                aria2_status = run_aria2_batch(filtered, names, download_dir, url_list, aria2_done, telemetry)
+            else:
+                aria2_status = run_aria2_per_url(filtered, names, download_dir, url_list, aria2_done, telemetry)
+            # downloads whose end never showed up in the output (e.g. errors only listed in the results table)
+            for u, status in aria2_status.items():
+                telemetry.finished(u, status == "OK")
+        finally:
+            telemetry.close()
 
     # ── POST-VALIDATION ───────────────────────────────────────────────
+    # only the files this run wrote; verdicts are cached for the checks below
     bad_files = []
-    for fname in os.listdir(download_dir):
-        if fname.lower().endswith(".pdf"):
-            full = os.path.join(download_dir, fname)
-            if not is_valid_pdf(full):
-                bad_files.append(fname)
+    for u in filtered:
+        reason = pdf_rejection_reason(progress.path(u))
+        if reason is not None and reason != "missing":
+            bad_files.append(names[u])
 
     if bad_files:
         fail_log = os.path.join(download_dir, "invalid_pdfs.log")
@@ -216,90 +751,132 @@ def download_from_csv(csv_path: str, base_dir: str):
 
     # Recompute remaining URLs after aria2 run
     remaining = []
+    result_rows = []
     for u in filtered:
-        tname = _target_name_from_url(u)
-        target_path = os.path.join(download_dir, tname) if tname else None
+        tname = names[u]
+        target_path = os.path.join(download_dir, tname)
         # If aria2 produced a valid file, consider it done
-        if tname and target_path and os.path.exists(target_path) and is_valid_pdf(target_path):
-            continue
-        # otherwise mark for fallback (includes those errored/timed out)
-        remaining.append(u)
-
-    if remaining:
-        # Try Playwright fallback for any remaining URLs (one-by-one)
-        logger.info(f"Attempting Playwright fallback for {len(remaining)} remaining URL(s)...")
-        try:
-            from src.post_process.download_with_playwrite import download_with_playwright
-        except Exception:
-            download_with_playwright = None
+        if os.path.exists(target_path) and is_valid_pdf(target_path):
+            outcome = "ok"
+            progress.done(u, via="aria2")
+        else:
+            # otherwise mark for fallback (includes those errored/timed out)
+            outcome = "invalid" if os.path.exists(target_path) else "failed"
+            remaining.append(u)
+        result_rows.append({"url": u, "file": tname, "aria2_status": aria2_status.get(u, "UNKNOWN"),
+                            "outcome": outcome})
+    write_results(os.path.join(download_dir, f"{prefix}_aria2_results.csv"), result_rows)
+    logger.info(f"aria2c: {len(filtered) - len(remaining)} valid PDF(s), {len(remaining)} left for fallback")
+
+    # landing pages found by the probe never went through aria2
+    for u in browser_only:
+        aria2_status[u] = "PROBE_HTML"
+    remaining += browser_only
+    if not remaining:
+        return
+    # If a file turned up in the meantime (e.g. a concurrent run), it is done
+    for u in list(remaining):
+        if is_valid_pdf(progress.path(u)):
+            logger.debug("File already present after aria2: %s", names[u])
+            progress.done(u, via="aria2")
+            remaining.remove(u)
+
+    def playwright_result(u: str, ok: bool, error: Optional[str] = None):
+        if ok and is_valid_pdf(progress.path(u)):
+            logger.info("Playwright downloaded: %s", names[u])
+            progress.done(u, via="playwright")
+        else:
+            logger.warning("Playwright fallback failed for URL: %s (%s)", u, error or "no download")
+            progress.failed(u, f"aria2 {aria2_status.get(u, 'UNKNOWN')}; playwright {error or 'failed'}")
 
-        still_remaining = []
+    if importlib.util.find_spec("playwright") is None:
+        logger.warning(f"Playwright is not installed, no fallback for {len(remaining)} URL(s)")
         for u in remaining:
-            tname = _target_name_from_url(u)
-            if not tname:
-                logger.debug("No target filename derived; skipping playwright fallback: %s", u)
-                still_remaining.append(u)
-                continue
+            playwright_result(u, False, "not installed")
+    elif PLAYWRIGHT_BATCH:
+        logger.info(f"Attempting batched Playwright fallback for {len(remaining)} remaining URL(s) "
+                    f"({PLAYWRIGHT_CONCURRENCY} concurrent contexts)...")
+        _playwright_batch(remaining, progress, playwright_result)
+    else:
+        logger.info(f"Attempting Playwright fallback for {len(remaining)} remaining URL(s)...")
+        _playwright_per_url(remaining, progress, playwright_result)
 
-            save_path = os.path.join(download_dir, tname)
 
-            # If file already present (joined race), skip
-            if os.path.exists(save_path) and is_valid_pdf(save_path):
-                logger.debug("File already present after aria2: %s", tname)
-                continue
+def _probe_and_route(urls: list[str], prefix: str, progress: _Progress) -> tuple[list, list]:
+    """Probe urls (url_probe.py) and split them into (for aria2, for the browser only).
+    Dead URLs and redirects to a sign-in page are recorded as failed and dropped."""
+    download_dir = progress.download_dir
+    logger.info(f"▶ Probing {len(urls)} URL(s), {PROBE_CONCURRENCY} at a time...")
+    probes = url_probe.probe_urls(urls, concurrency=PROBE_CONCURRENCY, per_host=PROBE_PER_HOST, timeout=PROBE_TIMEOUT)
+    with open(os.path.join(download_dir, f"{prefix}_probe.csv"), "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["url", "kind", "status", "final_url", "content_type", "length", "error"])
+        writer.writeheader()
+        writer.writerows(probes[u] for u in urls)
 
-            ok = False
-            if download_with_playwright:
-                try:
-                    # Run the playwright downloader as a separate process with an enforced timeout
-                    script_path = os.path.join(os.path.dirname(__file__), "download_with_playwrite.py")
-                    cmd = [sys.executable, script_path, u, save_path, "--timeout", str(PLAYWRIGHT_TIMEOUT_MS)]
-                    logger.debug("Running Playwright subprocess: %s", cmd)
-                    try:
-                        proc = subprocess.run(
-                            cmd,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            text=True,
-                            timeout=(PLAYWRIGHT_TIMEOUT_MS // 1000) + 5,
-                        )
-                        logger.debug("Playwright subprocess stdout: %s", proc.stdout)
-                        if proc.returncode == 0:
-                            ok = True
-                        else:
-                            logger.debug("Playwright subprocess failed (rc=%s): %s", proc.returncode, proc.stderr)
-                            ok = False
-                    except subprocess.TimeoutExpired:
-                        logger.warning("Playwright subprocess timed out for URL: %s", u)
-                        ok = False
-                except Exception as e:
-                    logger.debug("Playwright subprocess invocation error: %s", e)
-                    ok = False
-
-            if ok and is_valid_pdf(save_path):
-                logger.info("Playwright downloaded: %s", tname)
-            else:
-                logger.warning("Playwright fallback failed for URL: %s", u)
-                still_remaining.append(u)
-
-        if still_remaining:
-            # Update state with remaining URLs so the next run can resume
-            _atomic_write(state_path, {
-                "csv": base_name,
-                "remaining": still_remaining,
-                "updated_at": datetime.utcnow().isoformat() + "Z"
-            })
-            logger.warning(f"Some URLs remain ({len(still_remaining)}). State updated for resume.")
+    for_aria2, browser_only, counts = [], [], {}
+    for u in urls:
+        probe = probes[u]
+        kind = probe["kind"]
+        counts[kind] = counts.get(kind, 0) + 1
+        if kind in (url_probe.DEAD, url_probe.LOGIN):
+            progress.failed(u, f"probe: {kind} (HTTP {probe['status']})")
+        elif kind == url_probe.HTML:
+            browser_only.append(u)
         else:
-            # Completed successfully: remove state to avoid confusion next task
-            remove_state(state_path)
-            logger.info("✓ All URLs completed, state removed.")
-    else:
-        # Completed successfully: remove state to avoid confusion next task
-        remove_state(state_path)
-        logger.info("✓ All URLs completed, state removed.")
+            for_aria2.append(u)
+    logger.info("Probe: " + ", ".join(f"{n} {k}" for k, n in sorted(counts.items())) +
+                f" → {len(for_aria2)} to aria2, {len(browser_only)} to the browser, "
+                f"{len(urls) - len(for_aria2) - len(browser_only)} skipped")
+    return for_aria2, browser_only
 
-    logger.info("✓ Directory completed")
+
+def _playwright_batch(remaining: list[str], progress: _Progress, on_result: Callable):
+    """One browser for all remaining URLs (playwright_batch.py); each URL keeps its own deadline."""
+    from src.post_process.playwright_batch import run_batch
+
+    reported = set()
+
+    def report(u: str, ok: bool, error: Optional[str]):
+        reported.add(u)
+        on_result(u, ok, error)
+
+    try:
+        run_batch([(u, progress.path(u)) for u in remaining], concurrency=PLAYWRIGHT_CONCURRENCY,
+                  timeout_ms=PLAYWRIGHT_TIMEOUT_MS, deadline=PLAYWRIGHT_TIMEOUT_MS / 1000 + 5,
+                  on_result=report)
+    except Exception as e:
+        logger.error(f"Batched Playwright fallback failed: {e}")
+    for u in remaining:
+        if u not in reported:
+            on_result(u, False, "batch aborted")
+
+
+def _playwright_per_url(remaining: list[str], progress: _Progress, on_result: Callable):
+    """One download_with_playwrite.py subprocess per URL, with an enforced timeout."""
+    script_path = os.path.join(os.path.dirname(__file__), "download_with_playwrite.py")
+    for u in remaining:
+        save_path = progress.path(u)
+        cmd = [sys.executable, script_path, u, save_path, "--timeout", str(PLAYWRIGHT_TIMEOUT_MS)]
+        logger.debug("Running Playwright subprocess: %s", cmd)
+        error = None
+        try:
+            proc = subprocess.run(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                timeout=(PLAYWRIGHT_TIMEOUT_MS // 1000) + 5,
+            )
+            logger.debug("Playwright subprocess stdout: %s", proc.stdout)
+            ok = proc.returncode == 0
+            if not ok:
+                logger.debug("Playwright subprocess failed (rc=%s): %s", proc.returncode, proc.stderr)
+        except subprocess.TimeoutExpired:
+            ok, error = False, "timeout"
+        except Exception as e:
+            logger.debug("Playwright subprocess invocation error: %s", e)
+            ok = False
+        on_result(u, ok, error)
 
 
 def process_directory(root: str):
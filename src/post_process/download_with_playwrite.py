@@ -16,24 +16,74 @@ Notes:
 from __future__ import annotations
 import argparse
 import os
+import sys
 from pathlib import Path
 
 import requests
 import logging
 import base64
 
+try:
+    from src.utils.content_sniffer import ContentMismatch, PdfSniffer
+except ImportError:
+    # run as a script (the download server and download_with_aria2 spawn it by path)
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+    from src.utils.content_sniffer import ContentMismatch, PdfSniffer
+
 # basic logger for this module
 logger = logging.getLogger(__name__)
 if not logger.handlers:
     logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+# anti-detection script to mask navigator.webdriver and other properties
+_STEALTH_INIT_SCRIPT = """
+Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
+Object.defineProperty(navigator, 'languages', {get: () => ['en-US', 'en']});
+Object.defineProperty(navigator, 'plugins', {get: () => [1,2,3]});
+window.chrome = { runtime: {} };
+"""
+
+# blob: / data: URLs of in-page generated PDFs, and a fetch of one of them as base64
+_FIND_BLOB_URLS_JS = "() => { const urls = []; const els = document.querySelectorAll('iframe,embed,object,a'); els.forEach(e=>{ const s = e.src || e.getAttribute('href'); if(s && (s.startsWith('blob:') || s.startsWith('data:'))) urls.push(s); }); return urls; }"
+_FETCH_BLOB_B64_JS = "(u) => fetch(u).then(r => r.arrayBuffer()).then(b => { let arr = new Uint8Array(b); let CHUNK = 0x8000; let s = ''; for (let i = 0; i < arr.length; i += CHUNK) { s += String.fromCharCode.apply(null, Array.from(arr.subarray(i, i + CHUNK))); } return btoa(s); })"
+
+# navigation wait modes tried in turn while waiting for a download event
+_WAIT_MODES = ('networkidle', 'load', 'domcontentloaded')
+
+
+def browser_context_options(user_agent: str | None = None) -> dict:
+    """Keyword arguments for browser.new_context() matching download_with_playwright's context."""
+    return {
+        "accept_downloads": True,
+        "locale": "en-US",
+        "user_agent": user_agent or USER_AGENT,
+        "extra_http_headers": {
+            "Accept": "application/pdf,*/*;q=0.9",
+            "Accept-Language": "en-US,en;q=0.9",
+        },
+    }
+
+
+def _is_pdf_response(resp) -> bool:
+    """True for a response the browser received with a PDF content-type."""
+    return 'application/pdf' in (resp.headers.get('content-type') or '').lower()
+
+
+def _write_bytes_atomic(save_path: str, body: bytes):
+    tmp_path = str(Path(save_path).with_suffix(Path(save_path).suffix + '.partial'))
+    with open(tmp_path, 'wb') as f:
+        f.write(body)
+    os.replace(tmp_path, save_path)
+
 
 def _quick_http_probe_and_download(url: str, save_path: str, timeout_seconds: int = 10) -> bool:
     """Quickly probe the URL with requests; if it looks like a PDF serve, download via requests.
     This avoids launching Playwright for simple direct-file URLs and prevents Playwright hangs.
     """
     headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+        "User-Agent": USER_AGENT,
         "Accept": "application/pdf,*/*;q=0.9",
         "Accept-Language": "en-US,en;q=0.9",
     }
@@ -46,10 +96,18 @@ def _quick_http_probe_and_download(url: str, save_path: str, timeout_seconds: in
             if "application/pdf" in ctype or "attachment" in disp.lower() or url.lower().endswith(".pdf"):
                 logger.debug("Quick HTTP probe: direct PDF detected (ctype=%s, disp=%s). Streaming to %s", ctype, disp, save_path)
                 tmp_path = str(Path(save_path).with_suffix(Path(save_path).suffix + ".partial"))
-                with open(tmp_path, "wb") as f:
-                    for chunk in r.iter_content(chunk_size=64 * 1024):
-                        if chunk:
-                            f.write(chunk)
+                sniffer = PdfSniffer(ctype)
+                try:
+                    with open(tmp_path, "wb") as f:
+                        for chunk in r.iter_content(chunk_size=64 * 1024):
+                            if chunk:
+                                f.write(sniffer.feed(chunk))
+                        f.write(sniffer.finish())
+                except ContentMismatch as e:
+                    # e.g. an HTML challenge page behind a .pdf URL: leave it to Playwright
+                    logger.debug("Quick HTTP probe: body is not a PDF (%s), aborted: %s", e, url)
+                    os.remove(tmp_path)
+                    return False
                 os.replace(tmp_path, save_path)
                 return True
             else:
@@ -88,26 +146,15 @@ def download_with_playwright(url: str, save_path: str, timeout: int = 30000) ->
     # helper to attempt a download with specific launch/context options
     def _attempt(headless: bool = True, extra_args: list | None = None, user_agent: str | None = None) -> bool:
         extra_args = extra_args or []
-        # common browser-like headers
-        headers = {
-            "Accept": "application/pdf,*/*;q=0.9",
-            "Accept-Language": "en-US,en;q=0.9",
-        }
 
         with sync_playwright() as p:
             browser = p.chromium.launch(headless=headless, args=extra_args)
             # create a more realistic context
-            context = browser.new_context(accept_downloads=True, locale="en-US", user_agent=(user_agent or "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"), extra_http_headers=headers)
+            context = browser.new_context(**browser_context_options(user_agent))
             page = context.new_page()
 
-            # anti-detection script to mask navigator.webdriver and other properties
             try:
-                page.add_init_script("""
-                Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
-                Object.defineProperty(navigator, 'languages', {get: () => ['en-US', 'en']});
-                Object.defineProperty(navigator, 'plugins', {get: () => [1,2,3]});
-                window.chrome = { runtime: {} };
-                """)
+                page.add_init_script(_STEALTH_INIT_SCRIPT)
             except Exception:
                 pass
 
@@ -117,15 +164,9 @@ def download_with_playwright(url: str, save_path: str, timeout: int = 30000) ->
 
                 def _on_response(resp):
                     try:
-                        ct = (resp.headers.get('content-type') or '').lower()
-                        # Only capture if response looks like a PDF
-                        if 'application/pdf' in ct:
+                        if _is_pdf_response(resp):
                             logger.debug('Playwright: response with PDF content-type detected: %s', resp.url)
-                            body = resp.body()
-                            tmp_path = str(Path(save_path).with_suffix(Path(save_path).suffix + '.partial'))
-                            with open(tmp_path, 'wb') as f:
-                                f.write(body)
-                            os.replace(tmp_path, save_path)
+                            _write_bytes_atomic(save_path, resp.body())
                             saved['done'] = True
                     except Exception as e:
                         logger.debug('Playwright: error in response handler: %s', e)
@@ -133,9 +174,8 @@ def download_with_playwright(url: str, save_path: str, timeout: int = 30000) ->
                 page.on('response', _on_response)
 
                 # Try download event first (covers navigations that trigger browser download)
-                wait_options = ['networkidle', 'load', 'domcontentloaded']
                 download_saved = False
-                for wait_mode in wait_options:
+                for wait_mode in _WAIT_MODES:
                     try:
                         logger.debug("Playwright: goto %s (wait_until=%s) headless=%s", url, wait_mode, headless)
                         with page.expect_download(timeout=timeout) as download_info:
@@ -174,11 +214,7 @@ def download_with_playwright(url: str, save_path: str, timeout: int = 30000) ->
 
                     if resp and getattr(resp, 'status', None) == 200:
                         logger.debug('Playwright: page.request returned 200; saving body')
-                        body = resp.body()
-                        tmp_path = str(Path(save_path).with_suffix(Path(save_path).suffix + '.partial'))
-                        with open(tmp_path, 'wb') as f:
-                            f.write(body)
-                        os.replace(tmp_path, save_path)
+                        _write_bytes_atomic(save_path, resp.body())
                         return True
                 except Exception as e:
                     logger.debug('Playwright: exception during request GET fallback: %s', e)
@@ -186,18 +222,14 @@ def download_with_playwright(url: str, save_path: str, timeout: int = 30000) ->
                 # Final attempt: handle blob: URLs or in-page generated PDFs by fetching within the page
                 try:
                     logger.debug('Playwright: scanning for blob/data URLs in page')
-                    blob_urls = page.evaluate("() => { const urls = []; const els = document.querySelectorAll('iframe,embed,object,a'); els.forEach(e=>{ const s = e.src || e.getAttribute('href'); if(s && (s.startsWith('blob:') || s.startsWith('data:'))) urls.push(s); }); return urls; }")
+                    blob_urls = page.evaluate(_FIND_BLOB_URLS_JS)
                     for burl in blob_urls:
                         try:
                             logger.debug('Playwright: attempting to fetch blob URL in page: %s', burl)
                             # fetch the blob and return base64 string
-                            b64 = page.evaluate("(u) => fetch(u).then(r => r.arrayBuffer()).then(b => { let arr = new Uint8Array(b); let CHUNK = 0x8000; let s = ''; for (let i = 0; i < arr.length; i += CHUNK) { s += String.fromCharCode.apply(null, Array.from(arr.subarray(i, i + CHUNK))); } return btoa(s); })", burl)
+                            b64 = page.evaluate(_FETCH_BLOB_B64_JS, burl)
                             if b64:
-                                body = base64.b64decode(b64)
-                                tmp_path = str(Path(save_path).with_suffix(Path(save_path).suffix + '.partial'))
-                                with open(tmp_path, 'wb') as f:
-                                    f.write(body)
-                                os.replace(tmp_path, save_path)
+                                _write_bytes_atomic(save_path, base64.b64decode(b64))
                                 return True
                         except Exception as e:
                             logger.debug('Playwright: blob fetch failed for %s: %s', burl, e)
@@ -227,6 +259,88 @@ def download_with_playwright(url: str, save_path: str, timeout: int = 30000) ->
     return ok2
 
 
+async def download_in_context(context, url: str, save_path: str, timeout: int = 30000) -> bool:
+    """Async counterpart of one download_with_playwright attempt, run inside a caller-owned
+    playwright.async_api BrowserContext (e.g. one leased from the download server's browser pool).
+    The caller owns the context and closes it. Returns True on success."""
+    try:
+        mod = __import__("playwright.async_api", fromlist=["TimeoutError"])
+        PlaywrightTimeoutError = getattr(mod, "TimeoutError")
+    except Exception:
+        return False
+
+    save_path = str(Path(save_path))
+    dest_dir = os.path.dirname(save_path)
+    if dest_dir and not os.path.exists(dest_dir):
+        os.makedirs(dest_dir, exist_ok=True)
+
+    page = await context.new_page()
+    try:
+        await page.add_init_script(_STEALTH_INIT_SCRIPT)
+    except Exception:
+        pass
+
+    saved = {"done": False}
+
+    async def _on_response(resp):
+        try:
+            if _is_pdf_response(resp) and not saved['done']:
+                logger.debug('Playwright: response with PDF content-type detected: %s', resp.url)
+                _write_bytes_atomic(save_path, await resp.body())
+                saved['done'] = True
+        except Exception as e:
+            logger.debug('Playwright: error in response handler: %s', e)
+
+    page.on('response', _on_response)
+
+    for wait_mode in _WAIT_MODES:
+        try:
+            logger.debug("Playwright: goto %s (wait_until=%s)", url, wait_mode)
+            async with page.expect_download(timeout=timeout) as download_info:
+                await page.goto(url, wait_until=wait_mode, timeout=timeout)
+            download = await download_info.value
+            await download.save_as(save_path)
+            if os.path.exists(save_path) and os.path.getsize(save_path) > 0:
+                return True
+        except PlaywrightTimeoutError:
+            logger.debug("Playwright: expect_download timed out for wait_until=%s", wait_mode)
+            if saved['done']:
+                return True
+            continue
+        except Exception as e:
+            logger.debug("Playwright: unexpected exception during expect_download (wait_until=%s): %s", wait_mode, e)
+            break
+
+    if saved['done']:
+        return True
+
+    # request API shares the context's cookies
+    try:
+        resp = await page.request.get(url, timeout=timeout)
+        if resp.status == 200:
+            logger.debug('Playwright: page.request returned 200; saving body')
+            _write_bytes_atomic(save_path, await resp.body())
+            return True
+    except Exception as e:
+        logger.debug('Playwright: exception during request GET fallback: %s', e)
+
+    # blob: URLs or in-page generated PDFs
+    try:
+        blob_urls = await page.evaluate(_FIND_BLOB_URLS_JS)
+        for burl in blob_urls:
+            try:
+                b64 = await page.evaluate(_FETCH_BLOB_B64_JS, burl)
+                if b64:
+                    _write_bytes_atomic(save_path, base64.b64decode(b64))
+                    return True
+            except Exception as e:
+                logger.debug('Playwright: blob fetch failed for %s: %s', burl, e)
+    except Exception as e:
+        logger.debug('Playwright: error scanning/fetching blobs: %s', e)
+
+    return False
+
+
 def fallback_http_download(url: str, save_path: str, timeout: int = 60) -> bool:
     """Download file via HTTP as a fallback."""
     tmp_path = None
@@ -234,12 +348,19 @@ def fallback_http_download(url: str, save_path: str, timeout: int = 60) -> bool:
         with requests.get(url, stream=True, timeout=timeout) as r:
             r.raise_for_status()
             tmp_path = str(Path(save_path).with_suffix(Path(save_path).suffix + ".partial"))
+            sniffer = PdfSniffer(r.headers.get("Content-Type"))
             with open(tmp_path, "wb") as f:
                 for chunk in r.iter_content(chunk_size=64 * 1024):
                     if chunk:
-                        f.write(chunk)
+                        f.write(sniffer.feed(chunk))
+                f.write(sniffer.finish())
             os.replace(tmp_path, save_path)
         return True
+    except ContentMismatch as e:
+        logger.debug("HTTP fallback: body is not a PDF (%s), aborted: %s", e, url)
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
     except Exception:
         try:
             if tmp_path and os.path.exists(tmp_path):
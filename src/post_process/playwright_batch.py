@@ -0,0 +1,175 @@
+"""
+Batched Playwright fallback for src/post_process/download_with_aria2.py.
+
+Instead of one ``download_with_playwrite.py`` subprocess per URL (Python start-up, driver
+start and up to two Chromium launches each), one Chromium instance works through the whole
+list with ``concurrency`` isolated contexts at a time, each running download_in_context().
+
+Every URL has a hard deadline covering context creation, navigation, the HTTP fallback and
+context close. A context that cannot be closed after a deadline means a wedged browser: its
+processes are killed and a new browser is launched; URLs that were in flight in it are
+retried once.
+
+    results = run_batch([(url, "/data/pdfs/a.pdf"), ...], concurrency=4, timeout_ms=30000,
+                        on_result=lambda url, ok, error: ...)
+
+Requires playwright (pip install playwright && playwright install chromium).
+"""
+import asyncio
+import logging
+import os
+from typing import Callable, Optional
+
+from src.server.browser_pool import LAUNCH_ARGS, browser_pids
+from src.utils.pdf_validator import is_valid_pdf
+from src.utils.proc_utils import kill_pids
+
+logger = logging.getLogger(__name__)
+
+# (url, ok, error) -> None, called once per URL as soon as its result is known
+ResultFn = Callable[[str, bool, Optional[str]], None]
+
+
+class _BrowserHolder:
+    """One shared browser; relaunched when it disconnects or a context in it wedges."""
+
+    def __init__(self, playwright, headless: bool):
+        self._playwright = playwright
+        self.headless = headless
+        self.browser = None
+        self.generation = 0
+        self.launches = 0
+        self._lock = asyncio.Lock()
+
+    async def get(self):
+        async with self._lock:
+            if self.browser is None or not self.browser.is_connected():
+                await self._launch()
+            return self.browser, self.generation
+
+    async def _launch(self):
+        self.browser = await self._playwright.chromium.launch(headless=self.headless, args=LAUNCH_ARGS)
+        self.generation += 1
+        self.launches += 1
+
+    async def replace(self, generation: int):
+        """Kill the browser of ``generation`` (if still current) so the next get() relaunches."""
+        async with self._lock:
+            if generation != self.generation or self.browser is None:
+                return
+            browser, self.browser = self.browser, None
+            logger.warning("Playwright batch: browser wedged, killing and relaunching")
+            kill_pids(await browser_pids(browser, timeout=2))
+            try:
+                await asyncio.wait_for(browser.close(), timeout=5)
+            except Exception:
+                pass
+
+    async def close(self):
+        if self.browser is not None:
+            try:
+                await asyncio.wait_for(self.browser.close(), timeout=10)
+            except Exception:
+                kill_pids(await browser_pids(self.browser, timeout=2))
+            self.browser = None
+
+
+async def _download_one(holder: _BrowserHolder, url: str, save_path: str, timeout_ms: int,
+                        deadline: float, http_fallback: bool) -> tuple[bool, Optional[str], bool]:
+    """(ok, error, retry) for one URL."""
+    from src.post_process.download_with_playwrite import (
+        browser_context_options, download_in_context, fallback_http_download,
+    )
+
+    browser, generation = await holder.get()
+    box = {}
+
+    async def _run() -> bool:
+        box["ctx"] = await browser.new_context(**browser_context_options())
+        return await download_in_context(box["ctx"], url, save_path, timeout_ms)
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    error = None
+    try:
+        ok = await asyncio.wait_for(_run(), timeout=deadline)
+    except asyncio.TimeoutError:
+        ok, error = False, "timeout"
+    except Exception as e:
+        ok, error = False, f"playwright: {e}"
+    # closed outside the deadline, with its own timeout: a context that will not close means a wedged browser
+    ctx = box.get("ctx")
+    if ctx is not None and browser.is_connected():
+        try:
+            await asyncio.wait_for(ctx.close(), timeout=5)
+        except Exception:
+            await holder.replace(generation)
+    if error and error != "timeout" and not browser.is_connected():
+        # the browser died or was replaced under this URL: worth another try
+        return False, "browser restarted", True
+
+    if not ok and http_fallback:
+        remaining = deadline - (loop.time() - started)
+        if remaining > 1:
+            try:
+                ok = await asyncio.wait_for(
+                    asyncio.to_thread(fallback_http_download, url, save_path, int(remaining)), timeout=remaining)
+            except asyncio.TimeoutError:
+                ok = False
+    if ok and not is_valid_pdf(save_path):
+        ok, error = False, "not a valid PDF"
+    if not ok:
+        try:
+            if os.path.exists(save_path) and not is_valid_pdf(save_path):
+                os.remove(save_path)
+        except OSError:
+            pass
+    return ok, (None if ok else error or "no download"), False
+
+
+async def download_batch(items: list[tuple[str, str]], concurrency: int = 4, timeout_ms: int = 30000,
+                         deadline: Optional[float] = None, on_result: Optional[ResultFn] = None,
+                         http_fallback: bool = True, headless: bool = True) -> dict[str, bool]:
+    """Download (url, save_path) items with one browser and ``concurrency`` contexts.
+    ``deadline`` (seconds per URL) defaults to the Playwright timeout plus 5 s."""
+    from playwright.async_api import async_playwright
+
+    deadline = deadline or timeout_ms / 1000 + 5
+    queue: asyncio.Queue = asyncio.Queue()
+    for url, path in items:
+        queue.put_nowait((url, path, 0))
+    results: dict[str, bool] = {}
+
+    async with async_playwright() as playwright:
+        holder = _BrowserHolder(playwright, headless)
+
+        async def worker():
+            while True:
+                try:
+                    url, path, retries = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    ok, error, retry = await _download_one(holder, url, path, timeout_ms, deadline, http_fallback)
+                except Exception as e:
+                    # e.g. the browser could not be (re)launched
+                    ok, error, retry = False, f"playwright: {e}", False
+                if retry and retries < 1:
+                    queue.put_nowait((url, path, retries + 1))
+                    continue
+                results[url] = ok
+                if on_result:
+                    on_result(url, ok, error)
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, len(items))))))
+        finally:
+            await holder.close()
+    logger.info("Playwright batch: %d/%d downloaded, %d browser launch(es)",
+                sum(results.values()), len(items), holder.launches)
+    return results
+
+
+def run_batch(items: list[tuple[str, str]], **kwargs) -> dict[str, bool]:
+    """Blocking wrapper around download_batch()."""
+    return asyncio.run(download_batch(items, **kwargs))
@@ -47,6 +47,7 @@ def process_category(category_dir: str, ext: str, only_count: bool = False) -> t
     total_size = 0
     removed_dup = 0
     removed_non = 0
+    seen_inodes = set()  # hardlinked duplicates (download_with_aria2 dedup) take disk space once
     
     if only_count:
         logger.info(f"   📊 Counting only (no file modifications)")
@@ -88,8 +89,10 @@ def process_category(category_dir: str, ext: str, only_count: bool = False) -> t
 
             # accumulate
             try:
-                size = os.path.getsize(file_path)
-                total_size += size
+                st = os.stat(file_path)
+                if (st.st_dev, st.st_ino) not in seen_inodes:
+                    seen_inodes.add((st.st_dev, st.st_ino))
+                    total_size += st.st_size
                 file_count += 1
             except Exception as e:
                 logger.warning(f"Skipping size/count {file_path}: {e}")
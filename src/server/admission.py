@@ -0,0 +1,147 @@
+"""
+Admission control for the download server.
+
+Every upstream fetch (cache misses only; hits and coalesced requests are free) must hold a
+slot. Slots are limited globally and per upstream host. Waiting requests are queued in two
+lanes:
+
+- interactive: single-URL /download calls. Served first, and ``reserved`` slots are kept
+  for them so batch traffic can never take the whole server. The lane's wait queue is
+  bounded; when it is full, or a request waits longer than ``queue_timeout``, the request
+  is rejected with AdmissionRejected (the server answers 429 + Retry-After).
+- batch: /jobs workers. Not bounded here (the job runner already bounds its workers) and
+  only served when no interactive request can use the free slot.
+"""
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("host", "future")
+
+    def __init__(self, host: str, future: asyncio.Future):
+        self.host = host
+        self.future = future
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent: int = 32, per_host: int = 4, max_queue: int = 100,
+                 queue_timeout: float = 30, reserved: int = 4, retry_after: int = 5):
+        self.max_concurrent = max_concurrent
+        self.per_host = per_host
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.reserved = min(reserved, max(max_concurrent - 1, 0))
+        self.retry_after = retry_after
+        self.active = 0
+        self.active_by_lane = {INTERACTIVE: 0, BATCH: 0}
+        self.rejected = 0
+        self._by_host: dict[str, int] = {}
+        self._queues = {INTERACTIVE: deque(), BATCH: deque()}
+
+    def queued(self, lane: Optional[str] = None) -> int:
+        if lane:
+            return len(self._queues[lane])
+        return sum(len(q) for q in self._queues.values())
+
+    def _can_run(self, host: str, lane: str) -> bool:
+        limit = self.max_concurrent if lane == INTERACTIVE else self.max_concurrent - self.reserved
+        if self.active >= limit:
+            return False
+        return not self.per_host or self._by_host.get(host, 0) < self.per_host
+
+    def _take(self, host: str, lane: str):
+        self.active += 1
+        self.active_by_lane[lane] += 1
+        self._by_host[host] = self._by_host.get(host, 0) + 1
+
+    def _release(self, host: str, lane: str):
+        self.active -= 1
+        self.active_by_lane[lane] -= 1
+        left = self._by_host.get(host, 1) - 1
+        if left:
+            self._by_host[host] = left
+        else:
+            self._by_host.pop(host, None)
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hand free slots to waiters: interactive lane first, skipping hosts at their limit."""
+        for lane in (INTERACTIVE, BATCH):
+            queue = self._queues[lane]
+            for waiter in list(queue):
+                if self.active >= self.max_concurrent:
+                    return
+                if waiter.future.done():
+                    queue.remove(waiter)
+                    continue
+                if self._can_run(waiter.host, lane):
+                    queue.remove(waiter)
+                    self._take(waiter.host, lane)
+                    waiter.future.set_result(True)
+
+    def _reject(self, reason: str):
+        self.rejected += 1
+        logger.warning("Admission rejected: %s", reason)
+        raise AdmissionRejected(reason, self.retry_after)
+
+    @asynccontextmanager
+    async def slot(self, host: str, lane: str = INTERACTIVE):
+        """Hold one download slot for ``host`` for the duration of the block."""
+        host = host.lower()
+        queue = self._queues[lane]
+        # waiters that can run go first; the ones left are blocked by their own host or lane,
+        # so they must not hold up a request for another host
+        self._dispatch()
+        if self._can_run(host, lane):
+            self._take(host, lane)
+        else:
+            if lane == INTERACTIVE and len(queue) >= self.max_queue:
+                self._reject(f"wait queue full ({len(queue)})")
+            waiter = _Waiter(host, asyncio.get_running_loop().create_future())
+            queue.append(waiter)
+            self._dispatch()
+            try:
+                timeout = self.queue_timeout if lane == INTERACTIVE else None
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout=timeout)
+            except BaseException as e:
+                if waiter.future.done() and not waiter.future.cancelled():
+                    # granted just as we gave up: hand the slot back
+                    self._release(host, lane)
+                else:
+                    waiter.future.cancel()
+                    if waiter in queue:
+                        queue.remove(waiter)
+                    self._dispatch()
+                if isinstance(e, asyncio.TimeoutError):
+                    self._reject(f"no slot for {host} within {self.queue_timeout}s")
+                raise
+        try:
+            yield
+        finally:
+            self._release(host, lane)
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "active_interactive": self.active_by_lane[INTERACTIVE],
+            "active_batch": self.active_by_lane[BATCH],
+            "queued_interactive": self.queued(INTERACTIVE),
+            "queued_batch": self.queued(BATCH),
+            "rejected": self.rejected,
+            "max_concurrent": self.max_concurrent,
+        }
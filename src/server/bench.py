@@ -0,0 +1,272 @@
+"""
+Load and latency benchmark for src/download_server.py against a local fake origin.
+
+Starts src/server/fake_origin.py and (unless --server is given) a download server in a
+child process with a throw-away cache, fires --requests POST /download calls at
+--concurrency, and reports RPS and p50/p95/p99 latency per strategy (from the server's
+X-Download-Strategy header) and per origin scenario. Runs offline.
+
+The spawned server uses settings from config.yaml with benchmark overrides: a temporary
+cache and jobs dir, no /jobs workers, no per-host limit and no host-level negative cache
+(every fake URL shares one host). Add more with --set KEY=VALUE.
+
+Usage:
+    python -m src.server.bench --requests 500 --concurrency 50
+    python -m src.server.bench --mix fast=60,trickle=10,html=15,redirect=10,hang=5 --timeout 5
+    python -m src.server.bench --server http://127.0.0.1:8000 --json results.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+import httpx
+import yaml
+
+from src.server.fake_origin import FakeOrigin
+
+SCENARIOS = ("fast", "trickle", "html", "redirect", "hang")
+DEFAULT_MIX = "fast=70,trickle=10,html=10,redirect=5,hang=5"
+
+
+@dataclass
+class Sample:
+    scenario: str
+    strategy: str
+    status: int
+    latency: float
+    size: int
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _serve(port: int, overrides: dict):
+    # runs in the child process: patch settings before the server module reads them
+    from src.server import settings
+    for key, value in overrides.items():
+        setattr(settings, key, value)
+    import uvicorn
+    from src.download_server import app
+    logging.getLogger().setLevel(logging.WARNING)  # per-request INFO lines would swamp the report
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def _parse_mix(mix: str) -> list[tuple[str, int]]:
+    weights = []
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        weights.append((name, int(weight or 1)))
+    return weights
+
+
+def build_urls(origin: str, mix: str, total: int, size: int, rate: int, distinct: int) -> list[tuple[str, str]]:
+    """(scenario, url) pairs, interleaved by weight. distinct > 0 reuses that many URLs per
+    scenario (exercising the cache and coalescing); 0 makes every URL unique."""
+    weights = _parse_mix(mix)
+    run = uuid.uuid4().hex[:8]
+    deck = [name for name, weight in weights for _ in range(weight)]
+    counters = defaultdict(int)
+    urls = []
+    for i in range(total):
+        scenario = deck[(i * 7919) % len(deck)]  # stride through the deck so scenarios interleave
+        n = counters[scenario]
+        counters[scenario] += 1
+        if distinct:
+            n %= distinct
+        name = f"{run}-{n}.pdf"
+        if scenario == "redirect":
+            path = f"/redirect/3/{name}?size={size}"
+        elif scenario == "trickle":
+            path = f"/trickle/{name}?size={size}&rate={rate}"
+        else:
+            path = f"/{scenario}/{name}?size={size}"
+        urls.append((scenario, origin + path))
+    return urls
+
+
+async def _wait_ready(client: httpx.AsyncClient, base: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get(f"{base}/stats")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise SystemExit(f"Download server at {base} did not become ready")
+
+
+async def _one(client: httpx.AsyncClient, base: str, scenario: str, url: str, payload: dict) -> Sample:
+    start = time.monotonic()
+    size = 0
+    try:
+        async with client.stream("POST", f"{base}/download", json={"url": url, **payload}) as r:
+            async for chunk in r.aiter_bytes():
+                size += len(chunk)
+            status = r.status_code
+            strategy = r.headers.get("x-download-strategy") or f"http_{status}"
+    except httpx.TimeoutException:
+        status, strategy = 0, "client_timeout"
+    except httpx.TransportError:
+        status, strategy = 0, "connection_error"
+    return Sample(scenario, strategy, status, time.monotonic() - start, size)
+
+
+async def drive(base: str, urls: list[tuple[str, str]], concurrency: int, payload: dict,
+                client_timeout: float) -> tuple[list[Sample], float]:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=client_timeout) as client:
+        await _wait_ready(client, base)
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in urls:
+            queue.put_nowait(item)
+        samples: list[Sample] = []
+
+        async def worker():
+            while True:
+                try:
+                    scenario, url = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                samples.append(await _one(client, base, scenario, url, payload))
+
+        start = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return samples, time.monotonic() - start
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(values)))
+    return values[min(rank, len(values)) - 1]
+
+
+def summarize(samples: list[Sample], wall: float, key: str) -> list[dict]:
+    groups = defaultdict(list)
+    for sample in samples:
+        groups[getattr(sample, key)].append(sample)
+    groups["ALL"] = samples
+    rows = []
+    for name, group in groups.items():
+        latencies = sorted(s.latency for s in group)
+        rows.append({
+            key: name,
+            "count": len(group),
+            "ok": sum(1 for s in group if s.status in (200, 206)),
+            "rps": len(group) / wall if wall else 0.0,
+            "mb": sum(s.size for s in group) / 1e6,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else 0.0,
+        })
+    rows.sort(key=lambda r: (r[key] == "ALL", -r["count"]))
+    return rows
+
+
+def _print_table(rows: list[dict], key: str):
+    print(f"{key:<18} {'count':>6} {'ok':>6} {'rps':>8} {'MB':>8} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'max s':>8}")
+    for r in rows:
+        print(f"{r[key]:<18} {r['count']:>6} {r['ok']:>6} {r['rps']:>8.1f} {r['mb']:>8.1f} "
+              f"{r['p50']:>8.3f} {r['p95']:>8.3f} {r['p99']:>8.3f} {r['max']:>8.3f}")
+    print()
+
+
+def _overrides(args, workdir: str) -> dict:
+    overrides = {
+        "CACHE_DIR": os.path.join(workdir, "cache"),
+        "JOBS_DB": os.path.join(workdir, "jobs", "jobs.sqlite3"),
+        "JOBS_DIR": os.path.join(workdir, "jobs", "files"),
+        "JOB_WORKERS": 0,
+        "MAX_DOWNLOADS_PER_HOST": 0,
+        "HOST_FAILURE_THRESHOLD": 0,
+    }
+    for item in args.set:
+        key, sep, value = item.partition("=")
+        if not sep:
+            raise SystemExit(f"--set expects KEY=VALUE, got {item!r}")
+        overrides[key.strip()] = yaml.safe_load(value)
+    return overrides
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark the PDF download server against a local fake origin")
+    parser.add_argument("--server", help="URL of a running download server (default: start one)")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"scenario weights (default {DEFAULT_MIX})")
+    parser.add_argument("--size", type=int, default=512 * 1024, help="PDF size in bytes")
+    parser.add_argument("--trickle-rate", type=int, default=256 * 1024, help="bytes/s for trickle responses")
+    parser.add_argument("--distinct", type=int, default=0,
+                        help="distinct URLs per scenario (0 = all unique; small values measure cache hits)")
+    parser.add_argument("--timeout", type=int, default=5, help="per-strategy timeout sent to the server")
+    parser.add_argument("--stream", action="store_true", help="request stream-through responses")
+    parser.add_argument("--hedge", action="store_true", help="request hedged strategy mode")
+    parser.add_argument("--origin-port", type=int, default=0)
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="override a download_server setting in the spawned server")
+    parser.add_argument("--json", help="also write the samples and summaries to this file")
+    args = parser.parse_args(argv)
+
+    origin = FakeOrigin(port=args.origin_port)
+    origin_url = origin.start()
+    workdir = tempfile.mkdtemp(prefix="pdfdl_bench_")
+    server_proc = None
+    try:
+        if args.server:
+            base = args.server.rstrip("/")
+        else:
+            port = _free_port()
+            base = f"http://127.0.0.1:{port}"
+            server_proc = multiprocessing.Process(target=_serve, args=(port, _overrides(args, workdir)), daemon=True)
+            server_proc.start()
+
+        urls = build_urls(origin_url, args.mix, args.requests, args.size, args.trickle_rate, args.distinct)
+        payload = {"timeout": args.timeout, "stream": args.stream}
+        if args.hedge:
+            payload["hedge"] = True
+        # three strategies, each bounded by --timeout, plus queueing and transfer time
+        client_timeout = args.timeout * 4 + 60
+        print(f"Benchmarking {base}: {args.requests} requests, concurrency {args.concurrency}, "
+              f"origin {origin_url}, mix {args.mix}")
+        samples, wall = asyncio.run(drive(base, urls, args.concurrency, payload, client_timeout))
+
+        print(f"\nWall time {wall:.2f}s, {len(samples) / wall:.1f} req/s\n")
+        by_strategy = summarize(samples, wall, "strategy")
+        by_scenario = summarize(samples, wall, "scenario")
+        _print_table(by_strategy, "strategy")
+        _print_table(by_scenario, "scenario")
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"wall": wall, "args": vars(args), "by_strategy": by_strategy,
+                           "by_scenario": by_scenario, "samples": [asdict(s) for s in samples]}, f, indent=2)
+    finally:
+        if server_proc is not None:
+            server_proc.terminate()
+            server_proc.join(10)
+        origin.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Warm pool of long-lived Chromium instances for the download server's Playwright fallback.
+
+Browsers are launched once at startup and leased per request; every lease gets a fresh,
+isolated BrowserContext (own cookies/cache) that is closed when the request is done.
+
+- size:             number of Chromium processes kept warm
+- max_uses:         a browser is relaunched after serving this many leases
+- max_rss_mb:       a browser is relaunched when its processes together exceed this RSS
+                    (read from /proc, so only enforced on Linux)
+- acquire_timeout:  how long a request waits in the queue when every browser is busy
+- health_interval:  idle browsers are checked (connected, memory) this often
+
+A lease that is cancelled (request timeout, lost hedge race) returns at once; its context
+is closed in the background with a short timeout. Only if that close fails is the browser
+considered wedged mid-navigation: its processes are killed and relaunched. Routine cancels
+keep the warm browser.
+
+Requires playwright (pip install playwright && playwright install chromium).
+"""
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from src.utils.proc_utils import kill_pids
+
+logger = logging.getLogger(__name__)
+
+LAUNCH_ARGS = [
+    "--disable-blink-features=AutomationControlled",
+    "--disable-dev-shm-usage",
+    "--no-sandbox",
+]
+
+
+# how long a cancelled lease's context may take to close before its browser counts as wedged
+CANCEL_CLOSE_TIMEOUT = 5
+
+
+class BrowserPoolTimeout(Exception):
+    """No browser became free within the acquire timeout."""
+
+
+class _Slot:
+    def __init__(self, index: int):
+        self.index = index
+        self.browser = None
+        self.uses = 0
+
+
+def _proc_rss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+async def browser_pids(browser, timeout: float = 5) -> list[int]:
+    """PIDs of a browser's processes (browser, GPU, renderers), empty if unknown."""
+    async def _query():
+        session = await browser.new_browser_cdp_session()
+        try:
+            return await session.send("SystemInfo.getProcessInfo")
+        finally:
+            await session.detach()
+
+    try:
+        info = await asyncio.wait_for(_query(), timeout=timeout)
+    except Exception:
+        return []
+    return [p.get("id") for p in info.get("processInfo", []) if p.get("id")]
+
+
+async def browser_rss_bytes(browser) -> Optional[int]:
+    """Total RSS of a browser's processes, or None if unknown."""
+    pids = await browser_pids(browser)
+    if not pids or not os.path.exists("/proc"):
+        return None
+    return sum(_proc_rss_bytes(pid) for pid in pids)
+
+
+class BrowserPool:
+    def __init__(self, size: int = 2, max_uses: int = 100, max_rss_mb: int = 1024,
+                 acquire_timeout: float = 30, health_interval: float = 30, headless: bool = True):
+        self.size = size
+        self.max_uses = max_uses
+        self.max_rss_bytes = max_rss_mb * 1024 * 1024
+        self.acquire_timeout = acquire_timeout
+        self.health_interval = health_interval
+        self.headless = headless
+        self._playwright = None
+        self._slots: list[_Slot] = []
+        self._idle: Optional[asyncio.Queue] = None
+        self._health_task: Optional[asyncio.Task] = None
+        self._replacing: set[asyncio.Task] = set()
+        self.waiting = 0
+        self.recycled = 0
+
+    @property
+    def busy(self) -> int:
+        return self.size - self._idle.qsize() if self._idle else 0
+
+    async def start(self):
+        from playwright.async_api import async_playwright
+
+        self._playwright = await async_playwright().start()
+        self._idle = asyncio.Queue()
+        for i in range(self.size):
+            slot = _Slot(i)
+            await self._launch(slot)
+            self._slots.append(slot)
+            self._idle.put_nowait(slot)
+        self._health_task = asyncio.create_task(self._health_loop())
+        logger.info("Browser pool started with %d Chromium instance(s)", self.size)
+
+    async def stop(self):
+        if self._health_task:
+            self._health_task.cancel()
+        for task in list(self._replacing):
+            task.cancel()
+        await asyncio.gather(*self._replacing, return_exceptions=True)
+        for slot in self._slots:
+            await self._close(slot)
+        if self._playwright:
+            await self._playwright.stop()
+            self._playwright = None
+
+    async def _launch(self, slot: _Slot):
+        slot.browser = await self._playwright.chromium.launch(headless=self.headless, args=LAUNCH_ARGS)
+        slot.uses = 0
+
+    async def _close(self, slot: _Slot, kill: bool = False):
+        """Close the slot's browser; with kill=True its processes are SIGKILLed afterwards
+        in case a wedged browser ignores the close."""
+        if slot.browser is None:
+            return
+        pids = await browser_pids(slot.browser, timeout=2) if kill else []
+        try:
+            await asyncio.wait_for(slot.browser.close(), timeout=2 if kill else 10)
+        except Exception as e:
+            logger.debug("Browser pool: close failed for slot %d: %s", slot.index, e)
+        kill_pids(pids)
+        slot.browser = None
+
+    async def _recycle(self, slot: _Slot, reason: str, kill: bool = False):
+        logger.info("Browser pool: recycling slot %d (%s)", slot.index, reason)
+        self.recycled += 1
+        await self._close(slot, kill)
+        await self._launch(slot)
+
+    async def _replace(self, slot: _Slot, reason: str):
+        try:
+            await self._recycle(slot, reason, kill=True)
+        except Exception as e:
+            # the next lease relaunches a missing browser
+            logger.warning("Browser pool: relaunch of slot %d failed: %s", slot.index, e)
+        finally:
+            self._idle.put_nowait(slot)
+
+    async def _close_cancelled(self, slot: _Slot, ctx):
+        """Close the context of a cancelled lease; keep the browser unless that fails."""
+        try:
+            await asyncio.wait_for(ctx.close(), timeout=CANCEL_CLOSE_TIMEOUT)
+        except Exception as e:
+            logger.debug("Browser pool: context of a cancelled lease did not close: %s", e)
+            await self._replace(slot, "lease cancelled")
+            return
+        self._idle.put_nowait(slot)
+
+    async def _check(self, slot: _Slot):
+        """Relaunch the slot's browser if it died, is worn out, or uses too much memory."""
+        if slot.browser is None or not slot.browser.is_connected():
+            await self._recycle(slot, "disconnected")
+            return
+        if self.max_uses and slot.uses >= self.max_uses:
+            await self._recycle(slot, f"{slot.uses} uses")
+            return
+        if self.max_rss_bytes:
+            rss = await browser_rss_bytes(slot.browser)
+            if rss is not None and rss > self.max_rss_bytes:
+                await self._recycle(slot, f"rss {rss // (1024 * 1024)} MB")
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            # only idle browsers are inspected; leased ones are checked on release
+            for _ in range(self._idle.qsize()):
+                try:
+                    slot = self._idle.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                try:
+                    await self._check(slot)
+                except Exception as e:
+                    logger.warning("Browser pool: health check failed for slot %d: %s", slot.index, e)
+                finally:
+                    self._idle.put_nowait(slot)
+
+    @asynccontextmanager
+    async def context(self, **context_options):
+        """Lease a browser and yield a fresh BrowserContext on it."""
+        self.waiting += 1
+        try:
+            slot = await asyncio.wait_for(self._idle.get(), timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise BrowserPoolTimeout(f"no browser free within {self.acquire_timeout}s")
+        finally:
+            self.waiting -= 1
+        wedged = False
+        cancelled_ctx = None
+        try:
+            if slot.browser is None or not slot.browser.is_connected():
+                await self._recycle(slot, "disconnected")
+            ctx = await slot.browser.new_context(**context_options)
+            slot.uses += 1
+            try:
+                yield ctx
+            except asyncio.CancelledError:
+                # closed in the background: the lease returns at once
+                cancelled_ctx = ctx
+                raise
+            finally:
+                if cancelled_ctx is None:
+                    try:
+                        await asyncio.wait_for(ctx.close(), timeout=10)
+                    except Exception as e:
+                        logger.debug("Browser pool: context close failed: %s", e)
+                        wedged = True
+            if not wedged:
+                await self._check(slot)
+        finally:
+            if cancelled_ctx is not None:
+                self._background(self._close_cancelled(slot, cancelled_ctx))
+            elif wedged:
+                self._background(self._replace(slot, "lease cancelled"))
+            else:
+                self._idle.put_nowait(slot)
+
+    def _background(self, coro):
+        task = asyncio.create_task(coro)
+        self._replacing.add(task)
+        task.add_done_callback(self._replacing.discard)
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "busy": self.busy,
+            "waiting": self.waiting,
+            "recycled": self.recycled,
+        }
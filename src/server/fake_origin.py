@@ -0,0 +1,147 @@
+"""
+Local stand-in for publisher servers, used by src/server/bench.py (and handy for manual
+testing). Stdlib only; every response is generated, nothing touches the network.
+
+Routes (``<name>`` is free-form, so every request can use a distinct, uncached URL):
+    /fast/<name>?size=N              valid PDF of N bytes, sent at once
+    /trickle/<name>?size=N&rate=B    valid PDF sent at B bytes/s
+    /html/<name>                     200 HTML "access denied" page (saved as .pdf by naive clients)
+    /redirect/<hops>/<name>?size=N   302 chain of <hops> hops ending at /fast/<name>
+    /hang/<name>                     accepts the request and never answers
+    /status/<code>/<name>            empty response with that status code
+
+Usage:
+    python -m src.server.fake_origin --port 8900
+"""
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+DEFAULT_SIZE = 512 * 1024
+DEFAULT_RATE = 64 * 1024  # bytes/s for /trickle
+HANG_SECONDS = 600
+
+_HTML = (b"<!DOCTYPE html><html><head><title>Access denied</title></head>"
+         b"<body><h1>Institutional login required</h1></body></html>")
+
+_pdf_cache: dict[int, bytes] = {}
+
+
+def make_pdf(size: int) -> bytes:
+    """A structurally plausible PDF of exactly ``size`` bytes (header, padding, %%EOF trailer)."""
+    size = max(size, 64)
+    body = _pdf_cache.get(size)
+    if body is None:
+        head = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+        tail = b"\nstartxref\n0\n%%EOF\n"
+        body = head + b"0" * (size - len(head) - len(tail)) + tail
+        _pdf_cache[size] = body
+    return body
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeOrigin/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        segments = [s for s in parts.path.split("/") if s]
+        kind = segments[0] if segments else ""
+        size = int(query.get("size", DEFAULT_SIZE))
+        try:
+            if kind == "fast":
+                self._send(200, make_pdf(size), "application/pdf")
+            elif kind == "trickle":
+                self._trickle(make_pdf(size), int(query.get("rate", DEFAULT_RATE)))
+            elif kind == "html":
+                self._send(200, _HTML, "text/html; charset=utf-8")
+            elif kind == "redirect" and len(segments) >= 3:
+                hops = int(segments[1])
+                name = "/".join(segments[2:])
+                target = f"/redirect/{hops - 1}/{name}" if hops > 1 else f"/fast/{name}"
+                if parts.query:
+                    target += "?" + parts.query
+                self.send_response(302)
+                self.send_header("Location", target)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+            elif kind == "hang":
+                self.server.stopping.wait(HANG_SECONDS)
+                self.close_connection = True
+            elif kind == "status" and len(segments) >= 2:
+                self._send(int(segments[1]), b"", "text/plain")
+            else:
+                self._send(404, b"not found", "text/plain")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _trickle(self, body: bytes, rate: int):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        step = max(rate // 10, 1)
+        for offset in range(0, len(body), step):
+            if self.server.stopping.wait(0.1):
+                self.close_connection = True
+                return
+            self.wfile.write(body[offset:offset + step])
+            self.wfile.flush()
+
+
+class FakeOrigin:
+    """Runs the fake origin in a background thread."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-origin", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.httpd.stopping.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake publisher origin for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    args = parser.parse_args()
+    origin = FakeOrigin(args.host, args.port)
+    origin.start()
+    print(f"Fake origin listening on {origin.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        origin.stop()
+
+
+if __name__ == "__main__":
+    main()
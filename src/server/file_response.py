@@ -0,0 +1,185 @@
+"""
+File responses for the download server with validators, conditional GET and byte ranges.
+
+Files the server already holds (cache entries, finished downloads, job items) are sent with
+a strong ETag and Last-Modified, so clients can:
+
+- revalidate with If-None-Match / If-Modified-Since and get 304 Not Modified;
+- resume an interrupted transfer with a single ``Range: bytes=...`` (optionally guarded by
+  If-Range) and get 206 Partial Content, or 416 when the range starts past the end.
+
+The body is handed to the ASGI server as an open file when it offers the zero-copy
+extension (``http.response.zerocopysend``, i.e. sendfile(2)), or as a path for full bodies
+when it offers ``http.response.pathsend``. Otherwise it is read in a worker thread one
+chunk at a time, never buffering the whole file.
+"""
+import asyncio
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Callable, Mapping, Optional, Tuple
+from urllib.parse import quote
+
+from starlette.background import BackgroundTask
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def file_etag(st: os.stat_result) -> str:
+    # cache objects are replaced atomically, never rewritten in place, so inode, mtime and
+    # size identify the content
+    return '"%x-%x-%x"' % (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Inclusive (start, end) of a single ``bytes=`` range, or None when the header should
+    be ignored (other units, several ranges, bad syntax) and the whole file sent."""
+    units, _, spec = header.partition("=")
+    if units.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else max(start, size - 1)
+            if start > end:
+                return None
+        else:
+            suffix = int(last)
+            if suffix == 0:
+                raise RangeNotSatisfiable()
+            start, end = max(size - suffix, 0), size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+def _etag_listed(header: str, etag: str) -> bool:
+    """Weak comparison, as If-None-Match requires."""
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+def _not_modified(request: Headers, etag: str, mtime: float) -> bool:
+    if_none_match = request.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_listed(if_none_match, etag)
+    if_modified_since = request.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _read_chunk(f, offset: int, size: int) -> bytes:
+    f.seek(offset)
+    return f.read(size)
+
+
+class PdfFileResponse(Response):
+    media_type = "application/pdf"
+
+    def __init__(self, path: str, filename: Optional[str] = None, headers: Optional[Mapping[str, str]] = None,
+                 background: Optional[BackgroundTask] = None, on_sent: Optional[Callable[[int], None]] = None,
+                 chunk_size: int = CHUNK_SIZE):
+        self.path = path
+        self.status_code = 200
+        self.background = background
+        self.on_sent = on_sent
+        self.chunk_size = chunk_size
+        self.init_headers(headers)
+        self.headers.setdefault("accept-ranges", "bytes")
+        if filename is not None:
+            quoted = quote(filename)
+            if quoted != filename:
+                disposition = f"attachment; filename*=utf-8''{quoted}"
+            else:
+                disposition = f'attachment; filename="{filename}"'
+            self.headers.setdefault("content-disposition", disposition)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        request = Headers(scope=scope)
+        head_only = scope.get("method") == "HEAD"
+        f = await asyncio.to_thread(open, self.path, "rb")
+        try:
+            st = os.fstat(f.fileno())
+            etag = file_etag(st)
+            self.headers.setdefault("etag", etag)
+            self.headers.setdefault("last-modified", formatdate(st.st_mtime, usegmt=True))
+            start, end = 0, st.st_size - 1
+
+            if _not_modified(request, etag, st.st_mtime):
+                self.status_code = 304
+                del self.headers["content-type"]
+                head_only = True
+                end = -1
+            elif request.get("range") and self._if_range_ok(request.get("if-range"), etag):
+                try:
+                    byte_range = parse_range(request["range"], st.st_size)
+                except RangeNotSatisfiable:
+                    self.status_code = 416
+                    self.headers["content-range"] = f"bytes */{st.st_size}"
+                    head_only = True
+                    end = -1
+                else:
+                    if byte_range is not None:
+                        start, end = byte_range
+                        self.status_code = 206
+                        self.headers["content-range"] = f"bytes {start}-{end}/{st.st_size}"
+
+            length = end - start + 1
+            if self.status_code != 304:
+                self.headers["content-length"] = str(length)
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if head_only or length == 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+            else:
+                await self._send_body(scope, send, f, start, length, st.st_size)
+                if self.on_sent is not None:
+                    self.on_sent(length)
+        finally:
+            f.close()
+        if self.background is not None:
+            await self.background()
+
+    def _if_range_ok(self, if_range: Optional[str], etag: str) -> bool:
+        """A Range guarded by If-Range only applies while the validator still matches."""
+        if if_range is None:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith(('"', "W/")):
+            return if_range == etag
+        return if_range == self.headers["last-modified"]
+
+    async def _send_body(self, scope: Scope, send: Send, f, start: int, length: int, size: int):
+        extensions = scope.get("extensions") or {}
+        if "http.response.zerocopysend" in extensions:
+            await send({"type": "http.response.zerocopysend", "file": f, "offset": start, "count": length,
+                        "more_body": False})
+            return
+        if "http.response.pathsend" in extensions and start == 0 and length == size:
+            await send({"type": "http.response.pathsend", "path": os.fspath(self.path)})
+            return
+        offset, remaining = start, length
+        while remaining > 0:
+            chunk = await asyncio.to_thread(_read_chunk, f, offset, min(self.chunk_size, remaining))
+            if not chunk:
+                break  # file shrank underneath us; end the body short rather than hang
+            offset += len(chunk)
+            remaining -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
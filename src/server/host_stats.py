@@ -0,0 +1,108 @@
+"""
+Per-host strategy learning and a negative-result cache for the download server.
+
+- ``order()`` moves the strategy that last succeeded for a host to the front, so hosts
+  whose direct links always return an HTML paywall go straight to the browser.
+- URLs that just failed every strategy are remembered for ``negative_ttl`` seconds, as are
+  hosts where ``host_failure_threshold`` URLs in a row failed every strategy. Requests for
+  them fail fast instead of burning every strategy's timeout again. Any success for a host
+  clears its failure streak. Speculative URLs (DOI rule candidates, many of them paywalled
+  or redirectors like doi.org) are recorded with ``host_streak=False``: they are cached
+  per URL but never block their host.
+
+State is in memory (per worker process) and bounded to ``max_entries`` per table.
+"""
+import time
+from collections import OrderedDict
+from typing import Optional, Sequence, TypeVar
+
+from urllib.parse import urlsplit
+
+from src.server.pdf_cache import normalize_url
+
+T = TypeVar("T")
+
+
+def _host(url: str) -> str:
+    return (urlsplit(url).hostname or "").lower()
+
+
+class _BoundedDict(OrderedDict):
+    def __init__(self, max_entries: int):
+        super().__init__()
+        self.max_entries = max_entries
+
+    def __setitem__(self, key, value):
+        if key in self:
+            self.move_to_end(key)
+        super().__setitem__(key, value)
+        while len(self) > self.max_entries:
+            self.popitem(last=False)
+
+
+class StrategyRouter:
+    def __init__(self, negative_ttl: float = 900, host_failure_threshold: int = 5,
+                 adaptive: bool = True, max_entries: int = 10000):
+        self.negative_ttl = negative_ttl
+        self.host_failure_threshold = host_failure_threshold
+        self.adaptive = adaptive
+        self._last_success = _BoundedDict(max_entries)  # host -> strategy name
+        self._failed_urls = _BoundedDict(max_entries)   # normalized url -> expiry
+        self._failed_hosts = _BoundedDict(max_entries)  # host -> expiry
+        self._streaks = _BoundedDict(max_entries)       # host -> consecutive all-failed URLs
+        self.fast_failures = 0
+
+    def order(self, url: str, strategies: Sequence[tuple[str, T]]) -> list[tuple[str, T]]:
+        """Strategies with the host's last winner first; the rest keep their configured order."""
+        strategies = list(strategies)
+        preferred = self._last_success.get(_host(url)) if self.adaptive else None
+        if preferred:
+            strategies.sort(key=lambda item: item[0] != preferred)
+        return strategies
+
+    def preferred(self, url: str) -> Optional[str]:
+        return self._last_success.get(_host(url))
+
+    def blocked(self, url: str) -> Optional[float]:
+        """Seconds until url (or its host) may be tried again, or None if it is not blocked."""
+        if self.negative_ttl <= 0:
+            return None
+        now = time.time()
+        for table, key in ((self._failed_urls, normalize_url(url)), (self._failed_hosts, _host(url))):
+            expiry = table.get(key)
+            if expiry is None:
+                continue
+            if expiry > now:
+                self.fast_failures += 1
+                return expiry - now
+            del table[key]
+        return None
+
+    def record_success(self, url: str, strategy: str):
+        host = _host(url)
+        self._last_success[host] = strategy
+        self._failed_urls.pop(normalize_url(url), None)
+        self._failed_hosts.pop(host, None)
+        self._streaks.pop(host, None)
+
+    def record_failure(self, url: str, host_streak: bool = True):
+        if self.negative_ttl <= 0:
+            return
+        host = _host(url)
+        expiry = time.time() + self.negative_ttl
+        self._failed_urls[normalize_url(url)] = expiry
+        if not host_streak:
+            return
+        streak = self._streaks.get(host, 0) + 1
+        self._streaks[host] = streak
+        if self.host_failure_threshold and streak >= self.host_failure_threshold:
+            self._failed_hosts[host] = expiry
+
+    def stats(self) -> dict:
+        now = time.time()
+        return {
+            "learned_hosts": len(self._last_success),
+            "negative_urls": sum(1 for e in self._failed_urls.values() if e > now),
+            "negative_hosts": sum(1 for e in self._failed_hosts.values() if e > now),
+            "fast_failures": self.fast_failures,
+        }
@@ -0,0 +1,332 @@
+"""
+Persistent batch download jobs for the download server.
+
+A job is a list of URLs stored in a local SQLite file (JOBS_DB), so submitted work survives
+a server restart. A bounded pool of asyncio workers claims items one at a time and hands
+them to a fetch callable supplied by the server; finished files are kept under
+JOBS_DIR/<job_id>/ until the job is deleted.
+
+Items are claimed with a lease sized for the worst case of one fetch (``lease_for``) and
+renewed while the item runs, so a slow item is never claimed twice; an item whose worker
+died (crash, restart, another process killed) becomes claimable again once its lease
+expires, so several uvicorn workers can drain the same queue. A failed item is retried no
+earlier than ``retry_delay`` seconds later (the server uses its negative-cache TTL, which
+would otherwise fail the retry straight away).
+"""
+import asyncio
+import io
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+import zipfile
+from typing import Awaitable, Callable, Iterable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id         TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    total      INTEGER NOT NULL,
+    timeout    REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id      TEXT NOT NULL,
+    idx         INTEGER NOT NULL,
+    url         TEXT NOT NULL,
+    filename    TEXT NOT NULL,
+    status      TEXT NOT NULL DEFAULT 'pending',
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    lease_until REAL,
+    error       TEXT,
+    path        TEXT,
+    size        INTEGER,
+    strategy    TEXT,
+    updated_at  REAL NOT NULL,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS job_items_status ON job_items(status, lease_until);
+"""
+
+# (url, filename, timeout, dest_path) -> strategy name, or None on failure
+FetchFn = Callable[[str, str, float, str], Awaitable[Optional[str]]]
+# item timeout -> lease length in seconds
+LeaseFn = Callable[[float], float]
+
+
+def default_lease(timeout: float) -> float:
+    return timeout + 60
+
+
+class JobStore:
+    def __init__(self, db_path: str, files_dir: str):
+        self.db_path = os.path.abspath(db_path)
+        self.files_dir = os.path.abspath(files_dir)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        os.makedirs(self.files_dir, exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript(_SCHEMA)
+
+    # sqlite3 connections are per thread; calls arrive via asyncio.to_thread()
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def job_dir(self, job_id: str) -> str:
+        return os.path.join(self.files_dir, job_id)
+
+    def create(self, items: list[tuple[str, str]], timeout: float) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.execute("INSERT INTO jobs (id, created_at, total, timeout) VALUES (?, ?, ?, ?)",
+                         (job_id, now, len(items), timeout))
+            conn.executemany(
+                "INSERT INTO job_items (job_id, idx, url, filename, updated_at) VALUES (?, ?, ?, ?, ?)",
+                ((job_id, i, url, filename, now) for i, (url, filename) in enumerate(items)),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        os.makedirs(self.job_dir(job_id), exist_ok=True)
+        return job_id
+
+    def claim(self, lease_for: LeaseFn = default_lease) -> Optional[sqlite3.Row]:
+        """Atomically take the next pending (or lease-expired) item. pending items wait
+        until their lease_until (the retry time) has passed."""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT i.job_id, i.idx, i.url, i.filename, i.attempts, j.timeout FROM job_items i "
+                "JOIN jobs j ON j.id = i.job_id "
+                "WHERE (i.status = 'pending' AND (i.lease_until IS NULL OR i.lease_until < ?)) "
+                "OR (i.status = 'running' AND i.lease_until < ?) "
+                "ORDER BY j.created_at, i.idx LIMIT 1",
+                (now, now),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE job_items SET status = 'running', attempts = attempts + 1, lease_until = ?, "
+                    "updated_at = ? WHERE job_id = ? AND idx = ?",
+                    (now + lease_for(row["timeout"]), now, row["job_id"], row["idx"]),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def renew(self, job_id: str, idx: int, attempt: int, lease: float) -> bool:
+        """Extend the lease of a running item; False if it is no longer this attempt's."""
+        return self._conn().execute(
+            "UPDATE job_items SET lease_until = ?, updated_at = ? "
+            "WHERE job_id = ? AND idx = ? AND status = 'running' AND attempts = ?",
+            (time.time() + lease, time.time(), job_id, idx, attempt),
+        ).rowcount > 0
+
+    def finish(self, job_id: str, idx: int, path: str, strategy: str):
+        self._conn().execute(
+            "UPDATE job_items SET status = 'done', path = ?, size = ?, strategy = ?, error = NULL, "
+            "lease_until = NULL, updated_at = ? WHERE job_id = ? AND idx = ?",
+            (path, os.path.getsize(path), strategy, time.time(), job_id, idx),
+        )
+
+    def fail(self, job_id: str, idx: int, error: str, retry: bool, retry_delay: float = 0):
+        now = time.time()
+        self._conn().execute(
+            "UPDATE job_items SET status = ?, error = ?, lease_until = ?, updated_at = ? "
+            "WHERE job_id = ? AND idx = ?",
+            ("pending" if retry else "failed", error, now + retry_delay if retry and retry_delay else None,
+             now, job_id, idx),
+        )
+
+    def get(self, job_id: str) -> Optional[sqlite3.Row]:
+        return self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def counts(self, job_id: str) -> dict:
+        rows = self._conn().execute(
+            "SELECT status, COUNT(*) FROM job_items WHERE job_id = ? GROUP BY status", (job_id,)
+        ).fetchall()
+        return {status: n for status, n in rows}
+
+    def items(self, job_id: str, offset: int = 0, limit: int = 1000,
+              status: Optional[str] = None) -> list[sqlite3.Row]:
+        sql = ("SELECT idx, url, filename, status, attempts, error, size, strategy, updated_at "
+               "FROM job_items WHERE job_id = ?")
+        args: list = [job_id]
+        if status:
+            sql += " AND status = ?"
+            args.append(status)
+        sql += " ORDER BY idx LIMIT ? OFFSET ?"
+        args += [limit, offset]
+        return self._conn().execute(sql, args).fetchall()
+
+    def item(self, job_id: str, idx: int) -> Optional[sqlite3.Row]:
+        return self._conn().execute(
+            "SELECT * FROM job_items WHERE job_id = ? AND idx = ?", (job_id, idx)
+        ).fetchone()
+
+    def done_files(self, job_id: str) -> list[tuple[int, str, str]]:
+        return [tuple(r) for r in self._conn().execute(
+            "SELECT idx, filename, path FROM job_items WHERE job_id = ? AND status = 'done' ORDER BY idx",
+            (job_id,),
+        )]
+
+    def pending_count(self) -> int:
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM job_items WHERE status IN ('pending', 'running')"
+        ).fetchone()[0]
+
+    def delete(self, job_id: str) -> bool:
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.execute("DELETE FROM job_items WHERE job_id = ?", (job_id,))
+            deleted = conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,)).rowcount
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+        return bool(deleted)
+
+
+class JobRunner:
+    """Bounded pool of asyncio workers draining a JobStore."""
+
+    def __init__(self, store: JobStore, fetch: FetchFn, workers: int = 4, max_attempts: int = 2,
+                 poll_interval: float = 5, lease_for: LeaseFn = default_lease, retry_delay: float = 0):
+        self.store = store
+        self.fetch = fetch
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.lease_for = lease_for
+        self.retry_delay = retry_delay
+        self.active = 0
+        self._wakeup = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info("Job runner started with %d worker(s)", self.workers)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wake idle workers after new items were queued."""
+        self._wakeup.set()
+
+    async def _worker(self, n: int):
+        while True:
+            try:
+                row = await asyncio.to_thread(self.store.claim, self.lease_for)
+            except Exception as e:
+                logger.warning("Job worker %d: claim failed: %s", n, e)
+                row = None
+            if row is None:
+                self._wakeup.clear()
+                try:
+                    # other processes may queue work too, so poll as well as wait for notify()
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.active += 1
+            try:
+                await self._run_item(row)
+            finally:
+                self.active -= 1
+
+    async def _renew(self, job_id: str, idx: int, attempt: int, lease: float):
+        """Keep the item's lease ahead of a fetch that runs longer than planned
+        (admission waits are not bounded for the batch lane)."""
+        while True:
+            await asyncio.sleep(max(1.0, lease / 3))
+            try:
+                if not await asyncio.to_thread(self.store.renew, job_id, idx, attempt, lease):
+                    logger.warning("Job %s item %d: lease lost", job_id, idx)
+                    return
+            except Exception as e:
+                logger.warning("Job %s item %d: lease renewal failed: %s", job_id, idx, e)
+
+    async def _run_item(self, row: sqlite3.Row):
+        job_id, idx = row["job_id"], row["idx"]
+        dest = os.path.join(self.store.job_dir(job_id), f"{idx:06d}_{row['filename']}")
+        renewal = asyncio.create_task(self._renew(job_id, idx, row["attempts"] + 1, self.lease_for(row["timeout"])))
+        try:
+            strategy = await self.fetch(row["url"], row["filename"], row["timeout"], dest)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Job %s item %d raised: %s", job_id, idx, e)
+            strategy, error = None, str(e)
+        else:
+            error = "all download methods failed or file is not a valid PDF"
+        finally:
+            renewal.cancel()
+        if strategy:
+            await asyncio.to_thread(self.store.finish, job_id, idx, dest, strategy)
+        else:
+            retry = row["attempts"] + 1 < self.max_attempts
+            await asyncio.to_thread(self.store.fail, job_id, idx, error, retry, self.retry_delay)
+
+
+class _ZipSink(io.RawIOBase):
+    """Unseekable write target; zipfile then emits data descriptors and we drain as we go."""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_zip(files: Iterable[tuple[str, str]], chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+    """Yield a ZIP archive of (arcname, path) pairs without building it in memory or on disk.
+    PDFs are already compressed, so entries are stored."""
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for arcname, path in files:
+            try:
+                src = open(path, "rb")
+            except OSError as e:
+                logger.warning("ZIP: skipping %s: %s", path, e)
+                continue
+            info = zipfile.ZipInfo(arcname, date_time=time.localtime(os.path.getmtime(path))[:6])
+            with src, zf.open(info, "w", force_zip64=True) as dst:
+                while True:
+                    data = src.read(chunk_size)
+                    if not data:
+                        break
+                    dst.write(data)
+                    yield sink.drain()
+    yield sink.drain()
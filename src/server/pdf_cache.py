@@ -0,0 +1,202 @@
+"""
+Persistent on-disk PDF cache for the download server.
+
+Layout under CACHE_DIR:
+    index.sqlite3        entry index (WAL mode, shared by every uvicorn worker process)
+    objects/ab/<key>.pdf validated PDFs, <key> = sha256 of the normalized URL
+    staging/             per-request download dirs on the same filesystem, so a finished
+                         file can be committed with an atomic os.replace()
+
+Entries are evicted least-recently-used once the total size exceeds the byte budget.
+Entries read within the last ``evict_grace`` seconds are never evicted, so a response that
+is still streaming a cached file is not pulled out from under the client.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+_TRACKING_PREFIXES = ("utm_",)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key           TEXT PRIMARY KEY,
+    url           TEXT NOT NULL,
+    path          TEXT NOT NULL,
+    size          INTEGER NOT NULL,
+    etag          TEXT,
+    last_modified TEXT,
+    stored_at     REAL NOT NULL,
+    validated_at  REAL NOT NULL,
+    last_access   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_access ON entries(last_access);
+"""
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form used as cache key: lower-case scheme/host, no default port,
+    no fragment, no tracking parameters, query parameters sorted."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != _DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith(_TRACKING_PREFIXES)
+    )
+    return urlunsplit((scheme, host, parts.path or "/", urlencode(query), ""))
+
+
+def cache_key(url: str) -> str:
+    return hashlib.sha256(normalize_url(url).encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    url: str
+    path: str
+    size: int
+    etag: Optional[str]
+    last_modified: Optional[str]
+    stored_at: float
+    validated_at: float
+
+
+class PdfCache:
+    def __init__(self, root: str, max_bytes: int, revalidate_after: float = 86400, evict_grace: float = 60):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        self.evict_grace = evict_grace
+        self.objects_dir = os.path.join(self.root, "objects")
+        self.staging_dir = os.path.join(self.root, "staging")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.staging_dir, exist_ok=True)
+        self._db_path = os.path.join(self.root, "index.sqlite3")
+        self._local = threading.local()
+        self._conn().executescript(_SCHEMA)
+        self._purge_staging()
+
+    # sqlite3 connections are per thread; calls arrive via asyncio.to_thread()
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _purge_staging(self, max_age: float = 3600):
+        """Remove download dirs left behind by crashed workers."""
+        cutoff = time.time() - max_age
+        for name in os.listdir(self.staging_dir):
+            path = os.path.join(self.staging_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
+
+    def new_staging_dir(self) -> str:
+        return tempfile.mkdtemp(prefix="pdfdl_", dir=self.staging_dir)
+
+    def _object_path(self, key: str) -> str:
+        return os.path.join(self.objects_dir, key[:2], key + ".pdf")
+
+    def get(self, url: str) -> Optional[CacheEntry]:
+        key = cache_key(url)
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT key, url, path, size, etag, last_modified, stored_at, validated_at FROM entries WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row is None:
+            return None
+        entry = CacheEntry(*row)
+        if not os.path.exists(entry.path):
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            return None
+        conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+        return entry
+
+    def needs_revalidation(self, entry: CacheEntry) -> bool:
+        if not (entry.etag or entry.last_modified) or self.revalidate_after <= 0:
+            return False
+        return time.time() - entry.validated_at > self.revalidate_after
+
+    def mark_validated(self, entry: CacheEntry):
+        self._conn().execute("UPDATE entries SET validated_at = ? WHERE key = ?", (time.time(), entry.key))
+
+    def put(self, url: str, src_path: str, etag: Optional[str] = None,
+            last_modified: Optional[str] = None) -> Optional[CacheEntry]:
+        """Move an already-validated PDF into the cache. Returns None if it does not fit the budget."""
+        size = os.path.getsize(src_path)
+        if size > self.max_bytes:
+            return None
+        key = cache_key(url)
+        dest = self._object_path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        try:
+            os.replace(src_path, dest)
+        except OSError:
+            # source on another filesystem: copy next to dest first so the final rename stays atomic
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest), suffix=".partial")
+            os.close(fd)
+            shutil.copyfile(src_path, tmp)
+            os.replace(tmp, dest)
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO entries "
+            "(key, url, path, size, etag, last_modified, stored_at, validated_at, last_access) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, url, dest, size, etag, last_modified, now, now, now),
+        )
+        self.evict()
+        return CacheEntry(key, url, dest, size, etag, last_modified, now, now)
+
+    def evict(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            cutoff = time.time() - self.evict_grace
+            victims = conn.execute(
+                "SELECT key, path, size FROM entries WHERE last_access < ? ORDER BY last_access",
+                (cutoff,),
+            ).fetchall()
+            for key, path, size in victims:
+                if total <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning("Cache: could not remove %s: %s", path, e)
+                total -= size
+                logger.debug("Cache: evicted %s (%d bytes)", key, size)
+        finally:
+            conn.execute("COMMIT")
+
+    def stats(self) -> dict:
+        count, total = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        return {"entries": count, "bytes": total, "max_bytes": self.max_bytes}
@@ -0,0 +1,118 @@
+"""
+Runtime settings for src/download_server.py.
+
+Values come from the optional ``download_server`` section of config.yaml, using the
+same list-wrapped layout as every other section, e.g.::
+
+    download_server:
+      HTTP_MAX_CONNECTIONS:
+        - 200
+
+Missing keys (or a missing config.yaml) fall back to the defaults below, so the
+server can start without any configuration.
+"""
+import os
+
+import yaml
+
+from src.utils.utils import output_file, project_root
+
+
+def _load_section(name: str) -> dict:
+    if not os.path.exists(output_file):
+        return {}
+    try:
+        with open(output_file, "r", encoding="utf-8") as f:
+            data = yaml.safe_load(f) or {}
+    except Exception:
+        return {}
+    return data.get(name) or {}
+
+
+_cfg = _load_section("download_server")
+
+
+def _opt(key: str, default):
+    value = _cfg.get(key)
+    if isinstance(value, list):
+        return value[0] if value else default
+    return default if value is None else value
+
+
+# ── UPSTREAM HTTP POOL ────────────────────────────────────────────────────
+# One long-lived httpx.AsyncClient is shared by all requests; httpx keeps a
+# keep-alive connection pool per origin (scheme, host, port).
+HTTP_MAX_CONNECTIONS = int(_opt("HTTP_MAX_CONNECTIONS", 200))
+HTTP_MAX_KEEPALIVE = int(_opt("HTTP_MAX_KEEPALIVE", 50))
+HTTP_KEEPALIVE_EXPIRY = float(_opt("HTTP_KEEPALIVE_EXPIRY", 30.0))
+HTTP_CHUNK_SIZE = int(_opt("HTTP_CHUNK_SIZE", 64 * 1024))
+
+USER_AGENT = _opt(
+    "USER_AGENT",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/120.0.0.0 Safari/537.36",
+)
+
+# ── PDF CACHE ─────────────────────────────────────────────────────────────
+# CACHE_MAX_BYTES = 0 disables the cache. Several workers may share CACHE_DIR.
+CACHE_DIR = _opt("CACHE_DIR", os.path.join(project_root, "cache", "pdf_cache"))
+CACHE_MAX_BYTES = int(_opt("CACHE_MAX_BYTES", 10 * 1024 ** 3))
+CACHE_REVALIDATE_AFTER = float(_opt("CACHE_REVALIDATE_AFTER", 86400))  # seconds; 0 = never
+CACHE_EVICT_GRACE = float(_opt("CACHE_EVICT_GRACE", 60))  # seconds
+
+# ── BROWSER POOL ──────────────────────────────────────────────────────────
+# BROWSER_POOL_SIZE = 0 disables the pool; the Playwright fallback then runs
+# download_with_playwrite.py as a killable subprocess per request.
+BROWSER_POOL_SIZE = int(_opt("BROWSER_POOL_SIZE", 2))
+BROWSER_MAX_USES = int(_opt("BROWSER_MAX_USES", 100))
+BROWSER_MAX_RSS_MB = int(_opt("BROWSER_MAX_RSS_MB", 1024))
+BROWSER_ACQUIRE_TIMEOUT = float(_opt("BROWSER_ACQUIRE_TIMEOUT", 30))  # seconds
+BROWSER_HEALTH_INTERVAL = float(_opt("BROWSER_HEALTH_INTERVAL", 30))  # seconds
+
+# ── HEDGED STRATEGIES ─────────────────────────────────────────────────────
+# With hedging on, the next strategy starts HEDGE_DELAY seconds after the previous
+# one (or as soon as it fails); 0 races all strategies at once. First valid PDF wins.
+HEDGE_ENABLED = bool(_opt("HEDGE_ENABLED", False))
+HEDGE_DELAY = float(_opt("HEDGE_DELAY", 3.0))  # seconds
+
+# ── BATCH JOBS ────────────────────────────────────────────────────────────
+# JOB_WORKERS = 0 disables the /jobs API.
+JOBS_DB = _opt("JOBS_DB", os.path.join(project_root, "cache", "jobs", "jobs.sqlite3"))
+JOBS_DIR = _opt("JOBS_DIR", os.path.join(project_root, "cache", "jobs", "files"))
+JOB_WORKERS = int(_opt("JOB_WORKERS", 4))
+JOB_MAX_ATTEMPTS = int(_opt("JOB_MAX_ATTEMPTS", 2))  # retries wait NEGATIVE_CACHE_TTL
+JOB_MAX_URLS = int(_opt("JOB_MAX_URLS", 50000))
+
+# ── ADMISSION CONTROL ─────────────────────────────────────────────────────
+# Limits apply to upstream fetches only (cache hits and coalesced requests are free).
+MAX_CONCURRENT_DOWNLOADS = int(_opt("MAX_CONCURRENT_DOWNLOADS", 32))
+MAX_DOWNLOADS_PER_HOST = int(_opt("MAX_DOWNLOADS_PER_HOST", 4))
+MAX_QUEUED_REQUESTS = int(_opt("MAX_QUEUED_REQUESTS", 100))
+QUEUE_TIMEOUT = float(_opt("QUEUE_TIMEOUT", 30))  # seconds
+INTERACTIVE_RESERVED_SLOTS = int(_opt("INTERACTIVE_RESERVED_SLOTS", 4))
+RETRY_AFTER = int(_opt("RETRY_AFTER", 5))  # seconds, sent with 429 responses
+
+# ── STRATEGY ROUTING ──────────────────────────────────────────────────────
+# Per host, the strategy that last succeeded is tried first. URLs that failed every
+# strategy (and hosts with HOST_FAILURE_THRESHOLD such URLs in a row) are answered with
+# 502 for NEGATIVE_CACHE_TTL seconds without another attempt. 0 disables either part.
+ADAPTIVE_STRATEGY_ORDER = bool(_opt("ADAPTIVE_STRATEGY_ORDER", True))
+NEGATIVE_CACHE_TTL = float(_opt("NEGATIVE_CACHE_TTL", 900))  # seconds
+HOST_FAILURE_THRESHOLD = int(_opt("HOST_FAILURE_THRESHOLD", 5))
+
+# ── ARIA2 RPC ─────────────────────────────────────────────────────────────
+# With ARIA2_RPC on, the aria2c strategy submits downloads to one long-lived aria2c over
+# JSON-RPC (src/utils/aria2_rpc.py) instead of forking aria2c per request. ARIA2_RPC_URL
+# attaches to a daemon started elsewhere (e.g. shared with download_with_aria2.py);
+# empty starts and supervises one on localhost.
+ARIA2_RPC = bool(_opt("ARIA2_RPC", False))
+ARIA2_RPC_URL = _opt("ARIA2_RPC_URL", "") or None
+ARIA2_RPC_SECRET = _opt("ARIA2_RPC_SECRET", "") or None
+ARIA2_MAX_CONCURRENT = int(_opt("ARIA2_MAX_CONCURRENT", 16))
+ARIA2_MAX_DOWNLOAD_LIMIT = str(_opt("ARIA2_MAX_DOWNLOAD_LIMIT", "0"))  # bytes/s, K/M suffix; 0 = unlimited
+
+# ── DOI RESOLUTION ────────────────────────────────────────────────────────
+# Extra rules for POST /download/doi, tried before the built-in publisher table
+# (see src/server/doi_resolver.py). Each item: {name, prefixes: [...], templates: [...]}.
+DOI_RULES = list(_cfg.get("DOI_RULES") or [])
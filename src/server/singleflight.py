@@ -0,0 +1,98 @@
+"""
+Single-flight coalescing of concurrent identical work.
+
+The first caller for a key starts the work; every caller that arrives while it is still
+running waits on the same task and receives the same result. The work runs shielded, so a
+disconnecting client does not cancel it for the others.
+
+Results may own resources (e.g. a temp dir). ``on_release`` is called once the work has
+finished *and* the last caller has left its ``acquire`` block, whichever happens last.
+"""
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task, on_release: Optional[Callable[[Any], None]]):
+        self.task = task
+        self.on_release = on_release
+        self.refs = 0
+        self.released = False
+
+    def maybe_release(self):
+        if self.released or self.refs > 0 or not self.task.done():
+            return
+        self.released = True
+        if self.on_release is None or self.task.cancelled() or self.task.exception() is not None:
+            return
+        try:
+            self.on_release(self.task.result())
+        except Exception as e:
+            logger.warning("single-flight release hook failed: %s", e)
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights: dict[str, _Flight] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    def _finished(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        flight.maybe_release()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._flights
+
+    def _start(self, key: str, fn: Callable[[], Awaitable[Any]],
+               on_release: Optional[Callable[[Any], None]]) -> _Flight:
+        flight = _Flight(asyncio.ensure_future(fn()), on_release)
+        self._flights[key] = flight
+        flight.task.add_done_callback(lambda _t: self._finished(key, flight))
+        self.leaders += 1
+        return flight
+
+    def start(self, key: str, fn: Callable[[], Awaitable[Any]],
+              on_release: Optional[Callable[[Any], None]] = None) -> bool:
+        """Start ``fn`` as the flight for key without waiting for it; later ``acquire`` calls
+        join it. Returns False if a flight for key is already running."""
+        if key in self._flights:
+            return False
+        self._start(key, fn, on_release)
+        return True
+
+    @asynccontextmanager
+    async def acquire(self, key: str, fn: Callable[[], Awaitable[Any]],
+                      on_release: Optional[Callable[[Any], None]] = None, started: bool = False):
+        """Run ``fn`` once per key among concurrent callers and yield its result.
+        ``started`` marks a caller joining the flight it launched itself with ``start``."""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._start(key, fn, on_release)
+        elif not started:
+            self.coalesced += 1
+            logger.info("Coalesced request onto in-flight download: %s", key)
+        flight.refs += 1
+        try:
+            yield await asyncio.shield(flight.task)
+        finally:
+            flight.refs -= 1
+            flight.maybe_release()
+
+    def stats(self) -> dict:
+        total = self.leaders + self.coalesced
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "in_flight": self.in_flight,
+            "coalesced_ratio": (self.coalesced / total) if total else 0.0,
+        }
@@ -0,0 +1,103 @@
+"""
+Stream-through support for the download server.
+
+A StreamingDownload is a file that a background source (direct HTTP or aria2c) is still
+writing. Clients tail it with ``follow()`` while the same bytes land on disk, so the file
+can be validated and committed to the cache once the transfer finishes, and the client's
+time-to-first-byte is roughly the origin's.
+
+The first bytes are sniffed for ``%PDF`` before any reader is released; ``ready`` resolves
+to True (stream it) or False (not a PDF, caller falls back to the normal strategy chain).
+"""
+import asyncio
+import logging
+import os
+from typing import AsyncIterator, BinaryIO, Optional
+
+logger = logging.getLogger(__name__)
+
+PDF_MAGIC = b"%PDF"
+
+
+class StreamAborted(Exception):
+    """The upstream transfer failed after the client had started receiving bytes."""
+
+
+class StreamingDownload:
+    def __init__(self, path: str):
+        self.path = path
+        self.written = 0
+        self.content_length: Optional[int] = None
+        self.done = False
+        self.ok = False
+        self.ready: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._changed = asyncio.Event()
+
+    @property
+    def rejected(self) -> bool:
+        return self.ready.done() and not self.ready.result()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _sniff(self):
+        if self.ready.done() or (self.written < len(PDF_MAGIC) and not self.done):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                head = f.read(len(PDF_MAGIC))
+        except OSError:
+            head = b""
+        if not head.startswith(PDF_MAGIC):
+            logger.info("Stream sniff: not a PDF (%r), falling back: %s", head, self.path)
+        self.ready.set_result(head.startswith(PDF_MAGIC))
+
+    def advance(self, nbytes: int):
+        """Record that the source appended nbytes to the file."""
+        if nbytes <= 0:
+            return
+        self.written += nbytes
+        self._sniff()
+        self._notify()
+
+    def finish(self, ok: bool):
+        self.done = True
+        self.ok = ok
+        self._sniff()
+        self._notify()
+
+    async def follow(self, f: BinaryIO, chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+        """Yield the file's bytes as they are written. ``f`` is opened by the caller before the
+        response starts, so the data stays readable after the file is moved into the cache."""
+        pos = 0
+        try:
+            while True:
+                if pos < self.written:
+                    data = f.read(min(chunk_size, self.written - pos))
+                    if data:
+                        pos += len(data)
+                        yield data
+                        continue
+                if self.done:
+                    if not self.ok:
+                        raise StreamAborted(f"upstream transfer failed after {pos} bytes")
+                    return
+                changed = self._changed
+                await changed.wait()
+        finally:
+            f.close()
+
+
+def open_for_follow(live: StreamingDownload) -> Optional[BinaryIO]:
+    try:
+        return open(live.path, "rb")
+    except OSError:
+        return None
+
+
+def file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
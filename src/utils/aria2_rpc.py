@@ -0,0 +1,301 @@
+"""
+Long-lived aria2c driven over JSON-RPC, shared by src/download_server.py and
+src/post_process/download_with_aria2.py.
+
+Instead of forking aria2c per URL, one daemon (``--enable-rpc`` on 127.0.0.1) keeps its
+connection pools and schedules every download under global limits
+(``max-concurrent-downloads``, ``max-overall-download-limit``). Downloads are submitted
+with ``aria2.addUri``; a single poller queries all pending GIDs with one
+``system.multicall`` of ``aria2.tellStatus`` per interval and resolves their futures.
+
+Aria2Daemon either spawns and supervises its own aria2c (restarted if it dies; pending
+downloads then fail with Aria2RpcError) or, given ``url``, attaches to a daemon started
+elsewhere, so the server and the batch scripts can share one aria2c (an attached daemon
+keeps its own limits; set_limits() changes them explicitly)::
+
+    aria2 = Aria2Daemon(max_concurrent=16)
+    await aria2.start()
+    status = await aria2.download(url, "/data/pdfs", "a.pdf", timeout=60)
+    status["status"]  # complete, error or removed
+    await aria2.stop()
+"""
+import asyncio
+import logging
+import os
+import secrets
+import shutil
+import socket
+from typing import Optional
+
+import httpx
+
+from src.utils.proc_utils import kill_process_tree, new_group_kwargs
+
+logger = logging.getLogger(__name__)
+
+DONE_STATES = ("complete", "error", "removed")
+STATUS_KEYS = ["gid", "status", "totalLength", "completedLength", "downloadSpeed", "connections",
+               "errorCode", "errorMessage", "files"]
+
+
+class Aria2RpcError(Exception):
+    pass
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _str(value) -> str:
+    return str(value).lower() if isinstance(value, bool) else str(value)
+
+
+def _options(options: dict) -> dict:
+    # aria2 expects every option value as a string (a list of strings for repeatable ones like header)
+    return {k: [_str(x) for x in v] if isinstance(v, (list, tuple)) else _str(v)
+            for k, v in options.items() if v is not None}
+
+
+def flags_to_options(flags) -> dict:
+    """["--split=4", "--header=A: b", ...] → {"split": "4", "header": ["A: b"]} for addUri."""
+    options = {}
+    for flag in flags:
+        key, _, value = flag.lstrip("-").partition("=")
+        if key == "header":
+            options.setdefault("header", []).append(value)
+        else:
+            options[key] = value
+    return options
+
+
+class Aria2Daemon:
+    def __init__(self, url: Optional[str] = None, secret: Optional[str] = None, port: int = 0,
+                 max_concurrent: int = 16, max_download_limit: str = "0", options: Optional[dict] = None,
+                 poll_interval: float = 0.5, aria2_bin: Optional[str] = None):
+        self.url = url
+        self.secret = secret if secret is not None else (None if url else secrets.token_hex(16))
+        self.port = port
+        self.max_concurrent = max_concurrent
+        self.max_download_limit = max_download_limit
+        self.options = options or {}
+        self.poll_interval = poll_interval
+        self.aria2_bin = aria2_bin or shutil.which("aria2c")
+        self.restarts = 0
+        self._proc: Optional[asyncio.subprocess.Process] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._waiters: dict[str, asyncio.Future] = {}
+        self._last: dict[str, dict] = {}
+        self._poller: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    @property
+    def managed(self) -> bool:
+        """True when this object spawned (and supervises) the aria2c process."""
+        return self._proc is not None
+
+    # ── lifecycle ─────────────────────────────────────────────────────────
+    async def start(self, ready_timeout: float = 10):
+        self._stopping = False
+        self._client = httpx.AsyncClient(timeout=10)
+        if self.url is None:
+            if not self.aria2_bin:
+                await self._client.aclose()
+                raise Aria2RpcError("aria2c not found")
+            self.port = self.port or _free_port()
+            self.url = f"http://127.0.0.1:{self.port}/jsonrpc"
+            await self._spawn(ready_timeout)
+        else:
+            # an attached daemon is shared: its global limits are left to whoever started it
+            await self.call("aria2.getVersion")
+        self._poller = asyncio.create_task(self._poll_loop())
+
+    async def _spawn(self, ready_timeout: float):
+        cmd = [
+            self.aria2_bin,
+            "--enable-rpc=true",
+            "--rpc-listen-all=false",
+            f"--rpc-listen-port={self.port}",
+            f"--rpc-secret={self.secret}",
+            f"--max-concurrent-downloads={self.max_concurrent}",
+            f"--max-overall-download-limit={self.max_download_limit}",
+            # exits by itself if this process dies without calling stop()
+            f"--stop-with-process={os.getpid()}",
+            "--console-log-level=warn",
+            "--summary-interval=0",
+            *[f"--{k}={x}" for k, v in _options(self.options).items() for x in (v if isinstance(v, list) else [v])],
+        ]
+        self._proc = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL, **new_group_kwargs()
+        )
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + ready_timeout
+        while True:
+            try:
+                await self.call("aria2.getVersion")
+                logger.info("aria2c RPC daemon listening on %s (pid %s)", self.url, self._proc.pid)
+                return
+            except (httpx.TransportError, Aria2RpcError):
+                if self._proc.returncode is not None or loop.time() > deadline:
+                    self._kill()
+                    raise Aria2RpcError(f"aria2c RPC daemon did not start on {self.url}")
+                await asyncio.sleep(0.1)
+
+    def _kill(self):
+        if self._proc is not None and self._proc.returncode is None:
+            kill_process_tree(self._proc.pid)
+
+    async def stop(self):
+        self._stopping = True
+        if self._poller is not None:
+            self._poller.cancel()
+            try:
+                await self._poller
+            except asyncio.CancelledError:
+                pass
+            self._poller = None
+        self._fail_waiters(Aria2RpcError("aria2 daemon stopped"))
+        if self._proc is not None:
+            try:
+                await asyncio.wait_for(self.call("aria2.forceShutdown"), timeout=2)
+                await asyncio.wait_for(self._proc.wait(), timeout=5)
+            except Exception:
+                pass
+            self._kill()
+            await self._proc.wait()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # ── RPC ───────────────────────────────────────────────────────────────
+    async def call(self, method: str, *params):
+        if self._client is None:
+            raise Aria2RpcError("aria2 daemon not started")
+        if self.secret is not None and method != "system.multicall":
+            params = (f"token:{self.secret}",) + params
+        payload = {"jsonrpc": "2.0", "id": secrets.token_hex(4), "method": method, "params": list(params)}
+        r = await self._client.post(self.url, json=payload)
+        data = r.json()
+        if "error" in data:
+            raise Aria2RpcError(f"{method}: {data['error'].get('message')}")
+        return data.get("result")
+
+    async def multicall(self, calls: list[tuple]) -> list:
+        """[(method, *params), ...] in one round trip; a failed call yields an Aria2RpcError item."""
+        token = [f"token:{self.secret}"] if self.secret is not None else []
+        batch = [{"methodName": c[0], "params": token + list(c[1:])} for c in calls]
+        results = await self.call("system.multicall", batch)
+        return [r[0] if isinstance(r, list) else Aria2RpcError(r.get("faultString", "error")) for r in results]
+
+    async def set_limits(self, max_concurrent: Optional[int] = None, max_download_limit: Optional[str] = None):
+        """Change the global concurrency / bandwidth limits of the running daemon."""
+        changes = {}
+        if max_concurrent is not None:
+            self.max_concurrent = max_concurrent
+            changes["max-concurrent-downloads"] = max_concurrent
+        if max_download_limit is not None:
+            self.max_download_limit = max_download_limit
+            changes["max-overall-download-limit"] = max_download_limit
+        if changes:
+            await self.call("aria2.changeGlobalOption", _options(changes))
+
+    async def add_uri(self, url: str, directory: str, out: str, options: Optional[dict] = None) -> str:
+        opts = _options({**(options or {}), "dir": os.path.abspath(directory), "out": out})
+        return await self.call("aria2.addUri", [url], opts)
+
+    async def tell_status(self, gid: str) -> dict:
+        return await self.call("aria2.tellStatus", gid, STATUS_KEYS)
+
+    async def remove(self, gid: str):
+        try:
+            await self.call("aria2.forceRemove", gid)
+        except Exception:
+            pass
+        try:
+            # drop the stopped entry so it does not pile up in aria2's result list
+            await self.call("aria2.removeDownloadResult", gid)
+        except Exception:
+            pass
+
+    # ── completion ────────────────────────────────────────────────────────
+    async def wait(self, gid: str, timeout: Optional[float] = None) -> dict:
+        """Wait until the download stops (complete, error or removed) and return its status.
+        On timeout or cancellation the download is removed from aria2 before re-raising."""
+        fut = self._waiters.get(gid)
+        if fut is None:
+            fut = asyncio.get_running_loop().create_future()
+            self._waiters[gid] = fut
+        try:
+            return await asyncio.wait_for(asyncio.shield(fut), timeout)
+        except BaseException:
+            self._waiters.pop(gid, None)
+            self._last.pop(gid, None)
+            if not fut.done():
+                fut.cancel()
+            await asyncio.shield(self.remove(gid))
+            raise
+
+    async def download(self, url: str, directory: str, out: str, timeout: Optional[float] = None,
+                       options: Optional[dict] = None) -> dict:
+        gid = await self.add_uri(url, directory, out, options)
+        return await self.wait(gid, timeout)
+
+    def last_status(self, gid: str) -> Optional[dict]:
+        """Latest polled status of a pending download (None before the first poll)."""
+        return self._last.get(gid)
+
+    def _fail_waiters(self, exc: Exception):
+        waiters, self._waiters = self._waiters, {}
+        self._last = {}
+        for fut in waiters.values():
+            if not fut.done():
+                fut.set_exception(exc)
+
+    async def _poll_loop(self):
+        while not self._stopping:
+            await asyncio.sleep(self.poll_interval)
+            if self._proc is not None and self._proc.returncode is not None:
+                logger.warning("aria2c RPC daemon exited (rc=%s), restarting", self._proc.returncode)
+                self._fail_waiters(Aria2RpcError("aria2c exited"))
+                self.restarts += 1
+                try:
+                    await self._spawn(ready_timeout=10)
+                except Aria2RpcError as e:
+                    logger.error("%s", e)
+                continue
+            gids = list(self._waiters)
+            if not gids:
+                continue
+            try:
+                results = await self.multicall([("aria2.tellStatus", gid, STATUS_KEYS) for gid in gids])
+            except Exception as e:
+                logger.debug("aria2 status poll failed: %s", e)
+                continue
+            for gid, status in zip(gids, results):
+                fut = self._waiters.get(gid)
+                if fut is None or fut.done():
+                    continue
+                if isinstance(status, Exception):
+                    # unknown GID: removed by someone else or already purged
+                    status = {"gid": gid, "status": "removed", "errorMessage": str(status)}
+                self._last[gid] = status
+                if status.get("status") in DONE_STATES:
+                    self._waiters.pop(gid, None)
+                    self._last.pop(gid, None)
+                    fut.set_result(status)
+                    try:
+                        await self.call("aria2.removeDownloadResult", gid)
+                    except Exception:
+                        pass
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "managed": self.managed,
+            "pid": self._proc.pid if self._proc is not None else None,
+            "pending": len(self._waiters),
+            "restarts": self.restarts,
+            "max_concurrent": self.max_concurrent,
+            "max_download_limit": self.max_download_limit,
+        }
@@ -0,0 +1,107 @@
+"""
+Early-abort content sniffing for HTTP downloads that must yield a PDF.
+
+Feed the response body through a PdfSniffer before writing it. The first bytes are held
+back until they can be classified:
+
+- ``%PDF`` within the first SNIFF_BYTES (leading whitespace/junk is allowed, as readers do)
+  → accepted, whatever the Content-Type says (PDFs are often served as octet-stream);
+- an HTML or JSON signature, a text/html or JSON Content-Type on a body that does not open
+  with ``%PDF``, or SNIFF_BYTES without a PDF header → ContentMismatch is raised at once,
+  so the caller can close the connection instead of downloading a multi-megabyte
+  challenge page to disk.
+
+The exception's ``reason`` (html, json, not_pdf, empty) is suitable as a metric label.
+
+    sniffer = PdfSniffer(response.headers.get("content-type"))
+    for chunk in response.iter_content(64 * 1024):
+        f.write(sniffer.feed(chunk))
+    f.write(sniffer.finish())
+"""
+from typing import Optional
+
+PDF_MAGIC = b"%PDF"
+SNIFF_BYTES = 1024
+
+_BOMS = (b"\xef\xbb\xbf", b"\xff\xfe", b"\xfe\xff")
+
+
+class ContentMismatch(Exception):
+    def __init__(self, reason: str, detail: str = ""):
+        super().__init__(f"{reason}: {detail}" if detail else reason)
+        self.reason = reason
+
+
+def content_type_kind(content_type: Optional[str]) -> Optional[str]:
+    """pdf, html, json, other, or None when the header is missing."""
+    if not content_type:
+        return None
+    ctype = content_type.split(";", 1)[0].strip().lower()
+    if ctype in ("application/pdf", "application/x-pdf"):
+        return "pdf"
+    if ctype in ("text/html", "application/xhtml+xml"):
+        return "html"
+    if ctype == "application/json" or ctype.endswith("+json"):
+        return "json"
+    return "other"
+
+
+def classify_head(head: bytes) -> Optional[str]:
+    """pdf, html, json or not_pdf for the first bytes of a body; None if undecided yet.
+    ``%PDF`` counts only after whitespace or binary junk, never after markup, so a page that
+    merely mentions "%PDF" is still a page."""
+    pdf_at = head.find(PDF_MAGIC, 0, SNIFF_BYTES)
+    text = head[:pdf_at] if pdf_at >= 0 else head
+    for bom in _BOMS:
+        if text.startswith(bom):
+            text = text[len(bom):]
+            break
+    text = text.lstrip().lower()
+    if text.startswith(b"<") or b"<html" in text[:SNIFF_BYTES]:
+        return "html"
+    if text[:1] in (b"{", b"["):
+        return "json"
+    if pdf_at >= 0:
+        return "pdf"
+    if not text:
+        return None
+    if len(head) >= SNIFF_BYTES:
+        return "not_pdf"
+    # a PDF header may still follow some leading junk
+    return None
+
+
+class PdfSniffer:
+    def __init__(self, content_type: Optional[str] = None):
+        self.content_type = content_type
+        self.declared = content_type_kind(content_type)
+        self.accepted = False
+        self._head = b""
+
+    def _reject(self, kind: str):
+        raise ContentMismatch(kind, f"body is {kind} (Content-Type: {self.content_type or 'none'})")
+
+    def feed(self, chunk: bytes) -> bytes:
+        """Return the bytes that may be written now; raise ContentMismatch on a non-PDF body."""
+        if self.accepted:
+            return chunk
+        self._head += chunk
+        kind = classify_head(self._head)
+        if kind is None and self.declared in ("html", "json") and len(self._head.lstrip()) >= len(PDF_MAGIC):
+            # declared as a page and not starting with a PDF header: no need to wait for more
+            kind = self.declared
+        if kind is None:
+            return b""
+        if kind != "pdf":
+            self._reject(kind)
+        self.accepted = True
+        head, self._head = self._head, b""
+        return head
+
+    def finish(self) -> bytes:
+        """Call at end of body: returns any held-back bytes, or raises if no PDF header came."""
+        if self.accepted:
+            return b""
+        if not self._head.strip():
+            raise ContentMismatch("empty")
+        self._reject(classify_head(self._head) or "not_pdf")
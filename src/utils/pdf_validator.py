@@ -0,0 +1,98 @@
+"""
+Shared validation of downloaded PDFs, used by src/download_server.py and
+src/post_process/download_with_aria2.py.
+
+A file passes when, read through mmap (only the first and last pages are touched):
+
+- the ``%PDF-`` header is within the first HEAD_WINDOW bytes (readers allow leading junk);
+- ``%%EOF`` or ``startxref`` is within the last TAIL_WINDOW bytes, which catches transfers
+  cut off mid-file;
+- its size matches the expected Content-Length, when the caller knows it.
+
+Otherwise the reason is one of: missing, empty, size_mismatch, html, json, error_page,
+not_pdf, truncated, unreadable (suitable as a metric label).
+
+Verdicts are cached by (path, size, mtime), so checking the same unchanged file again is a
+stat call; callers validate the files they wrote in the current run rather than rescanning
+whole download directories.
+"""
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from src.utils.content_sniffer import classify_head
+
+PDF_HEADER = b"%PDF-"
+HEAD_WINDOW = 1024
+TAIL_WINDOW = 2048
+
+_ERROR_MARKERS = (b"internal server error", b"404 not found", b"403 forbidden", b"error")
+
+
+def _inspect(path: str, size: int) -> Optional[str]:
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        head = mm[:HEAD_WINDOW]
+        kind = classify_head(head)
+        if PDF_HEADER not in head or kind != "pdf":
+            if kind in ("html", "json"):
+                return kind
+            if any(marker in head.lower() for marker in _ERROR_MARKERS):
+                return "error_page"
+            return "not_pdf"
+        tail = mm[max(0, size - TAIL_WINDOW):]
+        if b"%%EOF" not in tail and b"startxref" not in tail:
+            return "truncated"
+    return None
+
+
+class PdfValidator:
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self._cache: OrderedDict[str, tuple] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, path: str, expected_size: Optional[int] = None) -> Optional[str]:
+        """None if path looks like a complete PDF, else the rejection reason."""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return "missing"
+        except OSError:
+            return "unreadable"
+        if st.st_size == 0:
+            return "empty"
+        if expected_size is not None and expected_size > 0 and st.st_size != expected_size:
+            return "size_mismatch"
+        key = os.path.abspath(path)
+        stamp = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] == stamp:
+                self._cache.move_to_end(key)
+                return cached[1]
+        try:
+            reason = _inspect(path, st.st_size)
+        except (OSError, ValueError):
+            return "unreadable"
+        with self._lock:
+            self._cache[key] = (stamp, reason)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return reason
+
+    def is_valid(self, path: str, expected_size: Optional[int] = None) -> bool:
+        return self.check(path, expected_size) is None
+
+
+_default = PdfValidator()
+
+
+def pdf_rejection_reason(path: str, expected_size: Optional[int] = None) -> Optional[str]:
+    return _default.check(path, expected_size)
+
+
+def is_valid_pdf(path: str, expected_size: Optional[int] = None) -> bool:
+    return _default.check(path, expected_size) is None
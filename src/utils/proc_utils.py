@@ -0,0 +1,63 @@
+"""
+Killable child processes.
+
+Downloaders such as aria2c and the Playwright script spawn their own children (Chromium
+starts a dozen). Killing only the direct child leaves those running, so commands started
+here get their own process group (session on POSIX, process group on Windows) and the
+whole tree is killed on timeout or cancellation.
+"""
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+
+# SIGKILL does not exist on Windows, where os.kill() with any other signal terminates the process
+_KILL_SIGNAL = getattr(signal, "SIGKILL", signal.SIGTERM)
+
+
+def new_group_kwargs() -> dict:
+    """Popen/create_subprocess_exec kwargs that put the child in its own process group."""
+    if sys.platform == "win32":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+
+def kill_process_tree(pid: int):
+    """Kill pid and everything in its process group. The child must have been started
+    with new_group_kwargs()."""
+    try:
+        if sys.platform == "win32":
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(pid)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        else:
+            os.killpg(pid, _KILL_SIGNAL)
+    except (ProcessLookupError, PermissionError, OSError):
+        pass
+
+
+def kill_pids(pids):
+    for pid in pids:
+        try:
+            os.kill(pid, _KILL_SIGNAL)
+        except (ProcessLookupError, PermissionError, OSError):
+            pass
+
+
+async def run_killable(cmd: list, timeout: float, reap_timeout: float = 5) -> tuple[int, bytes, bytes]:
+    """Run cmd without blocking the event loop. On timeout (asyncio.TimeoutError) or
+    cancellation the whole process tree is killed before the exception propagates; the
+    exit is awaited for at most ``reap_timeout`` seconds so the caller returns promptly."""
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, **new_group_kwargs()
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+    except BaseException:
+        kill_process_tree(proc.pid)
+        try:
+            await asyncio.wait_for(asyncio.shield(proc.wait()), timeout=reap_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+        raise
+    return proc.returncode, stdout, stderr